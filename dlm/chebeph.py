@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import math
+import numpy as np
+from hybrid import illinois
+
+# 压缩星历: 用切比雪夫多项式拟合太阳和月亮的视位置, 运行时只要 NumPy, 不用 Skyfield
+#
+# dlm.py 为了几天的太阳月亮位置要导入 Skyfield, 再加载 17 MB 的 de421.bsp.
+# 这里先离线用 Skyfield 算一遍 (build), 把太阳和月亮的地心视位置
+# (真赤道和真春分点坐标系, 也就是 radec(epoch='date') 的那个坐标系, 单位公里)
+# 按固定长度的时间段拟合成切比雪夫多项式, 每个天体的系数存成一个 .npy 文件,
+# 再加一个 JSON 文件记录时间范围, 段长和阶数.
+# 运行时 (ChebEphemeris) 用 mmap 打开系数文件, 只读到用到的那几段, 启动只要几毫秒.
+#
+# 拟合的是 x, y, z 三个分量而不是赤经赤纬, 这样赤经过 0 点不用特别处理.
+# 时间用 UT1 的 Julian date, UTC 跟它差不到 0.9 秒, 一般直接当 UT1 用就行.
+# 恒星时用 GMST 公式, 没有加章动的赤经项 (最多 1.2 秒), 对升落时间的影响在一秒左右.
+#
+# 生成系数文件 (要有 Skyfield 和 de421.bsp, 默认 2000 到 2050 年):
+#   python chebeph.py build
+# 自检 (要有 Skyfield):
+#   python chebeph.py check
+# 用法:
+#   eph = ChebEphemeris()
+#   ra, dec, distance = eph.radec('moon', jd)
+#   alt, az = eph.altaz('moon', jd, 34.4, -119.8)
+#   jd, rising = eph.risings_and_settings('moon', 34.4, -119.8, jd0, jd1)
+
+DLM_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PREFIX = os.path.join(DLM_DIR, 'chebeph')
+
+# 每个天体的段长 (天) 和多项式阶数, 拟合误差都在 0.01 角秒以下
+SEGMENTS = {
+    'sun': (16, 11),
+    'moon': (4, 12),
+}
+
+# 升落时天体中心的高度, 单位度, 跟 almanac.sunrise_sunset 和 almanac.risings_and_settings 一样
+HORIZONS = {
+    'sun': -0.8333,
+    'moon': -34.0 / 60.0,
+}
+
+EARTH_RADIUS = 6378.137  # 地球赤道半径, 公里
+EARTH_FLATTENING = 1 / 298.257223563
+J2000 = 2451545.0
+
+# ===== 离线生成 =====
+
+# 在时间段上拟合切比雪夫多项式
+#   sample: sample(jd 数组) 返回 (N, 3) 的数组, 天体的 x, y, z
+#   jd0, jd1: 起止时间, UT1 Julian date
+#   days, degree: 段长和阶数
+#   chunk: 一次算多少段, 免得一次采样太多内存不够
+# 返回 (段数, 3, degree + 1) 的系数数组
+def fit(sample, jd0, jd1, days, degree, chunk=500):
+    segments = int(math.ceil((jd1 - jd0) / days))
+    nodes = np.cos(np.pi * (np.arange(2 * (degree + 1)) + 0.5) / (2 * (degree + 1)))  # 切比雪夫节点, 取两倍
+    solve = np.linalg.pinv(np.polynomial.chebyshev.chebvander(nodes, degree))  # 最小二乘, 所有段共用
+    coef = np.empty((segments, 3, degree + 1))
+    for s0 in range(0, segments, chunk):
+        s1 = min(s0 + chunk, segments)
+        start = jd0 + np.arange(s0, s1) * days
+        jd = start[:, None] + (nodes[None, :] + 1) * days / 2  # (段, 节点)
+        xyz = sample(jd.ravel()).reshape(s1 - s0, nodes.size, 3)
+        coef[s0:s1] = np.einsum('kn,snc->sck', solve, xyz)
+    return coef
+
+# 用 Skyfield 生成系数文件
+#   planets: 加载的星历, 比如 load('de421.bsp')
+#   ts: Skyfield 的 timescale
+#   prefix: 输出文件名前缀, 生成 prefix.json, prefix-sun.npy, prefix-moon.npy
+#   year0, year1: 起止年份, 包括 year0 的 1 月 1 日, 不包括 year1 的
+#   dtype: 系数的类型, float32 就够了 (相对精度 6e-8, 月亮不到 0.03 公里)
+#   jd_range: (jd0, jd1), UT1 Julian date, 给了就不用 year0, year1, 只覆盖几天的星历 (比如测试用的) 用这个
+#   segments: 每个天体的段长和阶数, 默认见 SEGMENTS, 段长不能超过星历覆盖的时间
+def build(planets, ts, prefix=DEFAULT_PREFIX, year0=2000, year1=2050, dtype='float32', jd_range=None,
+        segments=SEGMENTS):
+    earth = planets['Earth']
+    jd0, jd1 = jd_range or (ts.utc(year0, 1, 1).ut1, ts.utc(year1, 1, 1).ut1)
+    header = {'time': 'UT1 Julian date', 'frame': 'geocentric apparent, true equator and equinox of date, km',
+            'year0': year0, 'year1': year1, 'jd0': jd0, 'jd1': jd1, 'bodies': {}}
+    for body, (days, degree) in segments.items():
+        target = planets[body]
+
+        def sample(jd):
+            ra, dec, distance = earth.at(ts.ut1_jd(jd)).observe(target).apparent().radec(epoch='date')
+            return np.stack(radec_to_xyz(ra.hours, dec.degrees, distance.km), axis=-1)
+
+        coef = fit(sample, jd0, jd1, days, degree).astype(dtype)
+        path = '%s-%s.npy' % (prefix, body)
+        np.save(path, coef)
+        header['bodies'][body] = {'file': os.path.basename(path), 'jd0': jd0, 'days': days,
+                'degree': degree, 'segments': coef.shape[0]}
+    with open(prefix + '.json', 'w') as f:
+        json.dump(header, f, indent=2)
+
+# ===== 运行时 =====
+
+# 赤经 (小时), 赤纬 (度), 距离转成 x, y, z
+def radec_to_xyz(ra, dec, distance):
+    ra, dec = np.radians(np.asarray(ra) * 15), np.radians(dec)
+    return distance * np.cos(dec) * np.cos(ra), distance * np.cos(dec) * np.sin(ra), distance * np.sin(dec)
+
+# x, y, z 转成 (赤经 (小时, 0 到 24), 赤纬 (度), 距离)
+def xyz_to_radec(x, y, z):
+    distance = np.sqrt(x * x + y * y + z * z)
+    ra = np.degrees(np.arctan2(y, x)) / 15 % 24
+    return ra, np.degrees(np.arcsin(z / distance)), distance
+
+# 格林尼治平恒星时, 单位度, IAU 1982 公式
+#   jd: UT1 Julian date
+def gmst(jd):
+    d = np.asarray(jd, dtype=float) - J2000
+    t = d / 36525
+    return (280.46061837 + 360.98564736629 * d + t * t * (0.000387933 - t / 38710000)) % 360
+
+# 观察点的地心位置在赤道坐标系里的 (x, y, z), 单位公里
+#   jd: UT1 Julian date
+#   lat, lon: 纬度, 经度, 单位度
+#   elevation: 海拔, 单位米
+def observer_xyz(jd, lat, lon, elevation=0):
+    la = np.radians(lat)
+    c = 1 / np.sqrt(np.cos(la) ** 2 + (1 - EARTH_FLATTENING) ** 2 * np.sin(la) ** 2)  # WGS84 椭球
+    s = (1 - EARTH_FLATTENING) ** 2 * c
+    h = np.asarray(elevation) / 1000
+    lst = np.radians(gmst(jd) + lon)  # 地方恒星时
+    r = (EARTH_RADIUS * c + h) * np.cos(la)
+    return r * np.cos(lst), r * np.sin(lst), (EARTH_RADIUS * s + h) * np.sin(la)
+
+class ChebEphemeris:
+    #   prefix: 系数文件名前缀, 见 build()
+    def __init__(self, prefix=DEFAULT_PREFIX):
+        with open(prefix + '.json') as f:
+            self.header = json.load(f)
+        self.coef = {}
+        for body, h in self.header['bodies'].items():
+            # mmap 打开, 不会把整个文件读进内存
+            self.coef[body] = np.load(os.path.join(os.path.dirname(prefix), h['file']), mmap_mode='r')
+
+    # 天体的地心视位置 (x, y, z), 单位公里
+    #   body: 'sun' 或 'moon'
+    #   jd: UT1 Julian date, 数或数组
+    def xyz(self, body, jd):
+        h = self.header['bodies'][body]
+        jd = np.asarray(jd, dtype=float)
+        if jd.size and (jd.min() < h['jd0'] or jd.max() > h['jd0'] + h['segments'] * h['days']):
+            raise ValueError("time out of range of the ephemeris, JD %.1f - %.1f" %
+                    (h['jd0'], h['jd0'] + h['segments'] * h['days']))
+        # 正好在最后一段的末尾时 floor 得到的是下一段, 用最后一段
+        s = np.minimum(np.floor((jd - h['jd0']) / h['days']).astype(int), h['segments'] - 1)
+        c = np.asarray(self.coef[body][s], dtype=float)  # (..., 3, degree + 1)
+        x = (2 * (jd - h['jd0'] - s * h['days']) / h['days'] - 1)[..., None]
+        # Clenshaw 递推求切比雪夫多项式的值
+        b1 = b2 = np.zeros(c.shape[:-1])
+        for k in range(c.shape[-1] - 1, 0, -1):
+            b1, b2 = 2 * x * b1 - b2 + c[..., k], b1
+        v = x * b1 - b2 + c[..., 0]
+        return v[..., 0], v[..., 1], v[..., 2]
+
+    # 天体的地心视赤经 (小时), 赤纬 (度), 距离 (公里)
+    def radec(self, body, jd):
+        return xyz_to_radec(*self.xyz(body, jd))
+
+    # 天体在观察点的高度角和方位角 (度), 用站心位置, 月亮的视差也算进去了, 不含大气折射
+    #   lat, lon: 观察点纬度, 经度, 单位度
+    #   elevation: 海拔, 单位米
+    def altaz(self, body, jd, lat, lon, elevation=0):
+        x, y, z = self.xyz(body, jd)
+        ox, oy, oz = observer_xyz(jd, lat, lon, elevation)
+        ra, dec, distance = xyz_to_radec(x - ox, y - oy, z - oz)
+        ha = np.radians(gmst(jd) + lon - ra * 15)  # 时角
+        dec, la = np.radians(dec), np.radians(lat)
+        alt = np.degrees(np.arcsin(np.sin(la) * np.sin(dec) + np.cos(la) * np.cos(dec) * np.cos(ha)))
+        az = np.degrees(np.arctan2(-np.cos(dec) * np.sin(ha),
+                np.sin(dec) * np.cos(la) - np.cos(dec) * np.sin(la) * np.cos(ha))) % 360
+        return alt, az
+
+    # 算 jd0 到 jd1 之间的升落时间
+    # 每小时算一次高度, 找出高度跨过地平线的小时, 再用 Illinois 法在这些小时里一起求解
+    #   body: 'sun' 或 'moon'
+    #   lat, lon: 观察点纬度, 经度, 单位度
+    #   jd0, jd1: 起止时间, UT1 Julian date
+    #   horizon: 升落时天体中心的高度, 单位度, 默认见 HORIZONS
+    #   epsilon: 精度, 单位秒
+    # 返回 (jd 数组, rising 数组), rising 取 True 时表示升起, 跟 almanac.find_discrete 的 y 一样
+    def risings_and_settings(self, body, lat, lon, jd0, jd1, horizon=None, epsilon=0.001):
+        if horizon is None:
+            horizon = HORIZONS[body]
+
+        def g(jd):
+            return self.altaz(body, jd, lat, lon)[0] - horizon
+
+        t = np.linspace(jd0, jd1, int(math.ceil((jd1 - jd0) * 24)) + 1)
+        f = g(t)
+        i = np.flatnonzero((f[:-1] <= 0) != (f[1:] <= 0))  # 这一小时里跨过了地平线
+        if i.size == 0:
+            return np.zeros(0), np.zeros(0, dtype=bool)
+        root, evals = illinois(g, t[i], t[i + 1], f[i], f[i + 1], epsilon / 86400)
+        return root, f[i] <= 0
+
+# 自检: 用 Skyfield 测试数据里只有几天的 de430-2015-03-02.bsp 生成一个临时的系数文件,
+# 跟 Skyfield 直接算的位置比, 包括范围的两端. 没有这个文件就跳过
+def check():
+    import tempfile
+    import skyfield
+    from skyfield.api import Loader
+    path = os.path.join(os.path.dirname(skyfield.__file__), 'tests', 'data', 'de430-2015-03-02.bsp')
+    if not os.path.exists(path):
+        print("no %s, check skipped" % path)
+        return
+    load = Loader(os.path.dirname(path), expire=False)
+    planets, ts = load(path), load.timescale(builtin=True)
+    jd0, jd1 = 2457082.0, 2457086.0  # 星历覆盖 JD 2457080.5 到 2457088.5, 两边留出光行时的余量
+    with tempfile.TemporaryDirectory() as d:
+        prefix = os.path.join(d, 'chebeph')
+        build(planets, ts, prefix, jd_range=(jd0, jd1), segments={'sun': (2, 11), 'moon': (1, 12)})
+        eph = ChebEphemeris(prefix)
+        jd = np.concatenate([[jd0, jd1], np.linspace(jd0, jd1, 97)])
+        for body in ('sun', 'moon'):
+            ra, dec, distance = eph.radec(body, jd)
+            ra0, dec0, distance0 = planets['Earth'].at(ts.ut1_jd(jd)).observe(planets[body]).apparent().radec(epoch='date')
+            dra = ((ra - ra0.hours + 12) % 24 - 12) * 15 * np.cos(np.radians(dec0.degrees))
+            err = np.hypot(dra, dec - dec0.degrees).max() * 3600
+            assert err < 0.1, (body, err)
+            print("%s: max error %.4f arcsec" % (body, err))
+        try:
+            eph.radec('sun', jd1 + 0.01)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("time after the range accepted")
+        del eph  # Windows 上 mmap 打开的文件删不掉
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['check']:
+        check()
+        print("check OK")
+        exit(0)
+
+    if sys.argv[1:2] == ['build']:
+        from skyfield.api import Loader
+        load = Loader(DLM_DIR, expire=False)
+        build(load('de421.bsp'), load.timescale(builtin=True))
+        exit(0)
+
+    # 跟 dlm.py 一样, UCSB 2020 年 3 月 10 日到 19 日 (太平洋时间) 的日出日落和月出月落
+    import datetime
+    import pytz
+    tz_ucsb = pytz.timezone('America/Los_Angeles')
+    d0 = tz_ucsb.localize(datetime.datetime(2020, 3, 10))
+    d1 = tz_ucsb.localize(datetime.datetime(2020, 3, 19))
+    jd0, jd1 = d0.timestamp() / 86400 + 2440587.5, d1.timestamp() / 86400 + 2440587.5
+    eph = ChebEphemeris()
+    for body, rise_name, set_name in (('sun', 'Sunrise', 'Sunset'), ('moon', 'Moonrise', 'Moonset')):
+        jd, rising = eph.risings_and_settings(body, 34.4, -119.8, jd0, jd1)
+        for j, r in zip(jd, rising):
+            d = datetime.datetime.fromtimestamp((j - 2440587.5) * 86400, tz_ucsb)
+            print(rise_name if r else set_name, "at: ", d.strftime('%c %Z'))
@@ -1,7 +1,20 @@
-from skyfield.api import Loader, Topos
-from skyfield import almanac  # 用来计算日出日落，月出月落
+from skyfield.api import Loader
+import os
+import sys
+import argparse
 import datetime
 import pytz
+from eventstore import rise_set_events, get_store
+from hybrid import hybrid_sunrise_sunset
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from instrument import span, register_cache  # 在 ../src 里, 见 instrument.py
+
+# 默认只输出升落时间, 都在事件存储里的话不用读 de421.bsp; 另外两段一定要读, 要的时候再加参数
+parser = argparse.ArgumentParser(description='Sun and Moon rising and setting at UCSB, March 10 to 19, 2020.')
+parser.add_argument('--hybrid', help='also find sunrise/sunset with hybrid.py, loads de421.bsp', action='store_true')
+parser.add_argument('--positions', help='also print the Sun and Moon altitude/azimuth, loads de421.bsp', action='store_true')
+args = parser.parse_args()
 
 # 先生成一个加载数据用的 loader，使用当前目录下已经下载的数据文件，
 # 而且不考虑文件可能太老的问题，所以可以离线情况下用
@@ -11,10 +24,23 @@ load = Loader('.', expire=False)
 # 加载时间数据，包括闰秒之类比较麻烦的东西
 # 这里也指定一下 builtin=True，直接用本地数据，不要试图从网上下
 # 不知道它跟前面 load 实例化时指定的 expire=False 是不是重了
-ts = load.timescale(builtin=True)
+with span('dlm.load_timescale'):
+    ts = load.timescale(builtin=True)
 
 # 加载行星数据
-planets = load('de421.bsp')
+# de421.bsp 有 16M, 第一次真要用的时候才加载: 日出日落月出月落都在事件存储里的话 (见 eventstore.py),
+# 不加 --hybrid 和 --positions 的时候根本不用读它
+_planets = None
+
+def get_planets():
+    global _planets
+    if _planets is None:
+        with span('dlm.load_de421'):
+            _planets = load('de421.bsp')
+    return _planets
+
+# 事件存储命中的天数和实际计算的天数
+register_cache('event store days', lambda: (get_store().stored_days, get_store().computed_days))
 
 # 用 pytz 整出个时区来
 tz_ucsb = pytz.timezone('America/Los_Angeles')
@@ -32,52 +58,39 @@ d1 = tz_ucsb.localize(d1_naive)
 t0 = ts.utc(d0)
 t1 = ts.utc(d1)
 
-# 观察点，UCSB 的经纬度
-ucsb = Topos(34.4, -119.8)
-
-# 算日出日落
-f = almanac.sunrise_sunset(planets, ucsb)  # f 应该是一个函数对象
-t, y = almanac.find_discrete(t0, t1, f)
+# 算出来的升落时间都存在事件存储里 (见 eventstore.py), 同一时间段再运行就不用重算了
 
-# y 是一个 numpy ndarray，跟 t 一样多元素，取值 True 时表示 t 里面对应日出时间，否则对应日落时间
+# 打印升落时间
+#   t, y: rise_set_events() 的返回值, y 取 True 时表示 t 里面对应升起时间, 否则对应落下时间
+def print_events(title, t, y, rise_name, set_name):
+    t_ucsb = t.astimezone(tz_ucsb)  # 转回 ucsb 本地时区，结果 t_ucsb 是一个 numpy 的 ndarray
+    print(title, d0.strftime('%c %Z'), " - ", d1.strftime('%c %Z'))
+    for i in range(t_ucsb.size):
+        if y[i]:
+            print(rise_name, "at: ", t_ucsb[i].strftime('%c %Z'))
+        else:
+            print(set_name, "at: ", t_ucsb[i].strftime('%c %Z'))
 
-t_ucsb = t.astimezone(tz_ucsb)     # 转回 ucsb 本地时区，结果 t_ucsb 是一个 numpy 的 ndarray
-print("========= Sun rising and setting ", d0.strftime('%c %Z'), " - ", d1.strftime('%c %Z'))
-for i in range(t_ucsb.size):
-    if y[i]:
-        print("Sunrise at: ", t_ucsb[i].strftime('%c %Z'))
-    else:
-        print("Sunset at: ", t_ucsb[i].strftime('%c %Z'))
+# 算日出日落
+with span('dlm.sun_events'):
+    t, y = rise_set_events(get_planets, ts, 'sun', 34.4, -119.8, t0, t1)
+print_events("========= Sun rising and setting ", t, y, "Sunrise", "Sunset")
 
 # 算月出月落
-moon = planets['Moon']
-f = almanac.risings_and_settings(planets, moon, ucsb)  # f 应该是一个函数对象
-t, y = almanac.find_discrete(t0, t1, f)
-
-# y 是一个 numpy ndarray，跟 t 一样多元素，取值 True 时表示 t 里面对应日出时间，否则对应日落时间
-
-t_ucsb = t.astimezone(tz_ucsb)  # 转回 ucsb 本地时区，结果 t_ucsb 是一个 numpy 的 ndarray
-print("========= Moon rising and setting ", d0.strftime('%c %Z'), " - ", d1.strftime('%c %Z'))
-for i in range(t_ucsb.size):
-    if y[i]:
-        print("Moonrise at: ", t_ucsb[i].strftime('%c %Z'))
-    else:
-        print("Moonset at: ", t_ucsb[i].strftime('%c %Z'))
+with span('dlm.moon_events'):
+    t, y = rise_set_events(get_planets, ts, 'moon', 34.4, -119.8, t0, t1)
+print_events("========= Moon rising and setting ", t, y, "Moonrise", "Moonset")
 
 # 算日出的另方法，这个方法肯定是没考虑到太阳是一个有大小的盘，当星星一样处理了
-sun = planets['Sun']
-f = almanac.risings_and_settings(planets, sun, ucsb)  # f 应该是一个函数对象
-t, y = almanac.find_discrete(t0, t1, f)
+t, y = rise_set_events(get_planets, ts, 'sun_point', 34.4, -119.8, t0, t1)
+print_events("********** Sun rising and setting ", t, y, "Sunrise", "Sunset")
 
-# y 是一个 numpy ndarray，跟 t 一样多元素，取值 True 时表示 t 里面对应日出时间，否则对应日落时间
-
-t_ucsb = t.astimezone(tz_ucsb)  # 转回 ucsb 本地时区，结果 t_ucsb 是一个 numpy 的 ndarray
-print("********** Sun rising and setting ", d0.strftime('%c %Z'), " - ", d1.strftime('%c %Z'))
-for i in range(t_ucsb.size):
-    if y[i]:
-        print("Moonrise at: ", t_ucsb[i].strftime('%c %Z'))
-    else:
-        print("Moonset at: ", t_ucsb[i].strftime('%c %Z'))
+# 用近似算法定位再用星历精确求解的日出日落, 结果应该跟上面第一种一样, 但星历计算次数少很多
+if args.hybrid:
+    with span('dlm.hybrid'):
+        t, y, evals = hybrid_sunrise_sunset(get_planets(), ts, 34.4, -119.8, t0, t1)
+    print_events("========= Sun rising and setting (hybrid) ", t, y, "Sunrise", "Sunset")
+    print("ephemeris evaluations per event:", evals.tolist())
 
 ########### 以上计算日出日落的方法见：
 ########### https://rhodesmill.org/skyfield/almanac.html
@@ -85,18 +98,25 @@ for i in range(t_ucsb.size):
 ########## 下面是计算视位置：方位角和高度角，见
 ########## https://rhodesmill.org/skyfield/positions.html
 
-earth = planets['Earth']
-ucsb_earth = earth + ucsb   # 必须转成明确在地球上，可能是换坐标系了吧
-apparent_t0_sun = ucsb_earth.at(t0).observe(sun).apparent()
-apparent_t0_moon = ucsb_earth.at(t0).observe(moon).apparent()
+if args.positions:
+    from skyfield.api import Topos
+
+    # 观察点，UCSB 的经纬度
+    ucsb = Topos(34.4, -119.8)
+
+    planets = get_planets()
+    sun, moon, earth = planets['Sun'], planets['Moon'], planets['Earth']
+    ucsb_earth = earth + ucsb   # 必须转成明确在地球上，可能是换坐标系了吧
+    apparent_t0_sun = ucsb_earth.at(t0).observe(sun).apparent()
+    apparent_t0_moon = ucsb_earth.at(t0).observe(moon).apparent()
 
-# 算太阳的
-alt, az, distance = apparent_t0_sun.altaz()    # 求方位角等
-print("Sun at %s, altitude=%s, azimuth=%s" % (d0.strftime('%c %Z'), alt.dstr(), az.dstr())) # 角度用字符串表示
-print("Sun at %s, altitude=%f, azimuth=%f" % (d0.strftime('%c %Z'), alt.degrees, az.degrees))  # 角度用浮点数表示
+    # 算太阳的
+    alt, az, distance = apparent_t0_sun.altaz()    # 求方位角等
+    print("Sun at %s, altitude=%s, azimuth=%s" % (d0.strftime('%c %Z'), alt.dstr(), az.dstr())) # 角度用字符串表示
+    print("Sun at %s, altitude=%f, azimuth=%f" % (d0.strftime('%c %Z'), alt.degrees, az.degrees))  # 角度用浮点数表示
 
-# 算地球的
-alt, az, distance = apparent_t0_moon.altaz()    # 求方位角等
-print("Moon at %s, altitude=%s, azimuth=%s" % (d0.strftime('%c %Z'), alt.dstr(), az.dstr()))
+    # 算地球的
+    alt, az, distance = apparent_t0_moon.altaz()    # 求方位角等
+    print("Moon at %s, altitude=%s, azimuth=%s" % (d0.strftime('%c %Z'), alt.dstr(), az.dstr()))
 
 
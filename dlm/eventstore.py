@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import math
+import sqlite3
+import numpy as np
+
+# 日出日落/月出月落搜索结果的持久存储
+#
+# almanac.find_discrete 很慢, 而 dlm.py 每次运行都在同一段时间上把同样的东西重算一遍.
+# 这里把算出来的事件存进一个 sqlite 文件, 以 (天体, 观察点, UTC 日期) 为键.
+# 以 UTC 整天 (MJD) 为单位记录哪些天已经算过了, 请求一个时间段时只算还没算过的那些天,
+# 连续的几天合并成一段交给 find_discrete, 结果存回去, 再和已有的一起返回.
+# 存的天数超过上限时, 按最近使用时间把最久没用过的天连同它们的事件一起删掉.
+#
+# 用法:
+#   t, y = rise_set_events(planets, ts, 'sun', 34.4, -119.8, t0, t1)
+# 返回值跟 almanac.find_discrete 一样: t 是 Skyfield 的 Time, y 取 True 时表示升起
+#
+# 星历可以传一个函数, 只有真要算的时候才调用它去加载, 全部命中存储时连 de421.bsp 都不用读:
+#   t, y = rise_set_events(get_planets, ts, 'sun', 34.4, -119.8, t0, t1)
+#
+# 自检 (要有 Skyfield):
+#   python eventstore.py check
+
+# 默认放在用户的缓存目录里 ($XDG_CACHE_HOME/ssac, 默认 ~/.cache/ssac), 不放在源码目录里, 那里可能是只读的
+DEFAULT_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')),
+        'ssac', 'events.sqlite')
+MJD_JD = 2400000.5  # MJD 0 对应的 Julian date
+
+# 支持的天体:
+#   sun: 日出日落, 考虑了太阳圆盘大小和大气折射
+#   moon: 月出月落
+#   sun_point: 把太阳当成一个点的升落, 跟 dlm.py 里第三种算法一样
+BODIES = ('sun', 'moon', 'sun_point')
+
+# 观察点经纬度保留的小数位数, 4 位大约 10 米
+OBSERVER_PRECISION = 4
+
+class EventStore:
+    #   path: sqlite 文件路径
+    #   max_days: 最多存多少个 (天体, 观察点, 日期), 超过了就淘汰最久没用过的
+    def __init__(self, path=DEFAULT_PATH, max_days=100000):
+        self.path = path
+        self.max_days = max_days
+        self.computed_days = 0  # 统计: 实际调用 find_discrete 算了多少天
+        self.stored_days = 0  # 统计: 直接用存储结果的天数
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS days (
+                body TEXT, lat REAL, lon REAL, day INTEGER, accessed REAL,
+                PRIMARY KEY (body, lat, lon, day));
+            CREATE INDEX IF NOT EXISTS days_accessed ON days (accessed);
+            CREATE TABLE IF NOT EXISTS events (
+                body TEXT, lat REAL, lon REAL, day INTEGER, tt REAL, rising INTEGER,
+                PRIMARY KEY (body, lat, lon, tt));
+            ''')
+
+    def close(self):
+        self.db.close()
+
+    # 返回 [day0, day1] 里已经算过的 UTC 日期 (MJD) 集合
+    def _stored_days(self, key, day0, day1):
+        rows = self.db.execute('SELECT day FROM days WHERE body=? AND lat=? AND lon=? AND day BETWEEN ? AND ?',
+                key + (day0, day1))
+        return {r[0] for r in rows}
+
+    # 取 [day0, day1] 这些 UTC 日期的事件, 没算过的天调用 compute 去算
+    #   key: (天体, 纬度, 经度)
+    #   day0, day1: 起止 UTC 日期, MJD 整数, 包括 day1
+    #   compute: compute(day_a, day_b) 返回 [day_a, day_b) 之间的事件 (tt 列表, ut1 列表, rising 列表)
+    #   tt0, tt1: 只返回这个 TT Julian date 范围内的事件
+    # 返回 (tt 列表, rising 列表), 按时间排序
+    def events(self, key, day0, day1, compute, tt0, tt1):
+        stored = self._stored_days(key, day0, day1)
+        self.stored_days += len(stored)
+        day = day0
+        while day <= day1:   # 找出连续的没算过的天, 一段一段地算
+            if day in stored:
+                day += 1
+                continue
+            end = day
+            while end + 1 <= day1 and end + 1 not in stored:
+                end += 1
+            tt, ut1, rising = compute(day, end + 1)
+            self.computed_days += end + 1 - day
+            # 事件所在的日期用 UT1 算, 淘汰某天时它的事件跟着一起删
+            self.db.executemany('INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)',
+                    [key + (math.floor(u - MJD_JD), t, int(r)) for t, u, r in zip(tt, ut1, rising)])
+            self.db.executemany('INSERT OR IGNORE INTO days VALUES (?, ?, ?, ?, 0)',
+                    [key + (d,) for d in range(day, end + 1)])
+            day = end + 1
+        self.db.execute('UPDATE days SET accessed=? WHERE body=? AND lat=? AND lon=? AND day BETWEEN ? AND ?',
+                (time.time(),) + key + (day0, day1))
+        rows = self.db.execute('''SELECT tt, rising FROM events WHERE body=? AND lat=? AND lon=?
+                AND tt >= ? AND tt < ? ORDER BY tt''', key + (tt0, tt1)).fetchall()
+        self._evict(key, day0, day1)  # 先取结果再淘汰
+        self.db.commit()
+        return [r[0] for r in rows], [bool(r[1]) for r in rows]
+
+    # 超过 max_days 时删掉最久没用过的那些天, 当前请求的 [day0, day1] 不删,
+    # 一次请求比 max_days 还长时存的天数会暂时超过上限
+    def _evict(self, key, day0, day1):
+        n = self.db.execute('SELECT COUNT(*) FROM days').fetchone()[0]
+        if n <= self.max_days:
+            return
+        old = self.db.execute('''SELECT body, lat, lon, day FROM days
+                WHERE NOT (body=? AND lat=? AND lon=? AND day BETWEEN ? AND ?)
+                ORDER BY accessed LIMIT ?''', key + (day0, day1, n - self.max_days)).fetchall()
+        self.db.executemany('DELETE FROM events WHERE body=? AND lat=? AND lon=? AND day=?', old)
+        self.db.executemany('DELETE FROM days WHERE body=? AND lat=? AND lon=? AND day=?', old)
+
+    # 清空所有存储
+    def clear(self):
+        self.db.execute('DELETE FROM events')
+        self.db.execute('DELETE FROM days')
+        self.db.commit()
+
+_store = None  # 默认存储, 第一次用的时候才打开
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = EventStore()
+    return _store
+
+# 生成 find_discrete 用的函数对象
+def event_function(planets, body, topos):
+    from skyfield import almanac
+    if body == 'sun':
+        return almanac.sunrise_sunset(planets, topos)
+    if body == 'moon':
+        return almanac.risings_and_settings(planets, planets['Moon'], topos)
+    if body == 'sun_point':
+        return almanac.risings_and_settings(planets, planets['Sun'], topos)
+    raise ValueError("unknown body %r, should be one of %s" % (body, ', '.join(BODIES)))
+
+# 算 t0 到 t1 之间某天体在观察点的升落时间, 结果会存下来, 重复的时间段不再重算
+#   planets: 加载的星历, 比如 load('de421.bsp'), 或者返回星历的函数, 要算的时候才调用
+#   ts: Skyfield 的 timescale
+#   body: 'sun', 'moon' 或 'sun_point', 见 BODIES
+#   lat, lon: 观察点纬度, 经度, 单位度
+#   t0, t1: 起止时间, Skyfield 的 Time
+#   store: 用哪个 EventStore, 默认用 get_store()
+# 返回值跟 almanac.find_discrete 一样: (Time, y), y 取 True 时表示升起
+def rise_set_events(planets, ts, body, lat, lon, t0, t1, store=None):
+    store = store or get_store()
+    lat, lon = round(float(lat), OBSERVER_PRECISION), round(float(lon), OBSERVER_PRECISION)  # Topos 不收整数
+    f = None  # find_discrete 用的函数, 第一次要算的时候才生成
+
+    def compute(day_a, day_b):  # 真正去算 [day_a, day_b) 这几个 UTC 整天
+        nonlocal f
+        from skyfield import almanac
+        from skyfield.api import Topos
+        if f is None:
+            f = event_function(planets() if callable(planets) else planets, body, Topos(lat, lon))
+        t, y = almanac.find_discrete(ts.utc(1858, 11, 17 + day_a), ts.utc(1858, 11, 17 + day_b), f)
+        return t.tt.tolist(), t.ut1.tolist(), y.tolist()
+
+    # 用 UT1 确定起止日期就够了, 它跟 UTC 最多差 0.9 秒, 两头各放宽 1 秒
+    day0 = math.floor(t0.ut1 - MJD_JD - 1 / 86400)
+    day1 = math.floor(t1.ut1 - MJD_JD + 1 / 86400)
+    tt, y = store.events((body, lat, lon), day0, day1, compute, t0.tt, t1.tt)
+    return ts.tt_jd(np.array(tt)), np.array(y, dtype=bool)
+
+# 自检: 用 Skyfield 测试数据里只有几天的 de430-2015-03-02.bsp, 在比 max_days 还长的时间段上
+# 跟 find_discrete 直接算的结果比, 第一次全要算, 第二次全在存储里, 再加一次部分重叠的.
+# 没有这个文件就跳过
+def check():
+    import tempfile
+    import skyfield
+    from skyfield import almanac
+    from skyfield.api import Loader, Topos
+    path = os.path.join(os.path.dirname(skyfield.__file__), 'tests', 'data', 'de430-2015-03-02.bsp')
+    if not os.path.exists(path):
+        print("no %s, check skipped" % path)
+        return
+    load = Loader(os.path.dirname(path), expire=False)
+    planets, ts = load(path), load.timescale(builtin=True)
+    lat, lon = 34.4, -119.8
+    f = almanac.sunrise_sunset(planets, Topos(lat, lon))
+    with tempfile.TemporaryDirectory() as d:
+        for max_days in (4, 5):
+            store = EventStore(os.path.join(d, 'events-%d.sqlite' % max_days), max_days=max_days)
+            # 星历覆盖 2015 年 3 月 1 日到 9 日, 存储按 UTC 整天算, 两头各留一天
+            for day0, day1 in ((2.3, 8.1), (2.3, 8.1), (3.5, 7.9), (2.0, 8.0)):
+                t0, t1 = ts.utc(2015, 3, day0), ts.utc(2015, 3, day1)
+                t, y = rise_set_events(planets, ts, 'sun', lat, lon, t0, t1, store)
+                t_ref, y_ref = almanac.find_discrete(t0, t1, f)
+                assert len(t) == len(t_ref) and (y == y_ref).all(), (max_days, day0, day1, len(t), len(t_ref))
+                assert np.abs(t.tt - t_ref.tt).max() * 86400 < 0.01
+            print("max_days %d: computed %d days, stored %d days" % (max_days, store.computed_days, store.stored_days))
+            store.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['check']:
+        check()
+        print("check OK")
@@ -0,0 +1,102 @@
+import os
+import sys
+import numpy as np
+
+# 用 sunclock.py 的近似算法给日出日落定位, 再用 Skyfield 星历精确求解
+#
+# almanac.find_discrete 要在整个时间段里密集采样, 星历计算次数很多.
+# sunclock.sun_rise_set 几乎不花时间就能把日出日落算到一两分钟以内,
+# 所以先用它给每个事件圈一个很窄的区间, 只在区间里用星历算太阳高度,
+# 用 Illinois 法 (改进的试位法) 求高度等于 -0.8333 度的时刻.
+# 所有事件同时迭代, 每次迭代只调用一次星历计算 (对一个 Time 数组).
+#
+# 用法:
+#   t, y, evals = hybrid_sunrise_sunset(planets, ts, 34.4, -119.8, t0, t1)
+# t, y 跟 almanac.find_discrete 的返回值一样, evals 是每个事件用了几次星历计算
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from sunclock import sun_rise_set
+
+J2000 = 2451545.0
+SUNRISE_ALTITUDE = -0.8333  # 跟 almanac.sunrise_sunset 一样, 考虑了太阳圆盘大小和大气折射
+
+# 用 Illinois 法在 [a, b] 里求 g(t) = 0, 所有区间一起算
+#   g: g(t 数组) 返回同样大小的数组, t 是 UT1 Julian date
+#   a, b: 区间两端, g(a) 和 g(b) 必须异号
+#   fa, fb: g(a), g(b)
+#   epsilon: 区间小于这个值 (天) 就停止
+# 返回 (根, 每个根用的 g 计算次数)
+def illinois(g, a, b, fa, fb, epsilon, max_iter=50):
+    a, b, fa, fb = a.copy(), b.copy(), fa.copy(), fb.copy()
+    evals = np.zeros(a.shape, dtype=int)
+    active = np.abs(b - a) > epsilon
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        i = np.flatnonzero(active)
+        c = b[i] - fb[i] * (b[i] - a[i]) / (fb[i] - fa[i])
+        fc = g(c)
+        evals[i] += 1
+        other_side = fc * fb[i] < 0  # 根在 b 和 c 之间, b 变成新的 a
+        a[i] = np.where(other_side, b[i], a[i])
+        fa[i] = np.where(other_side, fb[i], fa[i] / 2)  # 同一侧时把 fa 减半, 避免一端不动
+        b[i], fb[i] = c, fc
+        active[i] = (np.abs(b[i] - a[i]) > epsilon) & (fc != 0)
+    return b, evals
+
+# 用近似算法定位, 星历精确求解 t0 到 t1 之间的日出日落
+#   planets: 加载的星历, 比如 load('de421.bsp')
+#   ts: Skyfield 的 timescale
+#   lat, lon: 观察点纬度, 经度, 单位度
+#   t0, t1: 起止时间, Skyfield 的 Time
+#   bracket: 近似时间两边各放多少分钟作为初始区间, 区间里找不到就加倍, 最多加倍 4 次
+#   epsilon: 精度, 单位秒, 默认跟 find_discrete 一样是 1 毫秒
+# 返回 (t, y, evals):
+#   t: 日出日落时间, Skyfield 的 Time
+#   y: numpy 的 bool 数组, True 表示日出, False 表示日落
+#   evals: numpy 的 int 数组, 每个事件用的星历计算次数, 包括初始区间两端的计算
+def hybrid_sunrise_sunset(planets, ts, lat, lon, t0, t1, bracket=5, epsilon=0.001):
+    from skyfield.api import Topos  # 在这里才导入, chebeph.py 只用 illinois() 的时候不用装 Skyfield
+    observer = planets['Earth'] + Topos(float(lat), float(lon))  # Topos 不收整数
+    sun = planets['Sun']
+
+    def g(jd):  # 太阳高度减去日出高度, 单位度
+        alt = observer.at(ts.ut1_jd(jd)).observe(sun).apparent().altaz()[0]
+        return alt.degrees - SUNRISE_ALTITUDE
+
+    # 近似的日出日落时间, 两头各多算一天免得漏掉
+    guess, rising = [], []
+    for n in range(int(np.floor(t0.ut1 - J2000)) - 1, int(np.ceil(t1.ut1 - J2000)) + 2):
+        try:
+            jt, ha, dec = sun_rise_set(n, lon, lat)
+        except ValueError:  # 极昼或极夜, 近似算法没有日出日落
+            continue
+        guess += [jt - ha, jt + ha]
+        rising += [True, False]
+    guess, rising = np.array(guess), np.array(rising, dtype=bool)
+    if guess.size == 0:
+        return ts.ut1_jd(guess), rising, np.zeros(0, dtype=int)
+
+    # 初始区间, 两端高度必须异号, 不是的话把区间加倍
+    w = np.full(guess.shape, bracket / 1440)
+    a, b = guess - w, guess + w
+    fa, fb = g(a), g(b)
+    evals = np.full(guess.shape, 2)
+    for _ in range(4):
+        bad = np.flatnonzero(fa * fb > 0)
+        if bad.size == 0:
+            break
+        w[bad] *= 2
+        a[bad], b[bad] = guess[bad] - w[bad], guess[bad] + w[bad]
+        fa[bad], fb[bad] = g(a[bad]), g(b[bad])
+        evals[bad] += 2
+    found = fa * fb <= 0  # 还找不到的一般是接近极昼极夜的日子, 放弃
+    a, b, fa, fb = a[found], b[found], fa[found], fb[found]
+    rising, evals = rising[found], evals[found]
+
+    root, iters = illinois(g, a, b, fa, fb, epsilon / 86400)
+    evals += iters
+    t = ts.ut1_jd(root)
+    inside = (t.tt >= t0.tt) & (t.tt < t1.tt)  # 只要 t0 到 t1 之间的
+    order = np.argsort(root[inside])
+    return ts.ut1_jd(root[inside][order]), rising[inside][order], evals[inside][order]
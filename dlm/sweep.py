@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from sunmodel import select_model, models
+
+# 近似算法跟 DE421 的精度对比: 在全球网格上, 把每个格点很多年的日出日落都算一遍
+#
+# 每个格点 (纬度, 经度) 是一个任务, 分给进程池里的进程去算.
+# 每个进程启动时 (init_worker) 加载一次星历, 之后的任务都用它.
+# 任务里先用 sunmodel.py 的模型 (默认 simple, 也就是 sunclock.py) 算出每天的日出日落,
+# 再用 almanac.find_discrete 在星历上直接搜出准确的, 按时间把两边的事件一一对上, 统计误差.
+# 参照不能用 hybrid.py: 它是用 sunclock.py 定位的, 模型认为是极昼极夜的日子它就跳过,
+# 跟模型有同样的盲区, 高纬度漏掉的事件就查不出来了.
+# 模型说有日出日落但星历没有的 (或者反过来), 记为 missed, 一般出现在极昼极夜附近.
+#
+# 结果存成 npz, 每个统计量是一个 (纬度数, 经度数) 的数组, 可以直接当热力图画,
+# 另外按纬度打印一个表, 给出误差在容许范围内的最大纬度, 前端限制纬度时可以参考.
+#
+# 用法 (要有 Skyfield 和 de421.bsp):
+#   python sweep.py --lat-max 72 --lat-step 3 --lon-step 30 --years 2000 2040 --year-step 10 -o sweep.npz
+#   python sweep.py --model noaa --tolerance 120
+#   python sweep.py check    # 自检, 见 check()
+
+DLM_DIR = os.path.dirname(os.path.abspath(__file__))
+J2000 = 2451545.0
+MATCH_WINDOW = 3 / 24  # 模型和星历的事件相差 3 小时以内才算同一个事件
+
+# 统计量, 每个都是 (纬度数, 经度数) 的数组
+STATS = ['events', 'missed', 'rise_max', 'rise_rms', 'rise_bias', 'set_max', 'set_rms', 'set_bias']
+
+_ephemeris = None  # 进程里的 (planets, ts), 见 init_worker()
+
+# 进程池的 initializer, 每个进程只加载一次星历
+def init_worker(data_dir=DLM_DIR):
+    global _ephemeris
+    from skyfield.api import Loader
+    load = Loader(data_dir, expire=False)
+    _ephemeris = (load('de421.bsp'), load.timescale(builtin=True))
+
+# 星历算出的 jd0 到 jd1 (UT1) 之间的日出日落, 返回 (jd 数组, rising 数组)
+# 用 find_discrete 整段采样搜索, 不依赖任何近似模型
+def reference_events(lat, lon, jd0, jd1):
+    from skyfield import almanac
+    from skyfield.api import Topos
+    planets, ts = _ephemeris
+    f = almanac.sunrise_sunset(planets, Topos(float(lat), float(lon)))  # Topos 不收整数
+    t, y = almanac.find_discrete(ts.ut1_jd(jd0), ts.ut1_jd(jd1), f)
+    return t.ut1, np.asarray(y, dtype=bool)
+
+# 模型算出的 jd0 到 jd1 之间的日出日落, 返回 (jd 数组, rising 数组)
+#   model: sunmodel.SolarModel
+def model_events(model, lat, lon, jd0, jd1):
+    jd, rising = [], []
+    for n in range(int(np.floor(jd0 - J2000)) - 1, int(np.ceil(jd1 - J2000)) + 2):
+        try:
+            jt, ha, dec = model.sun_rise_set(n, lon, lat)
+        except ValueError:  # 极昼或极夜
+            continue
+        jd += [jt - ha, jt + ha]
+        rising += [True, False]
+    jd, rising = np.array(jd), np.array(rising, dtype=bool)
+    inside = (jd >= jd0) & (jd < jd1)
+    return jd[inside], rising[inside]
+
+# 把模型的事件和星历的事件按时间对上
+# 两边的事件都要比 jd0 到 jd1 两头各多算 MATCH_WINDOW, 这样边界附近的事件也能对上,
+# 只统计 jd0 到 jd1 之间的事件
+# 返回 (误差数组 (秒, 模型减星历), 对上的事件是不是日出, 没对上的事件个数)
+def match(jd, rising, ref_jd, ref_rising, jd0, jd1):
+    errors, kinds, missed = [], [], 0
+    for kind in (True, False):
+        a, b = np.sort(jd[rising == kind]), np.sort(ref_jd[ref_rising == kind])
+        if b.size == 0:
+            missed += ((a >= jd0) & (a < jd1)).sum()
+            continue
+        i = np.searchsorted(b, a)
+        before, after = b[np.clip(i - 1, 0, b.size - 1)], b[np.clip(i, 0, b.size - 1)]
+        nearest = np.where(np.abs(a - before) < np.abs(a - after), before, after)
+        close = np.abs(a - nearest) < MATCH_WINDOW
+        inside = (a >= jd0) & (a < jd1)
+        ok = close & inside
+        errors.append((a[ok] - nearest[ok]) * 86400)
+        kinds.append(np.full(ok.sum(), kind))
+        b_inside = b[(b >= jd0) & (b < jd1)]
+        missed += (inside.sum() - ok.sum()) + np.setdiff1d(b_inside, nearest[close]).size  # 两边没对上的
+    if not errors:  # 星历两种事件都没有, 比如极昼极夜的整年
+        return np.empty(0), np.empty(0, dtype=bool), missed
+    return np.concatenate(errors), np.concatenate(kinds), missed
+
+# 任务: 算一个格点的统计量, 返回 (i, j, 统计量 dict)
+#   i, j: 格点在结果数组里的下标
+#   years: 要算的年份列表, 每年整年都算
+#   model_name: sunmodel.py 里模型的名字
+def run_cell(i, j, lat, lon, years, model_name):
+    model = select_model(model_name)
+    errors, kinds, missed = [], [], 0
+    for year in years:
+        jd0 = J2000 - 0.5 + (np.datetime64('%d-01-01' % year) - np.datetime64('2000-01-01')).astype(int)
+        jd1 = J2000 - 0.5 + (np.datetime64('%d-01-01' % (year + 1)) - np.datetime64('2000-01-01')).astype(int)
+        e, k, m = match(*model_events(model, lat, lon, jd0 - MATCH_WINDOW, jd1 + MATCH_WINDOW),
+                *reference_events(lat, lon, jd0 - MATCH_WINDOW, jd1 + MATCH_WINDOW), jd0, jd1)
+        errors.append(e)
+        kinds.append(k)
+        missed += m
+    e, k = np.concatenate(errors), np.concatenate(kinds)
+    stats = {'events': e.size, 'missed': missed}
+    for name, sel in (('rise', k), ('set', ~k)):
+        v = e[sel]
+        stats[name + '_max'] = np.abs(v).max() if v.size else np.nan
+        stats[name + '_rms'] = np.sqrt(np.mean(v * v)) if v.size else np.nan
+        stats[name + '_bias'] = v.mean() if v.size else np.nan
+    return i, j, stats
+
+# 在网格上跑一遍, 返回结果 dict, 包括 lat, lon, years 和 STATS 里的每个数组
+#   lats, lons: 网格的纬度, 经度列表
+#   workers: 进程数, 默认是 CPU 个数
+#   initializer: 进程的初始化函数, 默认 init_worker
+def sweep(lats, lons, years, model_name='simple', workers=None, initializer=init_worker,
+        progress=sys.stderr):
+    result = {name: np.full((len(lats), len(lons)), np.nan) for name in STATS}
+    t_start = time.time()
+    with ProcessPoolExecutor(workers or os.cpu_count(), initializer=initializer) as pool:
+        futures = [pool.submit(run_cell, i, j, lat, lon, years, model_name)
+                for i, lat in enumerate(lats) for j, lon in enumerate(lons)]
+        for done, f in enumerate(as_completed(futures), 1):
+            i, j, stats = f.result()
+            for name, v in stats.items():
+                result[name][i, j] = v
+            if progress and (done % 10 == 0 or done == len(futures)):
+                print("cells done: %d/%d, %.1f s" % (done, len(futures), time.time() - t_start),
+                        file=progress, flush=True)
+    result.update({'lat': np.array(lats), 'lon': np.array(lons), 'years': np.array(years)})
+    return result
+
+# 按纬度打印报告, 给出误差都在 tolerance (秒) 以内并且没有漏掉事件的最大纬度
+def report(result, tolerance, f=sys.stdout):
+    print("lat      events  missed  rise max/rms (s)   set max/rms (s)", file=f)
+    ok = []
+    for i, lat in enumerate(result['lat']):
+        worst = max(np.nanmax(result['rise_max'][i]), np.nanmax(result['set_max'][i]))
+        missed = int(np.nansum(result['missed'][i]))
+        print("%6.1f %8d %7d %9.1f / %-7.1f %9.1f / %-7.1f" % (lat, np.nansum(result['events'][i]), missed,
+                np.nanmax(result['rise_max'][i]), np.nanmax(result['rise_rms'][i]),
+                np.nanmax(result['set_max'][i]), np.nanmax(result['set_rms'][i])), file=f)
+        if worst <= tolerance and missed == 0:
+            ok.append(abs(lat))
+    bad = [abs(lat) for lat in result['lat'] if abs(lat) not in ok]
+    safe = max([a for a in ok if not any(b <= a for b in bad)], default=None)
+    if safe is None:
+        print("no latitude is within %g s" % tolerance, file=f)
+    else:
+        print("within %g s and no missed event up to latitude +-%g" % (tolerance, safe), file=f)
+
+# 自检: 极昼极夜里星历一个事件都没有的时候 match() 和 run_cell() 也要能出结果
+# run_cell() 的部分要有 de421.bsp, 没有就跳过
+def check(data_dir=DLM_DIR):
+    jd0 = J2000 + 160  # 2000 年 6 月, 北极圈里是极昼
+    jd1 = jd0 + 30
+    e, k, m = match(np.empty(0), np.empty(0, dtype=bool), np.empty(0), np.empty(0, dtype=bool), jd0, jd1)
+    assert e.size == 0 and k.dtype == bool and m == 0
+    e, k, m = match(np.array([jd0 + 1.2, jd0 + 1.7]), np.array([True, False]),
+            np.empty(0), np.empty(0, dtype=bool), jd0, jd1)
+    assert e.size == 0 and m == 2  # 模型有, 星历没有, 都算 missed
+    if not os.path.exists(os.path.join(data_dir, 'de421.bsp')):
+        print("no de421.bsp, run_cell() of a polar cell skipped")
+        return
+    init_worker(data_dir)
+    for lat in (85, -85):  # 一年里有极昼, 极夜, 也有正常日出日落的格点
+        i, j, stats = run_cell(0, 0, lat, 0, [2020], 'simple')
+        assert stats['events'] > 0 and stats['missed'] >= 0, stats
+        print("lat %g: %d events, %d missed, rise max %.1f s" % (lat, stats['events'], stats['missed'], stats['rise_max']))
+    e, k, m = match(*model_events(select_model('simple'), 89.9, 0, jd0, jd1),
+            *reference_events(89.9, 0, jd0, jd1), jd0, jd1)  # 一个月的极昼, 两边都没有事件
+    assert e.size == 0 and m == 0
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['check']:
+        check()
+        print("check OK")
+        exit(0)
+
+    parser = argparse.ArgumentParser(description='Accuracy sweep of a solar model against DE421.')
+    parser.add_argument('--model', help='model to check, see sunmodel.py', choices=[m.name for m in models], default='simple')
+    parser.add_argument('--lat-max', help='largest latitude of the grid (default 72)', type=float, default=72)
+    parser.add_argument('--lat-step', help='latitude step (default 3)', type=float, default=3)
+    parser.add_argument('--lon-step', help='longitude step (default 30)', type=float, default=30)
+    parser.add_argument('--years', help='first and last year (default 2000 2040)', type=int, nargs=2, default=[2000, 2040])
+    parser.add_argument('--year-step', help='years between the checked years (default 10)', type=int, default=10)
+    parser.add_argument('--tolerance', help='acceptable error in seconds for the report (default 300)', type=float, default=300)
+    parser.add_argument('-j', '--workers', help='number of worker processes', type=int, default=None)
+    parser.add_argument('-o', '--out', help='npz file to save the statistics to', default='sweep.npz')
+    args = parser.parse_args()
+
+    lats = np.arange(-args.lat_max, args.lat_max + args.lat_step / 2, args.lat_step).round(6).tolist()
+    lons = np.arange(-180, 180, args.lon_step).round(6).tolist()
+    years = list(range(args.years[0], args.years[1] + 1, args.year_step))
+    result = sweep(lats, lons, years, args.model, args.workers)
+    np.savez_compressed(args.out, **result)
+    report(result, args.tolerance)
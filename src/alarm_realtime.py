@@ -0,0 +1,190 @@
+import sys
+import sched
+import time
+import datetime
+from sunjulian import day_number, jd_to_unix
+from suncache import cached_sun_rise_set
+from tzresolve import localize
+from instrument import span
+
+# Real-time mode of the terminal alarm clock, see alarm_simple1.py --realtime
+#
+# Instead of redrawing every few milliseconds, a scheduler sleeps until the next
+# time something on the screen can change: the next second boundary, sunrise,
+# sunset or local midnight. Sunrise/sunset of a day is calculated the first time
+# the day is needed, and only the terminal cells whose contents changed are written,
+# all of them when the reverse video attribute changes.
+#
+# Self check of the screen updates:
+#   python alarm_realtime.py check
+
+ROWS = 3  # screen rows of the clock
+
+# The clock rows on the terminal, below the cursor position at creation
+# Only the cells different from what is on the terminal are written.
+class Screen:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.lines = [''] * ROWS  # what is on the terminal now
+        self.widths = [0] * ROWS  # cells of every row written so far, blanks past the line included
+        self.reverse = None  # reverse video attribute of what is on the terminal
+        # hide cursor, save position with CSI s, not ESC 7 which saves the graphic attributes too,
+        # restoring those would undo the reverse video before every write
+        out.write('\033[?25l' + '\n' * ROWS + '\033[%dA' % ROWS + '\033[s')
+        out.flush()
+
+    # Show the lines, reverse: whether to show them in reverse video
+    def show(self, lines, reverse):
+        out = []
+        full = reverse != self.reverse  # attribute changed, every cell must be written again, spaces too
+        if full:
+            out.append('\033[7m' if reverse else '\033[0m')
+            self.reverse = reverse
+        for row, (old, new) in enumerate(zip(self.lines, lines)):
+            width = max(len(old), len(new), self.widths[row] if full else 0)
+            self.widths[row] = max(self.widths[row], width)
+            old, new = old.ljust(width), new.ljust(width)
+            col = 0
+            while col < width:
+                if old[col] == new[col] and not full:
+                    col += 1
+                    continue
+                end = width if full else col
+                while end < width and old[end] != new[end]:
+                    end += 1
+                # restore the saved position, move down to the row and right to the column
+                out.append('\033[u' + ('\033[%dB' % row if row else '') + '\033[%dG' % (col + 1) + new[col:end])
+                col = end
+        self.lines = list(lines)
+        if out:
+            self.out.write(''.join(out))
+            self.out.flush()
+
+    # Leave the cursor below the clock, clear attributes and show the cursor again
+    def close(self):
+        self.out.write('\033[u\033[%dB\033[0m\n\033[?25h' % ROWS)
+        self.out.flush()
+
+# The real-time alarm clock of an observer
+class RealtimeClock:
+    #   tz: timezone of the observer, see tzresolve.get_timezone()
+    #   lat, lon: observer latitude/longitude
+    #   sun_rise_set: function like suncache.cached_sun_rise_set(), like snapshot.Snapshot.sun_rise_set
+    def __init__(self, tz, lat, lon, sun_rise_set=cached_sun_rise_set):
+        self.tz, self.lat, self.lon = tz, lat, lon
+        self.sun_rise_set = sun_rise_set
+        self.days = {}  # local date -> (sunrise, sunset) as POSIX timestamps, filled lazily
+
+    # Return (sunrise, sunset) of a local date as POSIX timestamps
+    def sun_of(self, date):
+        if date not in self.days:
+            n = day_number(localize(self.tz, date.year, date.month, date.day))
+            jt, ha, dec = self.sun_rise_set(n, self.lon, self.lat)
+            self.days = {d: v for d, v in self.days.items() if d >= date - datetime.timedelta(days=1)}
+            self.days[date] = (jd_to_unix(jt - ha), jd_to_unix(jt + ha))
+        return self.days[date]
+
+    # Return the screen lines at a time and whether the Sun is up
+    #   now: POSIX timestamp
+    def lines(self, now):
+        d_now = datetime.datetime.fromtimestamp(int(now), self.tz)
+        rise, sets = self.sun_of(d_now.date())
+        if now >= rise:   # today's sunrise has passed, show next sunrise
+            rise = self.sun_of(d_now.date() + datetime.timedelta(days=1))[0]
+        d_rise = datetime.datetime.fromtimestamp(round(rise), self.tz)
+        countdown = datetime.timedelta(seconds=round(rise) - int(now))
+        return ([d_now.strftime("      Current time: %m/%d/%Y %H:%M:%S"),
+                d_rise.strftime("      Next sunrise: %m/%d/%Y %H:%M:%S"),
+                " Sunrise countdown: %s" % countdown],
+                self.sun_of(d_now.date())[0] <= now < sets)
+
+    # Return the time of the next display change or solar event after now
+    def next_change(self, now):
+        d_now = datetime.datetime.fromtimestamp(now, self.tz)
+        tomorrow = d_now.date() + datetime.timedelta(days=1)
+        midnight = localize(self.tz, tomorrow.year, tomorrow.month, tomorrow.day, hour=0).timestamp()
+        rise, sets = self.sun_of(d_now.date())
+        return min(t for t in (int(now) + 1, rise, sets, midnight) if t > now)
+
+    # Run the clock until Control-C is pressed
+    #   started: function called when the first frame is shown, the clock stops when it returns True
+    def run(self, screen, started=None):
+        s = sched.scheduler(time.time, time.sleep)
+
+        def step():
+            now = time.time()
+            with span('alarm.realtime_step'):
+                screen.show(*self.lines(now))
+            s.enterabs(self.next_change(now), 0, step)
+
+        step()
+        if started is not None and started():
+            screen.close()
+            return
+        try:
+            s.run()
+        except KeyboardInterrupt:  # Control-C pressed, recover the display
+            screen.close()
+
+# Replay what a Screen wrote on a small terminal model, return the rows as lists of
+# (character, reverse) cells, only the escape sequences Screen writes are understood
+def replay(text, width=40):
+    import re
+    cells = [[(' ', False)] * width for _ in range(ROWS + 1)]
+    row = col = saved_row = saved_col = 0
+    reverse = False
+    for m in re.finditer(r'\033\[(\??)(\d*)([A-Za-z])|\n|.', text):
+        if m.group(0) == '\n':
+            row, col = min(row + 1, ROWS), 0
+        elif m.group(3) is None:
+            cells[row][col] = (m.group(0), reverse)
+            col += 1
+        else:
+            private, n, op = m.group(1), int(m.group(2) or 1), m.group(3)
+            if private:
+                continue
+            if op == 's':
+                saved_row, saved_col = row, col
+            elif op == 'u':
+                row, col = saved_row, saved_col
+            elif op == 'A':
+                row = max(row - n, 0)
+            elif op == 'B':
+                row = min(row + n, ROWS)
+            elif op == 'G':
+                col = n - 1
+            elif op == 'm':
+                reverse = n == 7
+    return cells
+
+# Self check of Screen: after every show() the terminal holds the lines, every cell
+# up to the longest line drawn so far in the attribute of the last show()
+def check():
+    import io
+    frames = [
+        (['  12:00:00', ' ab  cd', 'sunrise 06:00'], False),
+        (['  12:00:01', ' ab  cd', 'sunrise 06:00'], False),
+        (['  12:00:02', ' ab  ce', 'sunset 18:00'], True),    # attribute changes, spaces included
+        (['  12:00:02', ' ab  ce', 'sunset 18:00'], True),    # nothing changes, nothing written
+        (['  12:00:03', '', 'sunrise 06:01'], False),
+        (['  1', ' x y', 'sunrise 06:01'], True),
+    ]
+    out = io.StringIO()
+    screen = Screen(out)
+    widths = [0] * ROWS
+    for i, (lines, reverse) in enumerate(frames):
+        before = out.tell()
+        screen.show(lines, reverse)
+        if i and frames[i - 1] == (lines, reverse):
+            assert out.tell() == before, "unchanged frame written again"
+        cells = replay(out.getvalue())
+        for row, line in enumerate(lines):
+            widths[row] = max(widths[row], len(line))
+            expect = [(c, reverse) for c in line.ljust(widths[row])]
+            assert cells[row][:widths[row]] == expect, (lines, reverse, row, cells[row][:widths[row]])
+    screen.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['check']:
+        check()
+        print("check OK")
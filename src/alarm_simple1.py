@@ -1,11 +1,11 @@
 import argparse
 import time
-import julian
-import pytz
-from datetime import timedelta
-import datetime
-from sunclock import sun_rise_set, equ2hor
-from timezonefinder import TimezoneFinder
+from sunjulian import from_jd, day_number
+from datetime import date, timedelta
+from tzresolve import get_noons, localize
+from alarm_realtime import RealtimeClock, Screen
+from instrument import span, first_frame
+import snapshot
 
 year, month, day = 2020, 3, 9
 lat, lon = 51, 0.1   # London
@@ -19,6 +19,10 @@ parser.add_argument('-m', '--month', help='month of date (1-12)', type=int, meta
 parser.add_argument('-d', '--day', help='day of date (1-31)', type=int, metavar='DAY', choices=range(1, 32), default=day)
 parser.add_argument('--lat', help='observer latitude (-65.7-65.7)', type=float, default=lat)
 parser.add_argument('--lon', help='observer longitude (-180.0-180.0)', type=float, default=lon)
+parser.add_argument('--profile', help='report call counts and latencies at exit and on SIGUSR1, see instrument.py', action='store_true')
+parser.add_argument('--realtime', help='show the real time instead of simulating the date, uses little CPU', action='store_true')
+parser.add_argument('--snapshot', help='startup snapshot file, see snapshot.py (default %(default)s)', default=snapshot.DEFAULT_PATH)
+parser.add_argument('--once', help='show the first frame and exit, print the time it took from the start', action='store_true')
 args = parser.parse_args()
 if args.lat < -65.7 or args.lat > 65.7:
     print("Sorry, please chose latitude between -65.7 and 65.7.")
@@ -29,41 +33,45 @@ if args.lon < -180 or args.lon > 180:
 year, month, day = args.year, args.month, args.day
 lat, lon = args.lat, args.lon
 
-# Calculate timezone from longitude, return a timezone.timezone object
-def get_timezone(lon):
-    hours = lon // 15
-    if ((lon % 15) > 7.5): hours = hours + 1
-    return datetime.timezone(timedelta(hours=hours))  # standard timezone
+# the timezone and sunrise/sunset saved by the last run, see snapshot.py,
+# when there is none the timezone is found from observer geolocation
+snap = snapshot.load(lat, lon, args.snapshot) or snapshot.Snapshot.resolve(lat, lon, args.snapshot)
+# the noon of the date in the timezone
+noons = get_noons(year, month, day, lat, lon, snap.timezone())
+d_local, d_utc = noons['d_local'], noons['d_utc']
+first_frame_time = None
 
-# first try to find the timezone from observer longtitude
-tf = TimezoneFinder()
-tz_str = tf.timezone_at(lat=lat, lng=lon)
-if (tz_str == None):  # not found
-    tz = get_timezone(lon)  # use standard timezone
-    d_local = datetime.datetime(year, month, day, hour=12, tzinfo=tz)
-else:  # found
-    tz = pytz.timezone(tz_str)
-    if (tz == None):  # but not in pytz
-        tz = get_timezone(lon)   # use standard timezone
-        d_local = datetime.datetime(year, month, day, hour=12, tzinfo=tz)
-    else:  # remember normally pytz timezone cannot be used in datetime constructor
-        d_local = tz.localize(datetime.datetime(year, month, day, hour=12))
+# called when the first frame is on the screen, return whether to stop (--once)
+#   n: number of days since Jan 1st, 2000 12:00 of the first day shown
+def started(n):
+    global first_frame_time
+    first_frame_time = first_frame('alarm')
+    snap.fill(n)  # the snapshot for the next start, now that the first frame is out
+    snap.save()
+    return args.once
+
+if args.realtime:  # run on the real clock until Control-C is pressed, see alarm_realtime.py
+    today = date.today()
+    n_today = day_number(localize(noons['tz'], today.year, today.month, today.day))
+    RealtimeClock(noons['tz'], lat, lon, snap.sun_rise_set).run(Screen(), lambda: started(n_today))
+    if args.once:
+        print("time to first frame: %.1f ms" % (first_frame_time * 1000))
+    exit(0)
 
 # calculate offset of our timezone to UTC
-d_utc = d_local.astimezone(tz=datetime.timezone.utc)
 tz_h = d_local.tzinfo.utcoffset(d_local) / timedelta(hours=1)
 
-n = round(julian.to_jd(d_utc) - 2451545)  # number of days since Jan 1st, 2000 12:00
-sun_rs = sun_rise_set(n, lon, lat)  # do the math
-sun_rs_next = sun_rise_set(n + 1, lon, lat)  # do the math for the next day
+n = day_number(d_utc)  # number of days since Jan 1st, 2000 12:00
+sun_rs = snap.sun_rise_set(n, lon, lat)  # do the math, or take it from the snapshot
+sun_rs_next = snap.sun_rise_set(n + 1, lon, lat)  # same for the next day
 
-# sunrise time in Julian date, we add an timezone correction because julian.from_jd() ignores timezone
+# sunrise time in Julian date, we add an timezone correction because from_jd() returns UTC
 j_rise = sun_rs[0] - sun_rs[1] + tz_h/24
 
-d_rise = julian.from_jd(j_rise)  # sunrise time in local dateime date (because we have added timezone correction)
+d_rise = from_jd(j_rise)  # sunrise time in local dateime date (because we have added timezone correction)
 print(d_rise.strftime("\n     Sunrise today: %m/%d/%Y %H:%M:%S"))
 j_rise_next = sun_rs_next[0] - sun_rs_next[1] + tz_h/24  # next day sunrise in Julian date, with timezone correction
-d_rise_next = julian.from_jd(j_rise_next)  # next day sunrise time in local date
+d_rise_next = from_jd(j_rise_next)  # next day sunrise time in local date
 print(d_rise_next.strftime("  Sunrise tomorrow: %m/%d/%Y %H:%M:%S"))
 j_set = sun_rs[0] + sun_rs[1] + tz_h/24
 
@@ -78,8 +86,10 @@ j_stop = j_set + 2/24  # stop time
 j_minute = 1/1440  # a minute in Julian day
 tick_time = 0.04
 i = 0
-while True:
-    try:
+first = True
+# any error, Control-C included, leaves the display usable
+try:
+    while True:
         j_now = j_start + i * j_minute
         if (j_now > j_stop):
             j_now = j_start
@@ -89,19 +99,28 @@ while True:
             d_this_rise = d_rise_next
         else:
             d_this_rise = d_rise
-        d_now = julian.from_jd(j_now)
-        if (j_now < j_rise or j_now > j_set):   # no special graphic attribute in night
-            print('\033[0m', end="", flush=True)  # clear graphic mode attribute
-        else:
-            print('\033[7m', end="", flush=True)  # set reverse video when sun is above horizon
-        print(d_now.strftime("      Current time: %m/%d/%Y %H:%M:%S"), "   ")
-        print(d_this_rise.strftime("      Next sunrise: %m/%d/%Y %H:%M:%S"), "   ")
-        print(" Sunrise countdown:", (d_this_rise - d_now) // 1, "       ")
-        print('\033[3A', end="", flush=True)  # move cursor up 3 rows
+        with span('alarm.frame'):  # one frame, see instrument.py
+            d_now = from_jd(j_now)
+            if (j_now < j_rise or j_now > j_set):   # no special graphic attribute in night
+                print('\033[0m', end="", flush=True)  # clear graphic mode attribute
+            else:
+                print('\033[7m', end="", flush=True)  # set reverse video when sun is above horizon
+            print(d_now.strftime("      Current time: %m/%d/%Y %H:%M:%S"), "   ")
+            print(d_this_rise.strftime("      Next sunrise: %m/%d/%Y %H:%M:%S"), "   ")
+            print(" Sunrise countdown:", (d_this_rise - d_now) // 1, "       ")
+            print('\033[3A', end="", flush=True)  # move cursor up 3 rows
+        if first:
+            first = False
+            if started(n):
+                break
         time.sleep(tick_time)
-    except:  # Control-C pressed, recover the display
-        print('\033[0m', end="", flush=True)  # clear graphic mode attribute
-        print('\033[3B', end="", flush=True)  # move cursor down 3 rows
-        print('\033[?25h')  # show the cursor
-        exit(0)
+except KeyboardInterrupt:  # Control-C pressed
+    pass
+finally:
+    # recover the display
+    print('\033[0m', end="", flush=True)  # clear graphic mode attribute
+    print('\033[3B', end="", flush=True)  # move cursor down 3 rows
+    print('\033[?25h')  # show the cursor
+if args.once:
+    print("time to first frame: %.1f ms" % (first_frame_time * 1000))
 
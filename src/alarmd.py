@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import math
+import time
+import socket
+import stat
+import heapq
+import asyncio
+import argparse
+import datetime
+import numpy as np
+from sunbatch import altitude_crossings, ALTITUDES
+from sunjulian import J2000, unix_to_jd, jd_to_unix
+from tzresolve import cell_precision
+from instrument import timed
+
+# Sunrise alarm daemon: many alarms in one process
+#
+# An alarm rings at sunrise or sunset of a location, optionally some minutes
+# before or after it (a negative offset is a pre-rise alarm). Instead of the
+# horizon, the Sun can cross another altitude, like -6 (civil twilight) for a
+# ramp starting at dawn, see sunbatch.ALTITUDES for the names. The next ring time
+# of every alarm is kept in one heap, an asyncio task sleeps until the earliest one.
+#
+# Alarms are grouped by location cell (latitude/longitude rounded to
+# tzresolve.cell_precision) and altitude. Crossing times of a cell are calculated
+# for a window of days ahead, for all cells of an altitude that need it in one
+# sunbatch.altitude_crossings() call, so
+# the alarms of a cell share the calculation and a day's rescheduling is one
+# NumPy call however many alarms there are.
+#
+# The API is a Unix socket, a JSON request per line, a JSON response per line:
+#   {"cmd": "add", "lat": 34.4, "lon": -119.8, "event": "sunrise", "altitude": "civil",
+#    "offset": -30, "label": "room 1"}
+#       -> {"ok": true, "alarm": {...}}
+#   {"cmd": "list"} -> {"ok": true, "alarms": [{...}, ...]}
+#   {"cmd": "remove", "id": 1} -> {"ok": true}
+# Errors are {"ok": false, "error": "message"}.
+#
+# Example:
+#   python alarmd.py serve --socket /tmp/alarmd.sock --state alarms.json
+#   python alarmd.py add --lat 34.4 --lon -119.8 --offset -30 --label "room 1"
+#   python alarmd.py list
+#   python alarmd.py remove 1
+
+DEFAULT_SOCKET = '/tmp/alarmd.sock'
+EVENTS = ('sunrise', 'sunset')
+WINDOW = 8  # days calculated at a time for a cell
+
+# Return the cell of an alarm: (latitude, longitude, altitude)
+def cell_of(alarm):
+    return (round(alarm['lat'], cell_precision), round(alarm['lon'], cell_precision), alarm['altitude'])
+
+# Return the J2000 day number of the local solar day at a time, see sunclock.sun_rise_set()
+#   t: POSIX timestamp
+#   lon: longitude, in degree
+def solar_day(t, lon):
+    return int(np.floor(unix_to_jd(t) - J2000 + lon / 360))
+
+# The alarms, their next ring times and the sunrise/sunset table of their cells
+class AlarmDaemon:
+    #   state: JSON file to keep the alarms in across restarts, or None
+    #   out: file to write a line to when an alarm rings
+    def __init__(self, state=None, out=sys.stdout):
+        self.state, self.out = state, out
+        self.alarms = {}  # id -> alarm dict
+        self.cells = {}   # cell -> {day number: (morning, evening) crossing as POSIX timestamps,
+                          #          None if the Sun does not cross the altitude}
+        self.heap = []    # (ring time, alarm id, generation)
+        self.next_id = 1
+        self.wakeup = None  # asyncio.Event set when the heap top may have changed
+        if state and os.path.exists(state):
+            with open(state) as f:
+                saved = json.load(f)
+            self.next_id = saved['next_id']
+            for a in saved['alarms']:
+                a.setdefault('altitude', ALTITUDES['sunrise'])
+                a.update({'next': None, 'generation': 0, 'rung': 0})
+                self.alarms[a['id']] = a
+            self.schedule(list(self.alarms.values()), time.time())
+
+    # Calculate the crossings of days [day0, day0 + WINDOW) for the cells whose
+    # table runs out within two days from day0, one batch for each altitude
+    #   needs: dict of cell -> first day needed
+    @timed('alarmd.fill')
+    def fill(self, needs):
+        todo = {}  # altitude -> [(cell, day0)]
+        for cell, day0 in needs.items():
+            if any(n not in self.cells.get(cell, {}) for n in (day0, day0 + 1, day0 + 2)):
+                todo.setdefault(cell[2], []).append((cell, day0))
+        for altitude, cells in todo.items():
+            la = np.array([c[0] for c, d in cells])[:, None]
+            lo = np.array([c[1] for c, d in cells])[:, None]
+            n = np.array([d for c, d in cells])[:, None] + np.arange(WINDOW)[None, :]
+            morning, evening, above, below = altitude_crossings(n, lo, la, [altitude])
+            morning, evening = jd_to_unix(morning[..., 0]), jd_to_unix(evening[..., 0])
+            none = above[..., 0] | below[..., 0]
+            for i, (cell, day0) in enumerate(cells):
+                days = self.cells.setdefault(cell, {})
+                for k in range(WINDOW):
+                    days[day0 + k] = None if none[i, k] else (morning[i, k], evening[i, k])
+                for old in [d for d in days if d < day0 - 1]:  # forget the past days
+                    del days[old]
+
+    # Return the next ring time of an alarm after now from the cell table, or None
+    # when the table has no ring time for it
+    def ring_time(self, alarm, now):
+        days = self.cells.get(cell_of(alarm), {})
+        for n in sorted(days):
+            if days[n] is None:
+                continue
+            t = days[n][EVENTS.index(alarm['event'])] + alarm['offset'] * 60
+            if t > now:
+                return t
+        return None
+
+    # Find the next ring times of alarms and push them on the heap
+    # The cells of all the alarms are calculated together, an alarm in a polar
+    # day/night cell is looked up a window further until a year ahead.
+    @timed('alarmd.schedule')
+    def schedule(self, alarms, now):
+        for ahead in range(0, 366 + WINDOW, WINDOW):
+            needs = {}
+            for a in alarms:
+                needs[cell_of(a)] = solar_day(now, a['lon']) - 1 + ahead
+            self.fill(needs)
+            waiting = []
+            for a in alarms:
+                t = self.ring_time(a, now)
+                if t is None:
+                    waiting.append(a)
+                    continue
+                a['next'] = t
+                a['generation'] += 1
+                heapq.heappush(self.heap, (t, a['id'], a['generation']))
+            alarms = waiting
+            if not alarms:
+                break
+        for a in alarms:  # no crossing within a year
+            a['next'] = None
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    # Add an alarm, return it
+    #   event: 'sunrise' or 'sunset', the morning or the evening crossing of the altitude
+    #   altitude: altitude of the Sun's center in degree, or a name in sunbatch.ALTITUDES
+    #   offset: minutes after the event, negative is before it
+    def add(self, lat, lon, event='sunrise', offset=0, label='', altitude='sunrise'):
+        if altitude in ALTITUDES:
+            altitude = ALTITUDES[altitude]
+        lat, lon, offset, altitude = float(lat), float(lon), float(offset), float(altitude)
+        if not math.isfinite(offset):  # JSON lets NaN and Infinity through, they would break the state file
+            raise ValueError("offset should be a finite number of minutes")
+        if not -90 <= altitude <= 90:
+            raise ValueError("altitude out of range")
+        if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            raise ValueError("latitude/longitude out of range")
+        if event not in EVENTS:
+            raise ValueError("event should be one of %s" % ', '.join(EVENTS))
+        a = {'id': self.next_id, 'lat': lat, 'lon': lon, 'event': event, 'altitude': altitude,
+                'offset': offset, 'label': str(label), 'next': None, 'generation': 0, 'rung': 0}
+        self.next_id += 1
+        self.alarms[a['id']] = a
+        self.schedule([a], time.time())
+        self.save()
+        return a
+
+    # Remove an alarm, its heap entry is dropped when it comes to the top
+    def remove(self, alarm_id):
+        if self.alarms.pop(int(alarm_id), None) is None:
+            raise ValueError("no alarm %s" % alarm_id)
+        self.save()
+
+    # Save the alarms to the state file
+    def save(self):
+        if not self.state:
+            return
+        keys = ('id', 'lat', 'lon', 'event', 'altitude', 'offset', 'label')
+        tmp = self.state + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'next_id': self.next_id,
+                    'alarms': [{k: a[k] for k in keys} for a in self.alarms.values()]}, f)
+        os.replace(tmp, self.state)
+
+    # Return an alarm as a JSON-able dict, next ring time in ISO format, UTC
+    def describe(self, a):
+        d = {k: a[k] for k in ('id', 'lat', 'lon', 'event', 'altitude', 'offset', 'label', 'rung')}
+        d['next'] = None if a['next'] is None else datetime.datetime.fromtimestamp(
+                round(a['next']), datetime.timezone.utc).isoformat()
+        return d
+
+    # Ring the alarms due at now, reschedule them together
+    # Return the number of alarms rung
+    def ring_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            t, alarm_id, generation = heapq.heappop(self.heap)
+            a = self.alarms.get(alarm_id)
+            if a is None or a['generation'] != generation:  # removed or rescheduled
+                continue
+            a['rung'] += 1
+            print("%s alarm %d %s %s altitude %g offset %+g min %s" % (
+                    datetime.datetime.fromtimestamp(round(t), datetime.timezone.utc).isoformat(),
+                    a['id'], a['label'], a['event'], a['altitude'], a['offset'], (a['lat'], a['lon'])),
+                    file=self.out, flush=True)
+            due.append(a)
+        if due:
+            self.schedule(due, now)
+        return len(due)
+
+    # Task: sleep until the earliest alarm or a change of the heap, ring the due alarms
+    async def run_timers(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            self.ring_due(time.time())
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    # Handle a request dict, return the response dict
+    def handle(self, req):
+        if not isinstance(req, dict):
+            return {'ok': False, 'error': 'request must be a JSON object, got %s' % type(req).__name__}
+        try:
+            cmd = req.get('cmd')
+            if cmd == 'add':
+                a = self.add(req['lat'], req['lon'], req.get('event', 'sunrise'),
+                        req.get('offset', 0), req.get('label', ''), req.get('altitude', 'sunrise'))
+                return {'ok': True, 'alarm': self.describe(a)}
+            if cmd == 'list':
+                return {'ok': True, 'alarms': [self.describe(a) for a in self.alarms.values()]}
+            if cmd == 'remove':
+                self.remove(req['id'])
+                return {'ok': True}
+            raise ValueError("unknown command %r" % cmd)
+        except (KeyError, TypeError, ValueError) as e:
+            return {'ok': False, 'error': str(e)}
+
+    # Connection callback of the Unix socket server
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    resp = self.handle(json.loads(line))
+                except ValueError as e:  # bad JSON
+                    resp = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(resp).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    # Serve the API on a Unix socket and ring the alarms, until cancelled
+    # A socket file left by a daemon that is gone is replaced, RuntimeError is
+    # raised when a daemon still answers on it or the path is not a socket.
+    async def serve(self, path=DEFAULT_SOCKET):
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise RuntimeError("%s exists and is not a socket" % path)
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path)  # stale socket file
+            else:
+                raise RuntimeError("another daemon is serving on %s" % path)
+            finally:
+                probe.close()
+        server = await asyncio.start_unix_server(self.serve_client, path)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run_timers())
+
+# Send a request to a running daemon, return the response dict
+def request(req, path=DEFAULT_SOCKET):
+    async def send():
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(json.dumps(req).encode() + b'\n')
+        await writer.drain()
+        resp = await reader.readline()
+        writer.close()
+        return json.loads(resp)
+    return asyncio.run(send())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sunrise alarm daemon.')
+    parser.add_argument('--socket', help='Unix socket of the API (default %s)' % DEFAULT_SOCKET, default=DEFAULT_SOCKET)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('serve', help='run the daemon')
+    p.add_argument('--state', help='JSON file to keep the alarms in')
+    p = sub.add_parser('add', help='add an alarm')
+    p.add_argument('--lat', help='observer latitude', type=float, required=True)
+    p.add_argument('--lon', help='observer longitude', type=float, required=True)
+    p.add_argument('--event', help='event to ring at', choices=EVENTS, default='sunrise')
+    p.add_argument('--altitude', help='altitude of the Sun in degree or one of %s (default sunrise)' % ', '.join(ALTITUDES), default='sunrise')
+    p.add_argument('--offset', help='minutes after the event, negative for before', type=float, default=0)
+    p.add_argument('--label', help='label of the alarm', default='')
+    sub.add_parser('list', help='list the alarms')
+    p = sub.add_parser('remove', help='remove an alarm')
+    p.add_argument('id', type=int)
+    args = parser.parse_args()
+
+    if args.cmd == 'serve':
+        try:
+            asyncio.run(AlarmDaemon(args.state).serve(args.socket))
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError as e:
+            print(e)
+            exit(1)
+        exit(0)
+    req = {'cmd': args.cmd}
+    if args.cmd == 'add':
+        req.update(lat=args.lat, lon=args.lon, event=args.event, altitude=args.altitude,
+                offset=args.offset, label=args.label)
+    elif args.cmd == 'remove':
+        req['id'] = args.id
+    resp = request(req, args.socket)
+    print(json.dumps(resp, indent=2))
+    if not resp['ok']:
+        exit(1)
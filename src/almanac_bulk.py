@@ -0,0 +1,195 @@
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import datetime
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from sunbatch import sun_rise_set_batch
+from sunjulian import day_number, jd_to_iso_array
+
+# Bulk almanac generator: sunrise/sunset/transit for every (site, date) pair
+#
+# Sites are read from a CSV file with a header line and name, lat, lon columns.
+# The sites are split into shards of --shard-sites sites, each shard is calculated
+# by a worker process in one sun_rise_set_batch() call for all its sites and days,
+# and written to its own file in the output directory:
+#   shard-000000.csv, shard-000001.csv, ...   (or .parquet)
+# A shard file is written under a temporary name and renamed when complete, so
+# a stopped run can be restarted with the same arguments and skips finished shards.
+# The arguments of the run are kept in manifest.json next to the shards, a run with
+# other arguments (dates, format, shard size or sites) refuses the directory
+# instead of mixing its shards with the old ones.
+# Only a few shards are in flight at a time, so memory stays bounded however many
+# sites there are.
+#
+# Example, a year for every site in sites.csv:
+#   python almanac_bulk.py sites.csv -y 2021 -m 1 -d 1 --days 365 -o almanac
+#
+# Output columns, all times UTC:
+#   name, date, sunrise, sunset, transit, day_length (hours), polar ('day', 'night' or '')
+
+COLUMNS = ['name', 'date', 'sunrise', 'sunset', 'transit', 'day_length', 'polar']
+
+# Read sites from a CSV file, yield (name, lat, lon) tuples
+def read_sites(path):
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield row['name'], float(row['lat']), float(row['lon'])
+
+# Yield lists of at most `size` items from an iterable
+def chunks(items, size):
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Return the file name of a shard
+def shard_path(out_dir, shard, fmt):
+    return os.path.join(out_dir, 'shard-%06d.%s' % (shard, fmt))
+
+# Return a digest of a file, to tell the sites of two runs apart
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# Write the manifest of a run, or check it against the one of an earlier run
+def check_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            old = json.load(f)
+        if old != manifest:
+            raise ValueError("%s holds the shards of another run (%s), use another output directory" %
+                    (out_dir, ', '.join(k for k in manifest if old.get(k) != manifest[k])))
+        return
+    if any(name.startswith('shard-') for name in os.listdir(out_dir)):
+        raise ValueError("%s holds shards without a manifest, use another output directory" % out_dir)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+# Calculate the almanac of a shard, return a dict of column arrays, sites vary slowest
+#   sites: list of (name, lat, lon)
+#   n0: J2000 day number of the first day
+#   days: number of days
+def shard_columns(sites, n0, days):
+    names = [s[0] for s in sites]
+    la = np.array([s[1] for s in sites])[:, None]
+    lo = np.array([s[2] for s in sites])[:, None]
+    n = np.arange(n0, n0 + days)[None, :]
+    jt, ha, dec, polar_day, polar_night = sun_rise_set_batch(n, lo, la)
+    up = ~(polar_day | polar_night)
+    rise = np.where(up, jt - ha, np.nan).ravel()
+    sets = np.where(up, jt + ha, np.nan).ravel()
+    polar = np.where(polar_day, 'day', np.where(polar_night, 'night', '')).ravel()
+    date = np.datetime64('2000-01-01') + n.astype('timedelta64[D]')
+    return {
+        'name': np.repeat(names, days),
+        'date': np.tile(date.ravel().astype(str), len(sites)),
+        'sunrise': np.where(np.isnan(rise), '', jd_to_iso_array(np.nan_to_num(rise))),
+        'sunset': np.where(np.isnan(sets), '', jd_to_iso_array(np.nan_to_num(sets))),
+        'transit': jd_to_iso_array(jt.ravel()),
+        'day_length': np.round(ha.ravel() * 48, 4),  # 2 * hour angle, in hours
+        'polar': polar,
+    }
+
+# Worker: calculate a shard and write it to its file, return the number of rows
+def run_shard(out_dir, shard, sites, n0, days, fmt):
+    cols = shard_columns(sites, n0, days)
+    path = shard_path(out_dir, shard, fmt)
+    tmp = path + '.tmp'
+    if fmt == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.table({c: cols[c] for c in COLUMNS})
+        pyarrow.parquet.write_table(table, tmp)
+    else:
+        with open(tmp, 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(COLUMNS)
+            w.writerows(zip(*(cols[c].tolist() for c in COLUMNS)))
+    os.replace(tmp, path)
+    return len(cols['name'])
+
+# Generate the almanac of all sites, shard by shard in a process pool
+#   sites: iterable of (name, lat, lon)
+#   start: datetime.date of the first day
+#   days: number of days
+#   out_dir: output directory, created if missing
+#   fmt: 'csv' or 'parquet'
+#   shard_sites: number of sites of a shard
+#   workers: number of worker processes, default is the number of CPUs
+#   progress: a file to write progress lines to, or None
+#   sites_id: a string identifying the sites, e.g. file_digest() of the sites file,
+#     kept in the manifest so a resumed run can't pick up shards of other sites
+# Return the number of rows written in this run (skipped shards not included)
+# Raise ValueError when out_dir holds shards of a run with other arguments,
+# ImportError when the format is 'parquet' and pyarrow is not installed
+def generate(sites, start, days, out_dir, fmt='csv', shard_sites=1000, workers=None,
+        progress=sys.stderr, sites_id=None):
+    if fmt == 'parquet':  # imported here too, a missing pyarrow fails before the manifest is written
+        import pyarrow.parquet
+    os.makedirs(out_dir, exist_ok=True)
+    check_manifest(out_dir, {'start': start.isoformat(), 'days': days, 'format': fmt,
+            'shard_sites': shard_sites, 'sites': sites_id})
+    n0 = day_number(datetime.datetime(start.year, start.month, start.day, hour=12))
+    workers = workers or os.cpu_count()
+    t_start = time.time()
+    rows = done = skipped = 0
+    pending = set()
+    with ProcessPoolExecutor(workers) as pool:
+        for shard, chunk in enumerate(chunks(sites, shard_sites)):
+            if os.path.exists(shard_path(out_dir, shard, fmt)):  # done by an earlier run
+                skipped += 1
+                continue
+            if len(pending) >= 2 * workers:   # keep only a few shards in flight
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    rows += f.result()
+                    done += 1
+                report(progress, done, skipped, rows, t_start)
+            pending.add(pool.submit(run_shard, out_dir, shard, chunk, n0, days, fmt))
+        for f in wait(pending)[0]:
+            rows += f.result()
+            done += 1
+    report(progress, done, skipped, rows, t_start)
+    return rows
+
+# Write a progress line
+def report(progress, done, skipped, rows, t_start):
+    if progress is None:
+        return
+    elapsed = time.time() - t_start
+    print("shards done: %d, skipped: %d, rows: %d, %.1f s, %.0f rows/s" %
+            (done, skipped, rows, elapsed, rows / elapsed if elapsed else 0), file=progress, flush=True)
+
+if __name__ == '__main__':
+    today = datetime.date.today()
+    parser = argparse.ArgumentParser(description='Bulk sunrise/sunset almanac generator.')
+    parser.add_argument('sites', help='CSV file of sites, with name, lat, lon columns')
+    parser.add_argument('-y', '--year', help='year of start date (1900-2100)', type=int, metavar='YEAR', choices=range(1900,2101), default=today.year)
+    parser.add_argument('-m', '--month', help='month of start date (1-12)', type=int, metavar='MONTH', choices=range(1, 13), default=today.month)
+    parser.add_argument('-d', '--day', help='day of start date (1-31)', type=int, metavar='DAY', choices=range(1, 32), default=today.day)
+    parser.add_argument('--days', help='number of days', type=int, default=365)
+    parser.add_argument('-o', '--out', help='output directory', default='almanac')
+    parser.add_argument('-f', '--format', help='output format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--shard-sites', help='number of sites per shard', type=int, default=1000)
+    parser.add_argument('-j', '--workers', help='number of worker processes', type=int, default=None)
+    args = parser.parse_args()
+    try:
+        generate(read_sites(args.sites), datetime.date(args.year, args.month, args.day), args.days,
+                args.out, args.format, args.shard_sites, args.workers, sites_id=file_digest(args.sites))
+    except (ValueError, ImportError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
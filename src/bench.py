@@ -0,0 +1,385 @@
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import datetime
+from statistics import median
+
+# Benchmark suite for the solar math, timezone lookup, tk_clock tick and Skyfield path
+#
+# Every benchmark runs its body several rounds and records the median and minimum
+# time per call. Results are written as JSON and can be compared with a saved
+# baseline, a benchmark slower than the baseline by more than the threshold is
+# reported as a regression and the exit status is 1.
+#
+# Example:
+#   python bench.py -o baseline.json          # once, on the old code
+#   python bench.py --baseline baseline.json  # after a change
+#
+# Benchmarks whose dependencies are missing (timezonefinder, skyfield, de421.bsp)
+# are skipped. The tk_clock tick runs against a stand-in tkinter, so it needs no
+# display and measures only our own per-tick work.
+
+DLM_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlm'))
+
+benchmarks = []  # list of (name, function returning (callable, calls per run))
+
+# Decorator to register a benchmark
+#   name: benchmark name, like 'sun_rise_set/scalar'
+def benchmark(name):
+    def register(f):
+        benchmarks.append((name, f))
+        return f
+    return register
+
+# Time a callable, return a dict of the results
+#   fn: the callable to time, called without arguments
+#   calls: number of calls of the measured operation done by one fn() call
+#   rounds: number of timed fn() calls
+def measure(fn, calls, rounds):
+    fn()  # warm up
+    times = []
+    for i in range(rounds):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) / calls)
+    return {'per_call_s': median(times), 'min_s': min(times), 'calls': calls, 'rounds': rounds}
+
+# ===== solar math =====
+
+@benchmark('sun_rise_set/scalar')
+def bench_sun_rise_set():
+    from sunclock import sun_rise_set
+    def run():
+        for n in range(7000, 8000):
+            sun_rise_set(n, -119.8, 34.4)
+    return run, 1000
+
+def _batch_sun_rise_set(size):
+    import numpy as np
+    from sunbatch import sun_rise_set_batch
+    n = 7000 + np.arange(size) % 365
+    la = np.linspace(-60, 60, size)
+    lo = np.linspace(-180, 180, size)
+    return lambda: sun_rise_set_batch(n, lo, la), size
+
+@benchmark('sun_rise_set/batch_1k')
+def bench_sun_rise_set_1k():
+    return _batch_sun_rise_set(1000)
+
+@benchmark('sun_rise_set/batch_1m')
+def bench_sun_rise_set_1m():
+    return _batch_sun_rise_set(1000000)
+
+@benchmark('equ2hor/scalar')
+def bench_equ2hor():
+    from sunclock import equ2hor
+    def run():
+        for i in range(1000):
+            equ2hor(i / 1000 - 0.5, 0.3, 34.4)
+    return run, 1000
+
+def _batch_equ2hor(size):
+    import numpy as np
+    from sunbatch import equ2hor_batch
+    ha = np.linspace(-0.5, 0.5, size)
+    return lambda: equ2hor_batch(ha, 0.3, 34.4), size
+
+@benchmark('equ2hor/batch_1k')
+def bench_equ2hor_1k():
+    return _batch_equ2hor(1000)
+
+@benchmark('equ2hor/batch_1m')
+def bench_equ2hor_1m():
+    return _batch_equ2hor(1000000)
+
+@benchmark('sunpath/positions_1m')
+def bench_sunpath_positions():
+    import numpy as np
+    from sunpath import SunPath
+    jd = 2458918.8 + np.arange(1000000) / 86400
+    return lambda: SunPath(-119.8, 34.4).positions(jd), 1000000
+
+@benchmark('sunpath/stepper')
+def bench_sunpath_stepper():
+    from sunpath import SunPath
+    step = SunPath(-119.8, 34.4).stepper(2458918.8, 1 / 86400)
+    def run():
+        for i in range(10000):
+            step.next()
+    return run, 10000
+
+@benchmark('altitude_crossings/batch_1k_x6')
+def bench_altitude_crossings():
+    import numpy as np
+    from sunbatch import altitude_crossings, ALTITUDES
+    n = 7000 + np.arange(1000) % 365
+    la = np.linspace(-60, 60, 1000)
+    return lambda: altitude_crossings(n, 0, la, list(ALTITUDES)), 1000
+
+@benchmark('alarmd/schedule_10k')
+def bench_alarmd_schedule():
+    import io
+    import numpy as np
+    from alarmd import AlarmDaemon
+    d = AlarmDaemon(out=io.StringIO())
+    rnd = np.random.default_rng(1)
+    for la, lo in zip(rnd.uniform(-60, 60, 1000), rnd.uniform(-180, 180, 1000)):
+        for offset in range(0, 100, 10):  # 10 alarms a cell
+            d.alarms[len(d.alarms) + 1] = {'id': len(d.alarms) + 1, 'lat': la, 'lon': lo,
+                    'event': 'sunrise', 'altitude': -0.83, 'offset': -offset, 'label': '', 'next': None, 'generation': 0, 'rung': 0}
+    alarms = list(d.alarms.values())
+    def run():
+        d.cells.clear()
+        d.heap.clear()
+        d.schedule(alarms, 1600000000)
+    return run, len(alarms)
+
+@benchmark('sunindex/build_50y')
+def bench_sunindex_build():
+    import tempfile
+    import datetime
+    from sunindex import build
+    prefix = os.path.join(tempfile.mkdtemp(), 'index')
+    return lambda: build(prefix, 34.4, -119.8, 2000, 2049, datetime.timezone(datetime.timedelta(hours=-8))), 1
+
+@benchmark('sunindex/queries_1y')
+def bench_sunindex_queries():
+    import tempfile
+    import datetime
+    from sunindex import build, SunIndex
+    prefix = os.path.join(tempfile.mkdtemp(), 'index')
+    build(prefix, 34.4, -119.8, 2000, 2049, datetime.timezone(datetime.timedelta(hours=-8)))
+    index = SunIndex(prefix)
+    d0, d1 = datetime.date(2025, 1, 1), datetime.date(2025, 12, 31)
+    def run():
+        index.extreme('rise', d0, d1)
+        index.extreme('set', d0, d1, largest=True)
+        index.runs('day_length', d0, d1, above=14)
+        index.first('rise', d0, d1, above=6.5)
+    return run, 4
+
+# ===== timezone =====
+
+@benchmark('timezone/finder_startup')
+def bench_finder_startup():
+    from timezonefinder import TimezoneFinder
+    return TimezoneFinder, 1
+
+@benchmark('timezone/get_noons_cold')
+def bench_get_noons_cold():
+    import tzresolve
+    tzresolve.get_finder()  # startup is measured above
+    def run():
+        tzresolve._timezone_name_at_cell.cache_clear()
+        for i in range(100):
+            tzresolve.get_noons(2020, 3, 9, 20 + i * 0.3, -120 + i * 0.5)
+    return run, 100
+
+@benchmark('timezone/get_noons_warm')
+def bench_get_noons_warm():
+    import tzresolve
+    def run():
+        for i in range(100):
+            tzresolve.get_noons(2020, 3, 9, 34.4, -119.8)
+    return run, 100
+
+# ===== startup =====
+
+# Run alarm_simple1.py until its first frame, in a new Python process
+#   snapshot_path: startup snapshot file, removed before every run when cold
+def _alarm_first_frame(snapshot_path, cold):
+    import subprocess
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alarm_simple1.py')
+    def run():
+        if cold and os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        subprocess.run([sys.executable, script, '--once', '--snapshot', snapshot_path],
+                stdout=subprocess.DEVNULL, check=True)
+    return run, 1
+
+@benchmark('startup/alarm_first_frame_cold')
+def bench_alarm_first_frame_cold():
+    import tempfile
+    return _alarm_first_frame(os.path.join(tempfile.mkdtemp(), 'snapshot.json'), True)
+
+@benchmark('startup/alarm_first_frame_snapshot')
+def bench_alarm_first_frame_snapshot():
+    import tempfile
+    return _alarm_first_frame(os.path.join(tempfile.mkdtemp(), 'snapshot.json'), False)
+
+# ===== tk_clock tick =====
+
+# A tkinter stand-in: widgets accept and ignore everything, the canvas counts items
+class _Widget:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):  # grid(), title(), after(), configure()...
+        return lambda *args, **kwargs: None
+
+class _Canvas(_Widget):
+    def __init__(self, *args, **kwargs):
+        self.items = 0
+
+    def _create(self, *args, **kwargs):
+        self.items += 1
+        return self.items
+
+    create_line = create_oval = create_rectangle = create_text = create_image = _create
+
+class _StringVar:
+    def __init__(self, *args, **kwargs):
+        self.value = ''
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+# Import tk_clock with the tkinter stand-in, return the module
+def load_tk_clock_headless():
+    tk = types.ModuleType('tkinter')
+    ttk = types.ModuleType('tkinter.ttk')
+    ttk.Frame = ttk.Label = _Widget
+    tk.Tk = tk.Frame = tk.Label = _Widget
+    tk.Canvas = _Canvas
+    tk.StringVar = _StringVar
+    tk.N, tk.S, tk.E, tk.W = 'n', 's', 'e', 'w'
+    tk.ttk = ttk
+    saved = {m: sys.modules.get(m) for m in ('tkinter', 'tkinter.ttk', 'tk_clock')}
+    sys.modules.update({'tkinter': tk, 'tkinter.ttk': ttk})
+    sys.modules.pop('tk_clock', None)
+    try:
+        import tk_clock
+    finally:
+        for m, module in saved.items():
+            if module is None:
+                sys.modules.pop(m, None)
+            else:
+                sys.modules[m] = module
+    return tk_clock
+
+@benchmark('tk_clock/update')
+def bench_tk_clock_update():
+    tk_clock = load_tk_clock_headless()
+    tk_clock.simu_days = 365
+    tk_clock.simu_day_interval = 1
+    tk_clock.noons = tk_clock.get_noons(2019, 12, 21, 34.4, -119.8)
+    tk_clock.sun = tk_clock.sun_days(tk_clock.day_number(tk_clock.noons['d_utc']))
+    tk_clock.frames, tk_clock.day_labels, tk_clock.frame_hor = tk_clock.frame_table()
+    tk_clock.discs = tk_clock.disc_table()
+    tk_clock.graph_init()
+    def run():
+        for i in range(1000):
+            tk_clock.update()
+    return run, 1000
+
+@benchmark('tk_clock/graph_init_365')
+def bench_tk_clock_graph_init():
+    tk_clock = load_tk_clock_headless()
+    tk_clock.simu_days = 365
+    tk_clock.simu_day_interval = 1
+    tk_clock.noons = tk_clock.get_noons(2019, 12, 21, 34.4, -119.8)
+    tk_clock.sun = tk_clock.sun_days(tk_clock.day_number(tk_clock.noons['d_utc']))
+    return tk_clock.graph_init, 1
+
+@benchmark('tk_clock/frame_table_365')
+def bench_tk_clock_frame_table():
+    tk_clock = load_tk_clock_headless()
+    tk_clock.simu_days = 365
+    tk_clock.simu_day_interval = 1
+    tk_clock.noons = tk_clock.get_noons(2019, 12, 21, 34.4, -119.8)
+    tk_clock.sun = tk_clock.sun_days(tk_clock.day_number(tk_clock.noons['d_utc']))
+    return tk_clock.frame_table, 1
+
+# ===== Skyfield =====
+
+def _skyfield():
+    from skyfield.api import Loader
+    path = os.path.join(DLM_DIR, 'de421.bsp')
+    if not os.path.exists(path):
+        raise ImportError("no %s" % path)
+    load = Loader(DLM_DIR, expire=False)
+    ts = load.timescale(builtin=True)
+    return ts, load('de421.bsp')
+
+@benchmark('skyfield/find_discrete_9_days')
+def bench_find_discrete():
+    from skyfield import almanac
+    from skyfield.api import Topos
+    ts, planets = _skyfield()
+    f = almanac.sunrise_sunset(planets, Topos(34.4, -119.8))
+    t0, t1 = ts.utc(2020, 3, 10, 7), ts.utc(2020, 3, 19, 7)
+    return lambda: almanac.find_discrete(t0, t1, f), 1
+
+@benchmark('skyfield/hybrid_9_days')
+def bench_hybrid():
+    sys.path.insert(0, DLM_DIR)
+    from hybrid import hybrid_sunrise_sunset
+    ts, planets = _skyfield()
+    t0, t1 = ts.utc(2020, 3, 10, 7), ts.utc(2020, 3, 19, 7)
+    return lambda: hybrid_sunrise_sunset(planets, ts, 34.4, -119.8, t0, t1), 1
+
+# Run the benchmarks, return the results dict
+#   only: run only the benchmarks whose names contain one of these strings
+#   rounds: timed rounds of each benchmark
+#   progress: a file to write a line per benchmark to, or None
+def run_all(only=None, rounds=5, progress=sys.stderr):
+    results = {}
+    for name, setup in benchmarks:
+        if only and not any(o in name for o in only):
+            continue
+        try:
+            fn, calls = setup()
+        except ImportError as e:  # missing optional dependency
+            if progress:
+                print("%-32s skipped: %s" % (name, e), file=progress)
+            continue
+        results[name] = measure(fn, calls, rounds)
+        if progress:
+            print("%-32s %12.3f us/call" % (name, results[name]['per_call_s'] * 1e6), file=progress)
+    return results
+
+# Compare results with a baseline, return a list of (name, ratio) of the regressions
+# The minimum times are compared, they are the least disturbed by other processes
+#   threshold: allowed slow down, 0.2 means 20% slower is still OK
+def compare(results, baseline, threshold=0.2):
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            continue
+        ratio = r['min_s'] / b['min_s']
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of sunclock, tk_clock and dlm.')
+    parser.add_argument('-o', '--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare with')
+    parser.add_argument('--threshold', help='allowed slow down against the baseline (default 0.2)', type=float, default=0.2)
+    parser.add_argument('--rounds', help='timed rounds of each benchmark (default 5)', type=int, default=5)
+    parser.add_argument('--only', help='run only benchmarks whose names contain this, can be repeated', action='append')
+    args = parser.parse_args()
+
+    results = run_all(args.only, args.rounds)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(), 'machine': platform.machine(),
+                    'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print("REGRESSION %-32s %.2fx slower than baseline" % (name, ratio))
+        if regressions:
+            exit(1)
+        print("no regression against %s" % args.baseline)
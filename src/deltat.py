@@ -0,0 +1,163 @@
+import os
+import mmap
+import struct
+import datetime
+from array import array
+from bisect import bisect_right
+
+# ΔT (TT - UT) and TAI - UTC lookup from the data files shipped in ../dlm:
+#   deltat.data: observed monthly ΔT, lines like " 2020  1  1  69.3612"
+#   deltat.preds: predicted ΔT, lines like "   58484.000  2019.00   69.34 ..."
+#   Leap_Second.dat: TAI - UTC steps, lines like "    41317.0    1  1 1972       10"
+#
+# The files are parsed once into 4 sorted arrays of doubles: MJD and ΔT of the
+# ΔT table, MJD and TAI - UTC of the leap second table. They can be written to a
+# compact index file and memory-mapped from it, so later runs skip the parsing.
+# Scalar lookups use bisect, the *_array functions take NumPy arrays.
+#
+# Outside the tables the first or last value is used.
+#
+# Example, sunrise with ΔT of the day instead of the 0.0008 day approximation:
+#   dt = delta_t(n + 2451545)
+#   sun_rise_set(n, lo, la, dt=dt)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlm')
+MJD_JD = 2400000.5  # Julian date of MJD 0
+
+_MAGIC = b'SSACDT1\n'
+_HEADER = struct.Struct('<8sII')  # magic, ΔT table size, leap second table size
+
+# Return MJD of a date
+def _mjd(year, month, day):
+    return (datetime.date(year, month, day) - datetime.date(1858, 11, 17)).days
+
+# Parse the ΔT data files, return 2 lists: MJD and ΔT in seconds
+def parse_delta_t(data_dir=DATA_DIR):
+    mjd, dt = [], []
+    with open(os.path.join(data_dir, 'deltat.data')) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 4:
+                mjd.append(_mjd(int(fields[0]), int(fields[1]), int(fields[2])))
+                dt.append(float(fields[3]))
+    with open(os.path.join(data_dir, 'deltat.preds')) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3 or fields[0] == 'MJD':
+                continue
+            m = float(fields[0])
+            if m > mjd[-1]:  # observed values win over predictions
+                mjd.append(m)
+                dt.append(float(fields[2]))
+    return mjd, dt
+
+# Parse the leap second file, return 2 lists: MJD and TAI - UTC in seconds from that day
+def parse_leap_seconds(data_dir=DATA_DIR):
+    mjd, tai_utc = [], []
+    with open(os.path.join(data_dir, 'Leap_Second.dat')) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 5 and not line.startswith('#'):
+                mjd.append(float(fields[0]))
+                tai_utc.append(float(fields[4]))
+    return mjd, tai_utc
+
+class DeltaTIndex:
+    # the 4 tables can be lists, arrays or memoryviews of doubles
+    def __init__(self, dt_mjd, dt, ls_mjd, tai_utc, buf=None):
+        self.dt_mjd, self.dt = dt_mjd, dt
+        self.ls_mjd, self.tai_utc = ls_mjd, tai_utc
+        self._buf = buf  # keep the mapped file open
+
+    # Return ΔT = TT - UT in seconds at a Julian date, linearly interpolated
+    #   j: Julian date
+    def delta_t(self, j):
+        mjd = j - MJD_JD
+        i = bisect_right(self.dt_mjd, mjd)
+        if i == 0:
+            return self.dt[0]
+        if i == len(self.dt_mjd):
+            return self.dt[-1]
+        m0, m1 = self.dt_mjd[i - 1], self.dt_mjd[i]
+        return self.dt[i - 1] + (self.dt[i] - self.dt[i - 1]) * (mjd - m0) / (m1 - m0)
+
+    # Return TAI - UTC in seconds at a Julian date (UTC)
+    #   j: Julian date
+    def tai_utc_at(self, j):
+        i = bisect_right(self.ls_mjd, j - MJD_JD)
+        return self.tai_utc[max(i - 1, 0)]
+
+    # Vectorized delta_t()
+    def delta_t_array(self, j):
+        import numpy as np
+        return np.interp(np.asarray(j, dtype=float) - MJD_JD,
+                np.asarray(self.dt_mjd), np.asarray(self.dt))
+
+    # Vectorized tai_utc_at()
+    def tai_utc_array(self, j):
+        import numpy as np
+        i = np.searchsorted(np.asarray(self.ls_mjd), np.asarray(j, dtype=float) - MJD_JD, side='right')
+        return np.asarray(self.tai_utc)[np.maximum(i - 1, 0)]
+
+    # Write the tables to a compact index file, see load_index()
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(self.dt_mjd), len(self.ls_mjd)))
+            for t in (self.dt_mjd, self.dt, self.ls_mjd, self.tai_utc):
+                array('d', t).tofile(f)
+        os.replace(tmp, path)
+
+# Parse the data files into a DeltaTIndex
+def build_index(data_dir=DATA_DIR):
+    dt_mjd, dt = parse_delta_t(data_dir)
+    ls_mjd, tai_utc = parse_leap_seconds(data_dir)
+    return DeltaTIndex(array('d', dt_mjd), array('d', dt), array('d', ls_mjd), array('d', tai_utc))
+
+# Open an index file written by DeltaTIndex.save(), memory-mapped
+def open_index(path):
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, n_dt, n_ls = _HEADER.unpack_from(buf)
+    if magic != _MAGIC:
+        raise ValueError("%s is not a delta T index file" % path)
+    d = memoryview(buf)[_HEADER.size:].cast('d')
+    tables = (d[:n_dt], d[n_dt:2*n_dt], d[2*n_dt:2*n_dt + n_ls], d[2*n_dt + n_ls:2*n_dt + 2*n_ls])
+    return DeltaTIndex(*tables, buf=buf)
+
+# Return a DeltaTIndex of the data files
+#   data_dir: directory of deltat.data, deltat.preds and Leap_Second.dat
+#   path: optional index file, (re)built when missing or older than the data files,
+#         then memory-mapped
+def load_index(data_dir=DATA_DIR, path=None):
+    if path is None:
+        return build_index(data_dir)
+    sources = [os.path.join(data_dir, n) for n in ('deltat.data', 'deltat.preds', 'Leap_Second.dat')]
+    if not os.path.exists(path) or os.path.getmtime(path) < max(map(os.path.getmtime, sources)):
+        build_index(data_dir).save(path)
+    return open_index(path)
+
+_index = None  # the default index, see get_index()
+
+# Return the default index, parsed from DATA_DIR at the first call
+def get_index():
+    global _index
+    if _index is None:
+        _index = build_index()
+    return _index
+
+# ΔT = TT - UT in seconds at a Julian date, from the default index
+def delta_t(j):
+    return get_index().delta_t(j)
+
+# TAI - UTC in seconds at a Julian date, from the default index
+def tai_utc(j):
+    return get_index().tai_utc_at(j)
+
+# Vectorized delta_t()
+def delta_t_array(j):
+    return get_index().delta_t_array(j)
+
+# Vectorized tai_utc()
+def tai_utc_array(j):
+    return get_index().tai_utc_array(j)
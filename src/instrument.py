@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import atexit
+import random
+import signal
+import contextlib
+from functools import wraps
+
+# Opt-in instrumentation of the hot paths: call counts, latencies and cache hit rates
+#
+# Enabled by the SSAC_PROFILE environment variable or a --profile command line
+# argument, decided once when this module is first imported:
+#   SSAC_PROFILE=1 python alarm_simple1.py     # report to stderr
+#   SSAC_PROFILE=prof.txt python tk_clock.py   # report appended to prof.txt
+#   python tk_clock.py --profile
+# When enabled, a report is written at exit and whenever the process gets SIGUSR1,
+# so a running alarm can be looked at without stopping it:
+#   kill -USR1 <pid>
+#
+# When disabled, timed() returns the function itself and span() a shared no-op
+# context manager, so the instrumented code runs as if nothing was there.
+#
+# Usage:
+#   @timed('sun_rise_set')
+#   def sun_rise_set(...): ...
+#
+#   with span('dlm.load_de421'):
+#       planets = load('de421.bsp')
+#
+#   register_cache('sun_rise_set cache', lambda: (cache.hits, cache.misses))
+#
+#   first_frame('alarm')   # once, when the first frame is on the screen
+
+_setting = os.environ.get('SSAC_PROFILE', '')
+enabled = bool(_setting) or '--profile' in sys.argv
+
+MAX_SAMPLES = 10000  # latency samples kept per name for the percentiles, reservoir sampled
+
+# Statistics of a named hot path
+class Stat:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0  # seconds
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(elapsed)
+        else:  # keep a uniform sample of all the calls
+            i = random.randrange(self.count)
+            if i < MAX_SAMPLES:
+                self.samples[i] = elapsed
+
+    # Return the p-th percentile of the sampled latencies, in seconds
+    def percentile(self, p):
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(len(s) * p / 100))] if s else 0.0
+
+# Return seconds since the process started, from /proc on Linux,
+# otherwise since this module was imported
+def _process_age():
+    try:
+        with open('/proc/self/stat') as f:
+            start = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return max(0.0, float(f.read().split()[0]) - start)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+_started = time.perf_counter() - _process_age()  # process start on the perf_counter() clock
+
+stats = {}   # name -> Stat
+caches = {}  # name -> function returning (hits, misses)
+
+# Return the Stat of a name, created at the first use
+def stat(name):
+    s = stats.get(name)
+    if s is None:
+        s = stats[name] = Stat()
+    return s
+
+# Decorator to time every call of a function under a name
+def timed(name):
+    def decorate(f):
+        if not enabled:
+            return f
+        s = stat(name)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                s.add(time.perf_counter() - t)
+        return wrapper
+    return decorate
+
+_null_span = contextlib.nullcontext()
+
+@contextlib.contextmanager
+def _span(s):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        s.add(time.perf_counter() - t)
+
+# Context manager to time a block of code under a name
+def span(name):
+    if not enabled:
+        return _null_span
+    return _span(stat(name))
+
+# Register a cache to report the hit rate of
+#   counts: function returning (hits, misses)
+def register_cache(name, counts):
+    caches[name] = counts
+
+# Record the time from the process start to the first frame of an entry point,
+# including the interpreter startup and all the imports, return it in seconds
+# The time is measured always, it is recorded as '<name>.time_to_first_frame' when enabled.
+def first_frame(name):
+    elapsed = time.perf_counter() - _started
+    if enabled:
+        stat(name + '.time_to_first_frame').add(elapsed)
+    return elapsed
+
+# Write the report
+def report(f=None):
+    f = f or sys.stderr
+    print("===== ssac profile, pid %d, %s =====" % (os.getpid(), time.strftime('%Y-%m-%d %H:%M:%S')), file=f)
+    print("%-28s %10s %12s %10s %10s %10s %10s %10s" % ('name', 'calls', 'total ms', 'mean us',
+            'p50 us', 'p90 us', 'p99 us', 'max us'), file=f)
+    for name, s in sorted(stats.items(), key=lambda i: -i[1].total):
+        if s.count == 0:
+            continue
+        print("%-28s %10d %12.3f %10.1f %10.1f %10.1f %10.1f %10.1f" % (name, s.count, s.total * 1e3,
+                s.total / s.count * 1e6, s.percentile(50) * 1e6, s.percentile(90) * 1e6,
+                s.percentile(99) * 1e6, s.max * 1e6), file=f)
+    for name, counts in sorted(caches.items()):
+        hits, misses = counts()
+        total = hits + misses
+        print("%-28s hits %d, misses %d, hit rate %s" % (name, hits, misses,
+                "%.1f%%" % (hits / total * 100) if total else '-'), file=f)
+    f.flush()
+
+# Write the report to where SSAC_PROFILE says
+def dump(*args):
+    if _setting and _setting.lower() not in ('1', 'true', 'yes'):
+        with open(_setting, 'a') as f:
+            report(f)
+    else:
+        report()
+
+if enabled:
+    atexit.register(dump)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, dump)
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+from suncache import cached_sun_rise_set
+from tzresolve import cell_precision, timezone_name, timezone_of
+
+# Startup snapshot of alarm_simple1.py and tk_clock.py
+#
+# What the first frame needs is the timezone of the observer and sunrise/sunset
+# of a few days. Finding the timezone loads the TimezoneFinder polygons, the
+# slowest part of a cold start by far, although the answer is the same every
+# time on a device that doesn't move. So every run saves the resolved timezone
+# name and the sunrise/sunset of the next SNAPSHOT_DAYS days to a small JSON
+# file, and the next run takes them from there: no TimezoneFinder, no NumPy and
+# no solar math before the first frame.
+#
+# The file is in the user cache directory ($XDG_CACHE_HOME/ssac, ~/.cache/ssac by
+# default), not in the source tree which may be read only. Failing to write it
+# is reported and otherwise ignored, the next start is just a cold one.
+#
+# A snapshot is for one timezone cell (see tzresolve.cell_precision), a run at
+# another position finds no snapshot and resolves everything again. Days the
+# snapshot doesn't have are calculated and added, and the file is written again
+# only when something was added.
+#
+# Example:
+#   snap = load(lat, lon) or Snapshot.resolve(lat, lon)
+#   noons = get_noons(year, month, day, lat, lon, snap.timezone())
+#   jt, ha, dec = snap.sun_rise_set(n, lon, lat)
+#   ...   # first frame
+#   snap.fill(n)
+#   snap.save()
+
+DEFAULT_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')),
+        'ssac', 'snapshot.json')
+SNAPSHOT_DAYS = 30  # days after the first day of a run kept in a snapshot
+VERSION = 1
+
+class Snapshot:
+    #   lat, lon: observer latitude/longitude, rounded to the timezone cell
+    #   tz_name: timezone name from tzresolve.timezone_name(), None when there is none
+    #   days: dict J2000 day number -> sunclock.sun_rise_set() result
+    def __init__(self, lat, lon, tz_name, days=None, path=DEFAULT_PATH):
+        self.lat, self.lon, self.tz_name = lat, lon, tz_name
+        self.days = days or {}
+        self.path = path
+        self.dirty = False  # something was added since the snapshot was loaded
+        self._tz = None
+
+    # Return a new snapshot of a position, the timezone is found by TimezoneFinder
+    @classmethod
+    def resolve(cls, lat, lon, path=DEFAULT_PATH):
+        snap = cls(*cell(lat, lon), timezone_name(lat, lon), path=path)
+        snap.dirty = True
+        return snap
+
+    # Whether the snapshot is of the timezone cell of a position
+    def covers(self, lat, lon):
+        return cell(lat, lon) == (self.lat, self.lon)
+
+    # Return the timezone object, see tzresolve.timezone_of()
+    def timezone(self):
+        if self._tz is None:
+            self._tz = timezone_of(self.tz_name, self.lon)
+        return self._tz
+
+    # Same as suncache.cached_sun_rise_set(), days of the snapshot cell are
+    # taken from the snapshot or calculated and added to it
+    def sun_rise_set(self, n, lo, la):
+        if not self.covers(la, lo):
+            return cached_sun_rise_set(n, lo, la)
+        value = self.days.get(n)
+        if value is None:
+            value = self.days[n] = tuple(cached_sun_rise_set(n, lo, la))
+            self.dirty = True
+        return value
+
+    # Calculate the days from n to n + count - 1 the snapshot doesn't have yet,
+    # and drop the days before n
+    def fill(self, n, count=SNAPSHOT_DAYS):
+        old = [k for k in self.days if k < n]
+        for k in old:
+            del self.days[k]
+        self.dirty = self.dirty or bool(old)
+        for k in range(n, n + count):
+            try:
+                self.sun_rise_set(k, self.lon, self.lat)
+            except ValueError:  # polar day or night, the caller finds out when it asks for the day
+                pass
+
+    # Write the snapshot when something was added, an existing file is replaced at once
+    # Return False when it could not be written, the error is reported to stderr
+    def save(self, path=None):
+        if not self.dirty:
+            return True
+        path = path or self.path
+        tmp = path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump({'version': VERSION, 'saved': time.time(), 'lat': self.lat, 'lon': self.lon,
+                        'tz': self.tz_name, 'days': {str(k): v for k, v in sorted(self.days.items())}}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print("cannot save the startup snapshot: %s" % e, file=sys.stderr)
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            return False
+        self.dirty = False
+        return True
+
+# Return (latitude, longitude) of the timezone cell of a position
+def cell(lat, lon):
+    return round(lat, cell_precision), round(lon, cell_precision)
+
+# Return the Snapshot saved for the timezone cell of a position,
+# None when there is no snapshot, it is unreadable, damaged or of another cell
+def load(lat, lon, path=DEFAULT_PATH):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != VERSION or cell(lat, lon) != (data['lat'], data['lon']):
+            return None
+        days = {int(k): tuple(float(x) for x in v) for k, v in data['days'].items()}
+        if not all(len(v) == 3 for v in days.values()) or not isinstance(data['tz'], (str, type(None))):
+            return None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):  # a truncated or edited file is a miss
+        return None
+    return Snapshot(data['lat'], data['lon'], data['tz'], days, path)
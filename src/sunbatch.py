@@ -0,0 +1,217 @@
+import numpy as np
+from instrument import timed
+
+# Vectorized versions of the sunclock.py solar math, every function takes NumPy
+# arrays (or anything broadcastable, including plain scalars) and evaluates the
+# same formulas as the scalar functions in sunclock.py in one pass.
+#
+# Example, a year of sunrises for many sites at once:
+#   n = np.arange(7385, 7750)[:, None]   # days, as a column
+#   lo, la = lons[None, :], lats[None, :] # sites, as a row
+#   jt, ha, dec, polar_day, polar_night = sun_rise_set_batch(n, lo, la)
+#   rise, sets = jt - ha, jt + ha          # shape (365, number of sites)
+#
+# Self check of altitude_crossings() against the scalar functions:
+#   python sunbatch.py check
+
+# sine of the altitude of the Sun's center at sunrise/sunset,
+# atmospheric refraction and angle subtended by solar disc correction included
+SIN_RISE_ALTITUDE = np.sin(np.radians(-0.83))
+SIN_OBLIQUITY = np.sin(np.radians(23.44))
+
+# Return approximation of local mean solar noon, as J2000 Julian day, see sunclock.py
+#   n: number of days since Jan 1st, 2000 12:00
+#   lo: longitude of the observer, west is negative, in degree
+#   dt: optional TT - UT in seconds, see deltat.delta_t_array()
+def local_mean_solar_noon(n, lo, dt=None):
+    if dt is None:
+        return np.add(n, 0.0008) - np.divide(lo, 360.0)
+    return np.add(n, np.divide(dt, 86400)) - np.divide(lo, 360.0)
+
+# Return the Earth's solar orbit mean anomaly, in degree
+#   j: time, J2000 Julian day with fraction
+def solar_mean_anomaly(j):
+    return np.mod(357.5291 + 0.98560028 * np.asarray(j, dtype=float), 360)
+
+# Return the Earth's equation of the center from mean anomaly, truncated at 3rd term, in degree
+#   m: solar mean anomaly of the Earth, in degree
+def equation_of_the_center(m):
+    m = np.radians(m)
+    return 1.9148*np.sin(m) + 0.02*np.sin(2*m) + 0.0003*np.sin(3*m)
+
+# Calculate solar ecliptic longitude from mean anomaly and equation of the center, in degree
+#   m: solar mean anomaly of the Earth, in degree
+#   c: equation of the center of the Earth, in degree
+def solar_ecliptic_longitude(m, c):
+    return np.mod(np.add(m, c) + 180 + 102.9372, 360)
+
+# Calculate the time of local true solar transit (solar noon), in Julian date
+#   j: time of mean solar noon, as J2000 Julian day
+#   m: solar mean anomaly at j, in degree
+#   l: solar ecliptic longitude at j, in degree
+def local_true_solar_transit(j, m, l):
+    return 2451545.0 + j + 0.0053*np.sin(np.radians(m)) - 0.0069*np.sin(2*np.radians(l))
+
+# Calculate the sine of the declination of the Sun from its ecliptic longitude
+#   l: solar ecliptic longitude, in degree
+def sin_declination_of_sun(l):
+    return np.sin(np.radians(l)) * SIN_OBLIQUITY
+
+# Calculate the cosine of the hour angle of sunrise or sunset, NOT clipped:
+# a value below -1 means the Sun never sets (polar day), above 1 means the Sun
+# never rises (polar night)
+#   d: sine of the declination of the Sun
+#   la: latitude of the observer, north is positive, in degree
+#   sin_alt: sine of the altitude of the Sun's center to cross, sunrise by default
+def cos_hour_angle(d, la, sin_alt=SIN_RISE_ALTITUDE):
+    la_r = np.radians(la)
+    return (sin_alt - np.sin(la_r) * d) / (np.cos(la_r) * np.cos(np.arcsin(d)))
+
+# Calculate the hour angle of sunrise or sunset, in fraction of Julian day
+# Instead of a math domain error, polar day gives 0.5 (the Sun is up all day)
+# and polar night gives 0 (the Sun never rises), use the masks to tell them apart
+#   d: sine of the declination of the Sun
+#   la: latitude of the observer, north is positive, in degree
+# Return a tuple with 3 arrays:
+#   0: hour angle, in fraction of Julian day
+#   1: polar day mask
+#   2: polar night mask
+def julian_hour_angle(d, la):
+    cha = cos_hour_angle(d, la)
+    polar_day = cha < -1
+    polar_night = cha > 1
+    ha = np.arccos(np.clip(cha, -1, 1)) / (2*np.pi)
+    return ha, polar_day, polar_night
+
+# Batch version of sunclock.sun_rise_set(), arguments are broadcast against each other
+# Input:
+#   n: number of days since Jan 1st, 2000 12:00
+#   lo: longitude of the observer, west is negative, in degree
+#   la: latitude of the observer, north is positive, in degree
+#   dt: optional TT - UT in seconds, see deltat.delta_t_array()
+# Return a tuple with 5 arrays of the broadcast shape:
+#   0: solar transit time, in Julian day with fraction
+#   1: sunset hour angle, in fraction of Julian day
+#   2: declination of the Sun at the date, in radians
+#   3: polar day mask, the Sun does not set at the date
+#   4: polar night mask, the Sun does not rise at the date
+@timed('sun_rise_set_batch')
+def sun_rise_set_batch(n, lo, la, dt=None):
+    n, lo, la = np.broadcast_arrays(np.asarray(n, dtype=float),
+            np.asarray(lo, dtype=float), np.asarray(la, dtype=float))
+    j = local_mean_solar_noon(n, lo, dt)
+    m = solar_mean_anomaly(j)
+    c = equation_of_the_center(m)
+    l = solar_ecliptic_longitude(m, c)
+    jt = local_true_solar_transit(j, m, l)
+    d = sin_declination_of_sun(l)
+    ha, polar_day, polar_night = julian_hour_angle(d, la)
+    return jt, ha, np.arcsin(d), polar_day, polar_night
+
+# Altitudes of the Sun's center of the usual events, in degree
+ALTITUDES = {
+    'sunrise': -0.83,
+    'civil': -6.0,         # civil twilight
+    'nautical': -12.0,     # nautical twilight
+    'astronomical': -18.0, # astronomical twilight
+    'golden_hour': 6.0,    # golden hour is from here down to -4
+    'blue_hour': -4.0,     # blue hour is from here down to -6
+}
+
+# Calculate the times the Sun crosses several altitudes in the morning and in the
+# evening, for every day and observer in one pass, without time stepping
+# Arguments n, lo, la, dt are broadcast against each other, see sun_rise_set_batch()
+#   altitudes: list of altitudes in degree, or names in ALTITUDES
+# Return a tuple with 4 arrays of the broadcast shape plus a last axis of len(altitudes):
+#   0: morning crossing (the Sun going up), in Julian day, NaN when there is none
+#   1: evening crossing (the Sun going down), in Julian day, NaN when there is none
+#   2: mask of the days the Sun stays above the altitude
+#   3: mask of the days the Sun stays below the altitude
+# Like sunclock.sun_rise_set(), the declination is the one at the transit of the day.
+def altitude_crossings(n, lo, la, altitudes, dt=None):
+    alt = np.array([ALTITUDES[a] if isinstance(a, str) else a for a in altitudes], dtype=float)
+    jt, ha, dec, polar_day, polar_night = sun_rise_set_batch(n, lo, la, dt)
+    cha = cos_hour_angle(np.sin(dec)[..., None], np.asarray(la, dtype=float)[..., None],
+            np.sin(np.radians(alt)))
+    above, below = cha < -1, cha > 1
+    ha = np.arccos(np.clip(cha, -1, 1)) / (2*np.pi)
+    ha[above | below] = np.nan
+    return jt[..., None] - ha, jt[..., None] + ha, above, below
+
+# Batch version of sunclock.equ2hor(), arguments are broadcast against each other
+#   ha: hour angle, in fraction of a Julian day
+#   dec: declination, in radians
+#   la: latitude of the observer on the Earth, in degree
+# Return a contiguous array of the broadcast shape plus a last axis of 2:
+#   [..., 0]: azimuth, measured from the north, positive to east, in degree
+#   [..., 1]: altitude, in degree
+def equ2hor_batch(ha, dec, la):
+    ha_r = np.asarray(ha, dtype=float) * np.pi * 2
+    dec = np.asarray(dec, dtype=float)
+    la_r = np.radians(la)
+    ha_r, dec, la_r = np.broadcast_arrays(ha_r, dec, la_r)
+    out = np.empty(ha_r.shape + (2,))
+    out[..., 0] = np.degrees(np.arctan2(np.sin(ha_r),
+            np.cos(ha_r) * np.sin(la_r) - np.tan(dec) * np.cos(la_r))) + 180
+    out[..., 1] = np.degrees(np.arcsin(np.sin(la_r) * np.sin(dec)
+            + np.cos(la_r) * np.cos(dec) * np.cos(ha_r)))
+    return out
+
+# Calculate the horizontal coordinates of the Sun from sunrise to sunset for
+# every given day, in one call
+#   ha: sunset hour angle of each day, in fraction of Julian day, as from sun_rise_set()
+#   dec: declination of the Sun of each day, in radians
+#   la: latitude of the observer on the Earth, in degree
+#   segments: number of segments of each track, a track has segments + 1 points
+# Return a contiguous array of shape ha.shape + (segments + 1, 2), see equ2hor_batch()
+def sun_tracks(ha, dec, la, segments):
+    ha = np.asarray(ha, dtype=float)[..., None]
+    steps = np.linspace(-1.0, 1.0, segments + 1)  # from sunrise to sunset
+    return equ2hor_batch(ha * steps, np.asarray(dec, dtype=float)[..., None],
+            np.asarray(la, dtype=float)[..., None])
+
+# Self check of altitude_crossings() against the scalar sunclock.py functions: the
+# sunrise crossings are those of sun_rise_set(), the Sun is at the altitude at every
+# crossing, and a day without a crossing is one the Sun stays above or below the
+# altitude all day, as masked; at the sunrise altitude sun_rise_set() fails on it
+# Return the number of (day, latitude) pairs of polar day or night checked
+def check(days=range(0, 366, 5), lats=(-89, -75, -66, -45, 0, 34.4, 60, 66, 70, 80, 89), lo=-119.8):
+    import math
+    import sunclock
+    names = list(ALTITUDES)
+    rise = names.index('sunrise')
+    morning, evening, above, below = altitude_crossings(np.array(days)[:, None], lo,
+            np.array(lats, dtype=float)[None, :], names)
+    polar = 0
+    for i, n in enumerate(days):
+        j = sunclock.local_mean_solar_noon(n, lo)
+        m = sunclock.solar_mean_anomaly(j)
+        l = sunclock.solar_ecliptic_longitude(m, sunclock.equation_of_the_center(m))
+        jt = sunclock.local_true_solar_transit(j, m, l)
+        dec = math.asin(sunclock.sin_declination_of_sun(l))
+        for k, la in enumerate(lats):
+            try:
+                _, ha, _ = sunclock.sun_rise_set(n, lo, la)
+            except ValueError:  # polar day or night
+                assert above[i, k, rise] or below[i, k, rise], (n, la)
+                polar += 1
+            else:
+                assert abs(morning[i, k, rise] - (jt - ha)) < 1e-9, (n, la)
+                assert abs(evening[i, k, rise] - (jt + ha)) < 1e-9, (n, la)
+            for a, name in enumerate(names):
+                alt = ALTITUDES[name]
+                assert above[i, k, a] == (sunclock.equ2hor(0.5, dec, la)[1] > alt), (n, la, name)  # at midnight
+                assert below[i, k, a] == (sunclock.equ2hor(0, dec, la)[1] < alt), (n, la, name)  # at transit
+                if above[i, k, a] or below[i, k, a]:
+                    assert np.isnan(morning[i, k, a]) and np.isnan(evening[i, k, a]), (n, la, name)
+                    continue
+                for t in (morning[i, k, a], evening[i, k, a]):
+                    assert abs(sunclock.equ2hor(t - jt, dec, la)[1] - alt) < 1e-6, (n, la, name, t - jt)
+    assert polar > 0
+    return polar
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['check']:
+        print("%d polar days and nights" % check())
+        print("check OK")
@@ -0,0 +1,165 @@
+import os
+import struct
+from collections import OrderedDict
+from sunclock import sun_rise_set
+from instrument import register_cache
+
+# A memoizing cache in front of sunclock.sun_rise_set()
+#
+# The result of sun_rise_set() only depends on the day number and the observer
+# position, so results are kept per (day, quantized latitude, quantized longitude).
+# The position is rounded to `precision` decimal places and the math is done for
+# the rounded position, so every position inside a grid cell gets the same result.
+# 2 decimal places is about 1 km, which moves sunrise by a few seconds at most.
+#
+# Example, a service answering repeated "sunrise for city X" queries:
+#   cache = SunCache(precision=2, maxsize=100000, path='sun.cache')
+#   jt, ha, dec = cache.sun_rise_set(n, lon, lat)
+#   ...
+#   cache.save()
+#
+# Self check:
+#   python suncache.py check
+
+# on-disk record: day, latitude and longitude as quantized integers,
+# then transit, hour angle, declination as doubles
+_MAGIC = b'SSAC1\n'
+_HEADER = struct.Struct('<6sB')  # magic, precision
+_RECORD = struct.Struct('<iii3d')
+
+class SunCache:
+    # precision: decimal places kept of latitude/longitude in degree
+    # maxsize: maximum number of cached days, the least recently used ones are dropped
+    # path: optional file to load from now and to save to by save()
+    def __init__(self, precision=2, maxsize=65536, path=None):
+        self.precision = precision
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._scale = 10 ** precision
+        self._data = OrderedDict()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self._data)
+
+    # Return the cache key of a day and an observer position
+    # n is rounded to the nearest day like the position, int() would truncate 7000.9 to 7000
+    def key(self, n, lo, la):
+        return (round(n), round(la * self._scale), round(lo * self._scale))
+
+    # Same as sunclock.sun_rise_set(), but for the observer position rounded to
+    # the cache precision, and only calculated once for each key
+    def sun_rise_set(self, n, lo, la):
+        k = self.key(n, lo, la)
+        try:
+            value = self._data[k]
+        except KeyError:
+            self.misses += 1
+            value = sun_rise_set(k[0], k[2] / self._scale, k[1] / self._scale)
+            self._put(k, value)
+            return value
+        self.hits += 1
+        self._data.move_to_end(k)
+        return value
+
+    def _put(self, k, value):
+        self._data[k] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)  # drop the least recently used one
+
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    # Return a dict of the cache counters
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                'maxsize': self.maxsize, 'hit_rate': self.hits / total if total else 0.0}
+
+    # Return the file path to save to or load from
+    def _path(self, path):
+        path = path or self.path
+        if path is None:
+            raise ValueError("no cache file: pass a path or create the SunCache with one")
+        return path
+
+    # Write all cached results to a compact binary file, from least to most recently used
+    def save(self, path=None):
+        path = self._path(path)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, self.precision))
+            for k, v in self._data.items():
+                f.write(_RECORD.pack(k[0], k[1], k[2], *v))
+        os.replace(tmp, path)  # never leave a half written cache file
+
+    # Read results saved by save(), the file must have the same precision
+    def load(self, path=None):
+        path = self._path(path)
+        with open(path, 'rb') as f:
+            buf = f.read()
+        magic, precision = _HEADER.unpack_from(buf)
+        if magic != _MAGIC:
+            raise ValueError("%s is not a sun cache file" % path)
+        if precision != self.precision:
+            raise ValueError("%s has precision %d, expected %d" % (path, precision, self.precision))
+        for r in _RECORD.iter_unpack(buf[_HEADER.size:]):
+            self._put(r[:3], r[3:])
+
+# a cache shared by the programs in this directory
+default_cache = SunCache()
+register_cache('sun_rise_set cache', lambda: (default_cache.hits, default_cache.misses))
+
+# Cached sun_rise_set(), see SunCache.sun_rise_set()
+def cached_sun_rise_set(n, lo, la):
+    return default_cache.sun_rise_set(n, lo, la)
+
+# Self check: results, hit/miss counting, least recently used eviction and a
+# save/load round trip
+def check():
+    import tempfile
+    cache = SunCache(precision=2, maxsize=3)
+    lo, la = -119.8, 34.4
+    assert cache.sun_rise_set(7000, lo, la) == sun_rise_set(7000, lo, la)
+    assert cache.sun_rise_set(7000, lo + 0.001, la - 0.001) == sun_rise_set(7000, lo, la)  # same cell
+    assert cache.sun_rise_set(6999.6, lo, la) == sun_rise_set(7000, lo, la)  # rounded, not truncated
+    assert (cache.hits, cache.misses, len(cache)) == (2, 1, 1)
+    for n in (7001, 7002):
+        cache.sun_rise_set(n, lo, la)
+    cache.sun_rise_set(7000, lo, la)  # now the most recently used, 7001 is the least
+    cache.sun_rise_set(7003, lo, la)  # drops 7001
+    assert [k[0] for k in cache._data] == [7002, 7000, 7003]
+    assert (cache.hits, cache.misses) == (3, 4)
+    cache.sun_rise_set(7001, lo, la)  # calculated again, drops 7002
+    assert [k[0] for k in cache._data] == [7000, 7003, 7001]
+    assert cache.stats() == {'hits': 3, 'misses': 5, 'size': 3, 'maxsize': 3, 'hit_rate': 3 / 8}
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'sun.cache')
+        cache.save(path)
+        loaded = SunCache(precision=2, maxsize=2, path=path)  # keeps the 2 most recently used
+        assert list(loaded._data.items()) == list(cache._data.items())[1:]
+        assert (loaded.hits, loaded.misses) == (0, 0)
+        try:
+            SunCache(precision=3, path=path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("cache of another precision loaded")
+    try:
+        SunCache().save()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("save without a path accepted")
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()['hit_rate'] == 0.0
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['check']:
+        check()
+        print("check OK")
@@ -1,15 +1,23 @@
 from math import sin, cos, tan, asin, acos, atan2, pi, radians, degrees
 import math
-import julian
+import sys
+import json
+from itertools import count
+from collections import namedtuple
+from sunjulian import to_jd, from_jd
 from datetime import datetime, timedelta
+from instrument import timed
 
 # Return approximation of local mean solar time noon, expressed as a J2000 Julian day
 # (number of days since Jan 1st, 2000 12:00) with day fration, leap seconds considered
 # https://en.wikipedia.org/wiki/Epoch_(astronomy)#Julian_Dates_and_J2000
 #   n: number of days since Jan 1st, 2000 12:00
 #   lo: longitude west (west is negative, east is positive) of the observer on the Earth, in degree
-def local_mean_solar_noon(n, lo):
-    return (n + 0.0008 - lo / 360.0)
+#   dt: optional TT - UT in seconds, see deltat.py, default is 0.0008 day (about 69 seconds)
+def local_mean_solar_noon(n, lo, dt=None):
+    if dt is None:
+        return (n + 0.0008 - lo / 360.0)
+    return (n + dt / 86400 - lo / 360.0)
 
 # Return the Earth's solar oribit mean anomaly at time specified , in degree
 # https://en.wikipedia.org/wiki/Mean_anomaly
@@ -65,8 +73,10 @@ def julian_hour_angle(d, la):
 #   n: number of days since Jan 1st, 2000 12:00
 #   lo: longitude west (west is negative) of the observer on the Earth, in degree
 #   la: latitude of the observer on the Earth, north is positive, in degree
-def sun_rise_set(n, lo, la):
-    j = local_mean_solar_noon(n, lo)  # local mean solar noon, in J2000 Julian day
+#   dt: optional TT - UT in seconds at the date, see deltat.py
+@timed('sun_rise_set')
+def sun_rise_set(n, lo, la, dt=None):
+    j = local_mean_solar_noon(n, lo, dt)  # local mean solar noon, in J2000 Julian day
     #print("local mean solar noon in J2000: ", j)
     m = solar_mean_anomaly(j)  # solar mean anomaly at local mean solar noon
     c = equation_of_the_center(m)  # equation of the center at the local mean solar noon
@@ -96,33 +106,39 @@ def equ2hor(ha, dec, la):
     a = asin( sin(la_r) * sin(dec) + cos(la_r) * cos(dec) * cos(ha_r))
     return degrees(A)+180, degrees(a)
 
-# print sunrise/sunset date time:
+# A day of sunrise/sunset, datetimes are local (timezone correction added) and naive,
+# horizontal coordinates as returned by equ2hor()
+SunriseRecord = namedtuple('SunriseRecord', ['rise', 'set', 'transit',
+        'rise_azimuth', 'rise_altitude', 'set_azimuth', 'set_altitude'])
+
+# A position of the Sun, datetime is local (timezone correction added) and naive
+SunCoordRecord = namedtuple('SunCoordRecord', ['time', 'azimuth', 'altitude'])
+
+# Yield a SunriseRecord for every day, lazily, stop iterating to stop calculating
 #   y, m, d: year, month (1-12), day(1-31) of the start day
-#   days: number of days to print
+#   days: number of days, None for no end
 #   la, lo: observer latitude/longitude
 #   tz_h: timezone correction, in hours
-def print_sunrise(y, m, d, days, la, lo, tz_h):
-    for i in range(days):
-        j = round(julian.to_jd(datetime(y, m, d, hour=12)) - 2451545 + i)
-        sun_rs = sun_rise_set(j, lo, la)
-        dt_rise = julian.from_jd(sun_rs[0] + tz_h/24 - sun_rs[1])  # sunrise datetime
-        dt_set = julian.from_jd(sun_rs[0] + tz_h/24 + sun_rs[1])  # sunset datetime
+def sunrise_records(y, m, d, days, la, lo, tz_h):
+    n = round(to_jd(datetime(y, m, d, hour=12)) - 2451545)
+    for i in (count() if days is None else range(days)):
+        sun_rs = sun_rise_set(n + i, lo, la)
         h_r = equ2hor(-sun_rs[1], sun_rs[2], la) # sunrise horizontal coordinates
         h_s = equ2hor(sun_rs[1], sun_rs[2], la) # sunset horizontal coordinates
-        print(dt_rise, ",", dt_set, ",", h_r, h_s)
-
-#print_sunrise(2020, 8, 20, 30, 34.4, -119.8, -8)
+        yield SunriseRecord(
+                from_jd(sun_rs[0] + tz_h/24 - sun_rs[1]),  # sunrise datetime
+                from_jd(sun_rs[0] + tz_h/24 + sun_rs[1]),  # sunset datetime
+                from_jd(sun_rs[0] + tz_h/24),  # transit datetime
+                h_r[0], h_r[1], h_s[0], h_s[1])
 
-# print horizontal coordinates of the Sun for a day from sunrise to sunset
-#   y, m, d: year, month (1-12), day(1-31) of the start day
-#   slices: how many points to print except the sunrise and sunset
+# Yield SunCoordRecord of the Sun for a day from sunrise to sunset, lazily
+#   y, m, d: year, month (1-12), day(1-31) of the day
+#   slices: how many points except the sunrise and sunset
 #   la, lo: observer latitude/longitude
 #   tz_h: timezone correction, in hours
-def print_sun_coord(y, m, d, slices, la, lo, tz_h):
-    n = round(julian.to_jd(datetime(y, m, d, hour=12) - timedelta(hours=tz_h)) - 2451545)
+def sun_coord_records(y, m, d, slices, la, lo, tz_h):
+    n = round(to_jd(datetime(y, m, d, hour=12) - timedelta(hours=tz_h)) - 2451545)
     sun_rs = sun_rise_set(n, lo, la)
-    dt_rise = julian.from_jd(sun_rs[0] + tz_h/24 - sun_rs[1])  # sunrise datetime
-    dt_set = julian.from_jd(sun_rs[0] + tz_h/24 + sun_rs[1])  # sunset datetime
     slices = math.floor(slices)
     if (slices <= 0):
         slices = 1
@@ -130,7 +146,53 @@ def print_sun_coord(y, m, d, slices, la, lo, tz_h):
     for i in range(slices + 2):
         j = sun_rs[0] + tz_h/24 - sun_rs[1] + i * step  # time as Julian day
         h = equ2hor(i * step - sun_rs[1], sun_rs[2], la)  # horizontal coordinates
-        print(julian.from_jd(j), h)
+        yield SunCoordRecord(from_jd(j), h[0], h[1])
+
+# ===== formatting stages, take records and yield lines without line ending =====
+
+# Format SunriseRecord as "sunrise , sunset , (azimuth, altitude) (azimuth, altitude)"
+def sunrise_text(records):
+    for r in records:
+        yield "%s , %s , %s %s" % (r.rise, r.set, (r.rise_azimuth, r.rise_altitude),
+                (r.set_azimuth, r.set_altitude))
+
+# Format SunCoordRecord as "time (azimuth, altitude)"
+def sun_coord_text(records):
+    for r in records:
+        yield "%s %s" % (r.time, (r.azimuth, r.altitude))
+
+# Format any records as CSV, with a header line of the field names
+def csv_lines(records):
+    header = True
+    for r in records:
+        if header:
+            yield ','.join(r._fields)
+            header = False
+        yield ','.join(v.isoformat() if isinstance(v, datetime) else repr(v) for v in r)
+
+# Format any records as JSON lines
+def json_lines(records):
+    for r in records:
+        yield json.dumps({k: v.isoformat() if isinstance(v, datetime) else v
+                for k, v in r._asdict().items()})
+
+# ===== sinks =====
+
+# Write lines to a file, standard output by default
+def write_lines(lines, f=None):
+    f = f or sys.stdout
+    for line in lines:
+        f.write(line + '\n')
+
+# print sunrise/sunset date time, see sunrise_records()
+def print_sunrise(y, m, d, days, la, lo, tz_h):
+    write_lines(sunrise_text(sunrise_records(y, m, d, days, la, lo, tz_h)))
+
+#print_sunrise(2020, 8, 20, 30, 34.4, -119.8, -8)
+
+# print horizontal coordinates of the Sun for a day from sunrise to sunset, see sun_coord_records()
+def print_sun_coord(y, m, d, slices, la, lo, tz_h):
+    write_lines(sun_coord_text(sun_coord_records(y, m, d, slices, la, lo, tz_h)))
 
 # print the Sun positions observed from UCSB (34.4N, -119.8E) at Jun 22, 2020
 # 242 time points (including sunrise and sunset)
@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import argparse
+import datetime
+import numpy as np
+from numpy.lib.format import open_memmap
+from sunbatch import sun_rise_set_batch
+from tzresolve import cell_precision, get_timezone, localize
+
+# Annual solar index of a location: daily sunrise, sunset, transit and day length
+# of a span of years, for range, threshold and extremum queries
+#
+# Questions like "earliest sunrise between two dates", "which days are longer than
+# 14 hours" or "first day the sunrise is after 06:30" would otherwise loop over
+# sun_rise_set() day by day. Here all the days are calculated in one
+# sunbatch.sun_rise_set_batch() call and stored, for the timezone cell of the
+# location (see tzresolve.cell_precision), in files of a prefix:
+#   <prefix>.json: location, timezone, first date, number of days
+#   <prefix>.npy: float32 array of shape (days, len(FIELDS)), memory-mapped when read
+#   <prefix>-blocks.npy: minimum, maximum and number of NaN of every field in every BLOCK days
+# A query looks at the blocks first, and only the blocks that can hold the answer
+# and the partial blocks at both ends of the date range are read from the days.
+#
+# Times are local clock hours of the date, in the timezone of the location at its
+# noon. Sunrise/sunset are NaN in polar day and night, day length is 24 or 0 then,
+# and NaN never matches a threshold.
+#
+# Example:
+#   index = get_index('sunindex', 34.4, -119.8, 2024, 2030)
+#   index.extreme('rise', datetime.date(2025, 1, 1), datetime.date(2025, 12, 31))   # earliest sunrise of 2025
+#   index.extreme('set', d0, d1, largest=True)      # latest sunset
+#   index.runs('day_length', d0, d1, above=14)      # days longer than 14 hours, as (first, last) dates
+#   index.first('rise', d0, d1, above=6.5)          # first sunrise after 06:30
+#
+# Self check of the index and its queries against direct calculation:
+#   python sunindex.py check
+
+FIELDS = ('rise', 'set', 'transit', 'day_length', 'utc_offset')  # all in hours
+BLOCK = 32  # days of a min/max block
+
+_J2000_DATE = datetime.date(2000, 1, 1)
+
+# Return the prefix of the index of the timezone cell of a location in a directory
+def index_prefix(directory, lat, lon):
+    return os.path.join(directory, 'sunindex_%.*f_%.*f' % (cell_precision, lat, cell_precision, lon))
+
+# Calculate and write the index of a location
+#   prefix: path prefix of the files
+#   lat, lon: observer latitude/longitude, rounded to the timezone cell
+#   year0, year1: first and last year, both included
+#   tz: timezone of the location, default is tzresolve.get_timezone()
+# Return the header dict
+def build(prefix, lat, lon, year0, year1, tz=None):
+    lat, lon = round(lat, cell_precision), round(lon, cell_precision)
+    tz = tz or get_timezone(lat, lon)
+    start, end = datetime.date(year0, 1, 1), datetime.date(year1 + 1, 1, 1)
+    days = (end - start).days
+    k = (start - _J2000_DATE).days + np.arange(days)  # days since Jan 1st, 2000 of the dates
+    offset = np.empty(days)
+    date = start
+    for i in range(days):  # timezone offset at noon of every date, the only per-day Python work
+        noon = localize(tz, date.year, date.month, date.day)
+        offset[i] = noon.utcoffset().total_seconds() / 3600
+        date += datetime.timedelta(days=1)
+    n = np.round(k - offset / 24)  # J2000 day number of the local noon, see sunjulian.day_number()
+    jt, ha, dec, polar_day, polar_night = sun_rise_set_batch(n, lon, lat)
+    midnight = 2451544.5 + k - offset / 24  # local midnight of the dates, in Julian date
+    up = ~(polar_day | polar_night)
+
+    data = open_memmap(prefix + '.npy.tmp', 'w+', 'float32', (days, len(FIELDS)))
+    data[:, 0] = np.where(up, (jt - ha - midnight) * 24, np.nan)
+    data[:, 1] = np.where(up, (jt + ha - midnight) * 24, np.nan)
+    data[:, 2] = (jt - midnight) * 24
+    data[:, 3] = ha * 48  # 24 in polar day, 0 in polar night, see sunbatch.julian_hour_angle()
+    data[:, 4] = offset
+    data.flush()
+
+    starts = np.arange(0, days, BLOCK)
+    blocks = open_memmap(prefix + '-blocks.npy.tmp', 'w+', 'float32', (starts.size, len(FIELDS), 3))
+    blocks[:, :, 0] = np.fmin.reduceat(data, starts, axis=0)  # NaN only when the whole block is
+    blocks[:, :, 1] = np.fmax.reduceat(data, starts, axis=0)
+    blocks[:, :, 2] = np.add.reduceat(np.isnan(data), starts, axis=0)
+    blocks.flush()
+
+    header = {'lat': lat, 'lon': lon, 'tz': str(tz), 'start': start.isoformat(), 'days': days,
+            'block': BLOCK, 'fields': FIELDS}
+    with open(prefix + '.json.tmp', 'w') as f:
+        json.dump(header, f, indent=2)
+    del data, blocks
+    # The files are written under temporary names and renamed at the end, an index
+    # open in another process keeps its old mappings. The old header goes first and
+    # the new one comes last, its presence means the arrays are complete.
+    if os.path.exists(prefix + '.json'):
+        os.remove(prefix + '.json')
+    os.replace(prefix + '.npy.tmp', prefix + '.npy')
+    os.replace(prefix + '-blocks.npy.tmp', prefix + '-blocks.npy')
+    os.replace(prefix + '.json.tmp', prefix + '.json')
+    return header
+
+# Return the SunIndex of the timezone cell of a location in a directory,
+# built first when there is none covering the years
+def get_index(directory, lat, lon, year0, year1):
+    prefix = index_prefix(directory, lat, lon)
+    if os.path.exists(prefix + '.json'):
+        index = SunIndex(prefix)
+        if index.start.year <= year0 and index.end.year > year1:
+            return index
+    os.makedirs(directory, exist_ok=True)
+    build(prefix, lat, lon, year0, year1)
+    return SunIndex(prefix)
+
+# Return the test of a threshold query on values, see SunIndex.runs()
+def _match(v, above, below):
+    ok = np.ones(np.shape(v), dtype=bool)
+    if above is not None:
+        ok &= v > above
+    if below is not None:
+        ok &= v < below
+    return ok
+
+# An index opened for reading, memory-mapped
+class SunIndex:
+    def __init__(self, prefix):
+        with open(prefix + '.json') as f:
+            self.header = json.load(f)
+        self.data = np.load(prefix + '.npy', mmap_mode='r')
+        self.blocks = np.load(prefix + '-blocks.npy')  # small, kept in memory
+        self.start = datetime.date.fromisoformat(self.header['start'])
+        self.end = self.start + datetime.timedelta(days=self.header['days'])  # first date not in the index
+        self.block = self.header['block']
+
+    # Return the index of a date
+    def date_index(self, date):
+        k = (date - self.start).days
+        if not 0 <= k < self.header['days']:
+            raise ValueError("%s is not in the index" % date)
+        return k
+
+    # Return the date of an index
+    def date_of(self, k):
+        return self.start + datetime.timedelta(days=int(k))
+
+    # Return the column of a field and the range of indexes of a date range, both dates included
+    def _range(self, field, date0, date1):
+        k0, k1 = self.date_index(date0), self.date_index(date1) + 1
+        if k1 <= k0:
+            raise ValueError("%s is after %s" % (date0, date1))
+        return FIELDS.index(field), k0, k1
+
+    # Return the values of a field from date0 to date1, both included
+    def values(self, field, date0, date1):
+        f, k0, k1 = self._range(field, date0, date1)
+        return np.array(self.data[k0:k1, f])
+
+    # Split the indexes k0 to k1 in a partial block at the head, whole blocks and
+    # a partial block at the tail, return a list of (start, end, block) in order,
+    # block is the block index of a whole block, None for a partial one
+    def _pieces(self, k0, k1):
+        b0, b1 = -(-k0 // self.block), k1 // self.block
+        if b0 >= b1:
+            return [(k0, k1, None)]
+        pieces = [(k0, b0 * self.block, None)] if k0 < b0 * self.block else []
+        pieces += [(b * self.block, (b + 1) * self.block, b) for b in range(b0, b1)]
+        if b1 * self.block < k1:
+            pieces.append((b1 * self.block, k1, None))
+        return pieces
+
+    # Return (date, value) of the smallest, or largest, value of a field from date0
+    # to date1, both included, the first date when there are several,
+    # (None, nan) when all values are NaN
+    def extreme(self, field, date0, date1, largest=False):
+        f, k0, k1 = self._range(field, date0, date1)
+        pick = np.fmax if largest else np.fmin
+        pieces = self._pieces(k0, k1)
+        best = np.nan
+        for start, end, b in pieces:
+            best = pick(best, self.blocks[b, f, int(largest)] if b is not None else pick.reduce(self.data[start:end, f]))
+        if np.isnan(best):
+            return None, best
+        for start, end, b in pieces:  # the first piece holding the best value
+            if b is not None and self.blocks[b, f, int(largest)] != best:
+                continue
+            hit = np.flatnonzero(self.data[start:end, f] == best)
+            if hit.size:
+                return self.date_of(start + hit[0]), float(best)
+
+    # Return the first date from date0 to date1 the value of a field is above
+    # and/or below thresholds, None when there is none
+    def first(self, field, date0, date1, above=None, below=None):
+        f, k0, k1 = self._range(field, date0, date1)
+        for start, end, b in self._pieces(k0, k1):
+            if b is not None and not self._may_match(b, f, above, below):
+                continue
+            hit = np.flatnonzero(_match(self.data[start:end, f], above, below))
+            if hit.size:
+                return self.date_of(start + hit[0])
+        return None
+
+    # Return the dates from date0 to date1 the value of a field is above and/or
+    # below thresholds, as a list of (first date, last date) of consecutive days
+    def runs(self, field, date0, date1, above=None, below=None):
+        f, k0, k1 = self._range(field, date0, date1)
+        mask = np.zeros(k1 - k0, dtype=bool)
+        for start, end, b in self._pieces(k0, k1):
+            if b is not None:
+                if not self._may_match(b, f, above, below):
+                    continue
+                lo, hi, nan = self.blocks[b, f]
+                if nan == 0 and _match(lo, above, below) and _match(hi, above, below):  # the whole block matches
+                    mask[start - k0:end - k0] = True
+                    continue
+            mask[start - k0:end - k0] = _match(self.data[start:end, f], above, below)
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+        return [(self.date_of(k0 + a), self.date_of(k0 + b - 1)) for a, b in zip(edges[0::2], edges[1::2])]
+
+    # Whether some day of a whole block can match the thresholds
+    def _may_match(self, b, f, above, below):
+        lo, hi = self.blocks[b, f, :2]
+        if np.isnan(lo):
+            return False
+        return (above is None or hi > above) and (below is None or lo < below)
+
+# Parse hours like '14', '6.5' or '06:30'
+def hours(s):
+    if ':' in s:
+        h, m = s.split(':')
+        return int(h) + int(m) / 60
+    return float(s)
+
+# Format hours like 06:30:15
+def hms(h):
+    s = round(h * 3600)
+    return '%s%02d:%02d:%02d' % ('-' if s < 0 else '', abs(s) // 3600, abs(s) // 60 % 60, abs(s) % 60)
+
+# Return the fields of a date calculated directly with the scalar sunclock.py
+# functions, day by day, see build()
+def direct(lat, lon, tz, date):
+    import math
+    import sunclock
+    offset = localize(tz, date.year, date.month, date.day).utcoffset().total_seconds() / 3600
+    k = (date - _J2000_DATE).days
+    n = round(k - offset / 24)
+    midnight = 2451544.5 + k - offset / 24
+    j = sunclock.local_mean_solar_noon(n, lon)
+    m = sunclock.solar_mean_anomaly(j)
+    l = sunclock.solar_ecliptic_longitude(m, sunclock.equation_of_the_center(m))
+    jt = sunclock.local_true_solar_transit(j, m, l)
+    try:
+        _, ha, _ = sunclock.sun_rise_set(n, lon, lat)
+        rise, sets, length = (jt - ha - midnight) * 24, (jt + ha - midnight) * 24, ha * 48
+    except ValueError:  # polar day or night, told apart by the altitude at transit
+        dec = math.asin(sunclock.sin_declination_of_sun(l))
+        rise = sets = math.nan
+        length = 24.0 if sunclock.equ2hor(0, dec, lat)[1] > -0.83 else 0.0
+    return rise, sets, (jt - midnight) * 24, length, offset
+
+# Self check: the index of a location is built in a temporary directory, its values
+# are compared with direct() day by day, and the range, threshold and point queries
+# with the same queries answered by scanning all the values of the range
+def check(locations=((34.4, -119.8), (78.2, 15.6)), year0=2024, year1=2025, queries=300, seed=1):
+    import random
+    import tempfile
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as d:
+        for lat, lon in locations:
+            tz = get_timezone(lat, lon)
+            prefix = index_prefix(d, lat, lon)
+            build(prefix, lat, lon, year0, year1, tz)
+            index = SunIndex(prefix)
+            days = index.header['days']
+            dates = [index.date_of(k) for k in range(days)]
+            expect = np.array([direct(lat, lon, tz, date) for date in dates])
+            data = np.array(index.data)
+            assert np.array_equal(np.isnan(data), np.isnan(expect)), (lat, lon)
+            assert np.nanmax(np.abs(data - expect)) < 1e-4, (lat, lon, np.nanmax(np.abs(data - expect)))
+            for _ in range(queries):
+                k0 = rng.randrange(days)
+                k1 = min(days, k0 + rng.choice((1, 5, BLOCK, 3 * BLOCK + 7, days)))  # k1 not included
+                f = rng.randrange(len(FIELDS) - 1)
+                field, v = FIELDS[f], data[k0:k1, f]
+                d0, d1 = dates[k0], dates[k1 - 1]
+                k = rng.randrange(k0, k1)
+                assert np.array_equal(index.values(field, dates[k], dates[k]), data[k:k + 1, f], equal_nan=True)
+                for largest in (False, True):
+                    date, value = index.extreme(field, d0, d1, largest)
+                    if np.isnan(v).all():
+                        assert date is None and np.isnan(value)
+                    else:
+                        best = np.nanargmax(v) if largest else np.nanargmin(v)
+                        assert (date, value) == (dates[k0 + best], float(v[best])), (field, d0, d1, largest)
+                limit = float(np.nanquantile(v, rng.random())) if not np.isnan(v).all() else 12.0
+                for above, below in ((limit, None), (None, limit), (limit - 1, limit + 1)):
+                    ok = np.ones(v.size, dtype=bool)
+                    if above is not None:
+                        ok &= v > above
+                    if below is not None:
+                        ok &= v < below
+                    hit = np.flatnonzero(ok)
+                    assert index.first(field, d0, d1, above, below) == (dates[k0 + hit[0]] if hit.size else None)
+                    runs = [(dates[k0 + a], dates[k0 + b])
+                            for a, b in zip(hit[np.r_[True, np.diff(hit) > 1]], hit[np.r_[np.diff(hit) > 1, True]])] if hit.size else []
+                    assert index.runs(field, d0, d1, above, below) == runs, (field, d0, d1, above, below)
+            polar = int(np.isnan(data[:, 0]).sum())
+            print("%g %g: %d days, %d polar, %d queries" % (lat, lon, days, polar, queries))
+            del index, data  # the memory-mapped files are removed with the directory
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['check']:
+        check()
+        print("check OK")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='Annual solar index of a location, see sunindex.py.')
+    parser.add_argument('--lat', help='observer latitude', type=float, default=34.4)
+    parser.add_argument('--lon', help='observer longitude', type=float, default=-119.8)
+    parser.add_argument('--years', help='first and last year of the index', type=int, nargs=2, default=[2020, 2030])
+    parser.add_argument('--dir', help='directory of the index files (default sunindex)', default='sunindex')
+    parser.add_argument('--from', help='first date of the query, like 2024-01-01', dest='date0', type=datetime.date.fromisoformat)
+    parser.add_argument('--to', help='last date of the query', dest='date1', type=datetime.date.fromisoformat)
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument('--earliest', help='smallest value of a field', choices=FIELDS, metavar='FIELD')
+    query.add_argument('--latest', help='largest value of a field', choices=FIELDS, metavar='FIELD')
+    query.add_argument('--above', help='days a field is above a value, in hours or HH:MM', nargs=2, metavar=('FIELD', 'VALUE'))
+    query.add_argument('--below', help='days a field is below a value', nargs=2, metavar=('FIELD', 'VALUE'))
+    query.add_argument('--first-above', help='first day a field is above a value', nargs=2, metavar=('FIELD', 'VALUE'))
+    query.add_argument('--first-below', help='first day a field is below a value', nargs=2, metavar=('FIELD', 'VALUE'))
+    args = parser.parse_args()
+
+    index = get_index(args.dir, args.lat, args.lon, *args.years)
+    d0 = args.date0 or index.start
+    d1 = args.date1 or index.end - datetime.timedelta(days=1)
+    if args.earliest or args.latest:
+        date, value = index.extreme(args.earliest or args.latest, d0, d1, largest=bool(args.latest))
+        print(date, hms(value) if date else '-')
+    elif args.above or args.below:
+        field, value = args.above or args.below
+        limits = {'above': hours(value)} if args.above else {'below': hours(value)}
+        for a, b in index.runs(field, d0, d1, **limits):
+            print(a, '-', b)
+    else:
+        field, value = args.first_above or args.first_below
+        limits = {'above': hours(value)} if args.first_above else {'below': hours(value)}
+        print(index.first(field, d0, d1, **limits))
@@ -0,0 +1,88 @@
+import datetime
+from instrument import timed
+
+# Julian date conversions for sunclock, without the julian library
+#
+# Scalar functions work on datetime objects, the *_array functions take and
+# return NumPy arrays so bulk outputs can be converted and formatted without
+# creating a datetime for every row. NumPy is only imported by the array functions.
+#
+# Times are rounded to milliseconds: a Julian date near 2.46e6 stored in a float
+# has a resolution of about 40 microseconds, anything finer is noise.
+
+J2000 = 2451545.0  # Julian date of Jan 1st, 2000 12:00 UTC
+UNIX_EPOCH_JD = 2440587.5  # Julian date of Jan 1st, 1970 00:00 UTC
+SECONDS_PER_DAY = 86400.0
+
+_J2000_DT = datetime.datetime(2000, 1, 1, hour=12)
+_UTC = datetime.timezone.utc
+
+# Convert a datetime to Julian date
+# An aware datetime is converted to UTC first, a naive one is taken as UTC
+#   d: datetime
+def to_jd(d):
+    if d.tzinfo is not None:
+        d = d.astimezone(_UTC).replace(tzinfo=None)
+    delta = d - _J2000_DT
+    return J2000 + delta.days + (delta.seconds + delta.microseconds / 1e6) / SECONDS_PER_DAY
+
+# Convert Julian date to datetime, rounded to milliseconds
+#   j: Julian date
+#   tz: None to return a naive UTC datetime, or a timezone (pytz ones included)
+#       to return an aware datetime in that timezone
+@timed('from_jd')
+def from_jd(j, tz=None):
+    d = _J2000_DT + datetime.timedelta(milliseconds=round((j - J2000) * SECONDS_PER_DAY * 1000))
+    if tz is None:
+        return d
+    return tz.fromutc(d.replace(tzinfo=tz))  # only one conversion, works with pytz too
+
+# Return the J2000 day number of a datetime: number of days since Jan 1st, 2000 12:00
+# rounded to the nearest day, as used by sunclock.sun_rise_set()
+#   d: datetime, see to_jd()
+def day_number(d):
+    return round(to_jd(d) - J2000)
+
+# Convert between Julian date and J2000 Julian day (days since Jan 1st, 2000 12:00)
+def jd_to_j2000(j):
+    return j - J2000
+
+def j2000_to_jd(n):
+    return n + J2000
+
+# Convert between Julian date and POSIX timestamp (seconds since Jan 1st, 1970 UTC)
+def jd_to_unix(j):
+    return (j - UNIX_EPOCH_JD) * SECONDS_PER_DAY
+
+def unix_to_jd(t):
+    return t / SECONDS_PER_DAY + UNIX_EPOCH_JD
+
+# Convert an array of Julian dates to NumPy datetime64 (UTC), rounded to the unit
+#   j: array of Julian dates
+#   tz_h: timezone correction in hours added to the result, to get local times
+#   unit: datetime64 unit like 'ms', 's' or 'm'
+def jd_to_datetime64_array(j, tz_h=0, unit='ms'):
+    import numpy as np
+    per_day = np.timedelta64(1, 'D') / np.timedelta64(1, unit)  # units in a day
+    t = np.rint((np.asarray(j, dtype=float) - UNIX_EPOCH_JD + tz_h / 24) * per_day)
+    return t.astype('int64').astype('datetime64[%s]' % unit)
+
+# Convert an array of NumPy datetime64 (UTC) to Julian dates
+#   d: array of datetime64 of any unit
+def datetime64_to_jd_array(d):
+    import numpy as np
+    ms = np.asarray(d).astype('datetime64[ms]').astype('int64')
+    return ms / (SECONDS_PER_DAY * 1000) + UNIX_EPOCH_JD
+
+# Return the J2000 day numbers of an array of datetime64 (UTC), see day_number()
+def day_number_array(d):
+    import numpy as np
+    return np.rint(datetime64_to_jd_array(d) - J2000).astype('int64')
+
+# Format an array of Julian dates as ISO 8601 strings like '2020-03-12T07:07:00'
+#   j: array of Julian dates
+#   tz_h: timezone correction in hours, to get local times
+#   unit: the last unit shown and rounded to, 's' for seconds, 'm' for minutes
+def jd_to_iso_array(j, tz_h=0, unit='s'):
+    import numpy as np
+    return np.datetime_as_string(jd_to_datetime64_array(j, tz_h, unit))
@@ -0,0 +1,237 @@
+import os
+import time
+import math
+from math import sin, cos, tan, asin, acos, radians, degrees
+from collections import namedtuple
+import sunclock
+
+# Solar models of different precision behind the same interface as sunclock.py:
+#   sun_rise_set(n, lo, la) returns (transit in Julian day, sunset hour angle in
+#   fraction of Julian day, declination in radians)
+#   equ2hor(ha, dec, la) returns (azimuth, altitude) in degree
+#
+# Tiers, from the cheapest:
+#   simple: sunclock.py, the Wikipedia sunrise equation, 3-term equation of center,
+#           2-sine equation of time, fixed 23.44° obliquity
+#   noaa: the NOAA solar calculator (Meeus, Astronomical Algorithms), see doc/design.md,
+#         with T dependent orbit, nutation in longitude and obliquity
+#   ephemeris: Skyfield with DE421, only available when skyfield and dlm/de421.bsp are present
+#
+# simple and noaa keep the Sun's declination constant over the day, the same as
+# sunclock.py, the ephemeris tier iterates sunrise and sunset to the event times.
+#
+# Use select_model() to get a model by name or by tolerance, run this file to
+# measure the cost and error of every available tier against almanac.find_discrete()
+# on the ephemeris, a reference independent of all the tiers:
+#   python sunmodel.py
+#   python sunmodel.py --kernel other.bsp --days 5537 5542   # another kernel and its days
+#
+# Measured with check_models(), 300 random (day, site) pairs between latitude -60
+# and 60 in each of the two short kernels shipped with Skyfield's tests (de441-1969.bsp,
+# days -11115 to -11110, July 1969, and de430-2015-03-02.bsp, days 5537 to 5542,
+# March 2015), on an x86-64 desktop, worst of the two:
+#   tier        cost/call   sunrise/sunset error, max / rms
+#   simple        2.7 us      197 s / 87 s
+#   noaa          4.3 us       53 s / 20 s
+#   ephemeris      11 ms      1.3 s / 0.7 s  (no topocentric parallax, about 0.6 s)
+# The error column of the models list below is what select_model() goes by, the
+# measured maximum rounded up.
+
+DLM_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlm'))
+SUNRISE_ALTITUDE = -0.833  # degree, refraction and solar disc included
+
+# A solar model tier
+#   name: tier name
+#   sun_rise_set, equ2hor: functions, see above
+#   error: measured worst sunrise/sunset time error, in seconds, see check_models()
+#   cost: measured cost of a sun_rise_set() call, in microseconds
+SolarModel = namedtuple('SolarModel', ['name', 'sun_rise_set', 'equ2hor', 'error', 'cost'])
+
+# Return the sunset hour angle in fraction of Julian day, see sunclock.julian_hour_angle()
+#   dec: declination of the Sun, in radians
+#   la: latitude of the observer, in degree
+def hour_angle(dec, la):
+    la_r = radians(la)
+    cha = (sin(radians(SUNRISE_ALTITUDE)) - sin(la_r) * sin(dec)) / (cos(la_r) * cos(dec))
+    return acos(cha) / (2*math.pi)
+
+# ===== noaa tier =====
+
+# Return (declination in radians, equation of time in minutes) of the Sun, NOAA algorithm
+#   jd: Julian date
+def noaa_dec_eot(jd):
+    t = (jd - 2451545.0) / 36525  # Julian centuries since J2000
+    l0 = (280.46646 + t * (36000.76983 + t * 0.0003032)) % 360  # geometric mean longitude
+    m = 357.52911 + t * (35999.05029 - 0.0001537 * t)  # geometric mean anomaly
+    e = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)  # eccentricity of Earth orbit
+    m_r = radians(m)
+    c = (sin(m_r) * (1.914602 - t * (0.004817 + 0.000014 * t))
+            + sin(2 * m_r) * (0.019993 - 0.000101 * t) + sin(3 * m_r) * 0.000289)  # equation of center
+    omega = radians(125.04 - 1934.136 * t)
+    lam = radians(l0 + c - 0.00569 - 0.00478 * sin(omega))  # apparent longitude
+    eps0 = 23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+    eps = radians(eps0 + 0.00256 * cos(omega))  # corrected obliquity
+    dec = asin(sin(eps) * sin(lam))
+    y = tan(eps / 2) ** 2
+    l0_r = radians(l0)
+    eot = 4 * degrees(y * sin(2 * l0_r) - 2 * e * sin(m_r) + 4 * e * y * sin(m_r) * cos(2 * l0_r)
+            - 0.5 * y * y * sin(4 * l0_r) - 1.25 * e * e * sin(2 * m_r))
+    return dec, eot
+
+# sunclock.sun_rise_set() with the NOAA algorithm
+def noaa_sun_rise_set(n, lo, la):
+    jt = 2451545.0 + n - lo / 360  # mean solar noon
+    for i in range(2):  # equation of time at the transit, one refinement is enough
+        dec, eot = noaa_dec_eot(jt)
+        jt = 2451545.0 + n - lo / 360 - eot / 1440
+    return jt, hour_angle(dec, la), dec
+
+# ===== ephemeris tier =====
+
+_ephemeris = None  # (timescale, planets), see load_ephemeris()
+
+# Load Skyfield timescale and DE421 from the dlm directory, return None when not available
+#   path: another SPK kernel to use instead, like a short test kernel for check_models()
+def load_ephemeris(path=None):
+    global _ephemeris
+    if _ephemeris is None or path is not None:
+        try:
+            from skyfield.api import Loader
+        except ImportError:
+            return None
+        path = path or os.path.join(DLM_DIR, 'de421.bsp')
+        if not os.path.exists(path):
+            return None
+        load = Loader(os.path.dirname(os.path.abspath(path)), expire=False)
+        _ephemeris = (load.timescale(builtin=True), load(os.path.basename(path)))
+    return _ephemeris
+
+# Return (local hour angle in degree, declination in radians) of the apparent Sun at a time
+#   jd: UT1 Julian date
+def ephemeris_hour_angle_dec(jd, lo):
+    ts, planets = load_ephemeris()
+    t = ts.ut1_jd(jd)
+    ra, dec, distance = planets['Earth'].at(t).observe(planets['Sun']).apparent().radec(epoch='date')
+    return ((t.gast - ra.hours) * 15 + lo + 180) % 360 - 180, dec.radians
+
+# sunclock.sun_rise_set() with the apparent position of the Sun from DE421
+# Unlike the other tiers, sunrise and sunset are each iterated to the event time
+# with the declination at that time, the result is made symmetric for the interface:
+# the returned transit is the middle of sunrise and sunset (within seconds of the
+# real transit) and the hour angle half of the day length, so transit -/+ hour
+# angle are the events. The declination is the one at the transit.
+def ephemeris_sun_rise_set(n, lo, la):
+    jt = 2451545.0 + n - lo / 360  # mean solar noon, a good first guess
+    for i in range(3):   # move to where the local hour angle is 0
+        ha, dec = ephemeris_hour_angle_dec(jt, lo)
+        jt -= ha / 360 * 0.99727  # a sidereal day is 0.99727 day
+    events = []
+    for sign in (-1, 1):  # sunrise, sunset
+        je = jt + sign * hour_angle(dec, la)
+        for i in range(3):  # move to where the altitude is the sunrise altitude at the event's declination
+            ha, dec_e = ephemeris_hour_angle_dec(je, lo)
+            target = sign * hour_angle(dec_e, la) * 360  # hour angle of the event, degree
+            je += ((target - ha + 180) % 360 - 180) / 360 * 0.99727
+        events.append(je)
+    rise, sets = events
+    return (rise + sets) / 2, (sets - rise) / 2, dec
+
+# ===== tiers =====
+
+models = [
+    SolarModel('simple', sunclock.sun_rise_set, sunclock.equ2hor, 200, 3),
+    SolarModel('noaa', noaa_sun_rise_set, sunclock.equ2hor, 60, 5),
+    SolarModel('ephemeris', ephemeris_sun_rise_set, sunclock.equ2hor, 2, 11000),
+]
+
+# Return the available models, cheapest first
+def available_models():
+    return [m for m in models if m.name != 'ephemeris' or load_ephemeris() is not None]
+
+# Select a model
+#   tier: model name, see above
+#   tolerance: the worst sunrise/sunset error acceptable, in seconds,
+#       the cheapest available model meeting it is returned
+# Without any argument the simple model is returned
+def select_model(tier=None, tolerance=None):
+    if tier is not None:
+        for m in models:
+            if m.name == tier:
+                if m not in available_models():
+                    raise ValueError("model %s is not available" % tier)
+                return m
+        raise ValueError("unknown model %s, should be one of %s" % (tier, ', '.join(m.name for m in models)))
+    if tolerance is None:
+        return models[0]
+    for m in available_models():
+        if m.error <= tolerance:
+            return m
+    raise ValueError("no available model is accurate to %s seconds" % tolerance)
+
+# Return (sunrise, sunset) as UT1 Julian dates found by almanac.find_discrete() on
+# the loaded ephemeris, independent of every model here, None for an event not found
+#   rise, sets: approximate sunrise and sunset, the events nearest to them are returned
+def reference_rise_set(rise, sets, lo, la):
+    from skyfield import almanac
+    from skyfield.api import Topos
+    ts, planets = load_ephemeris()
+    f = almanac.sunrise_sunset(planets, Topos(la, lo))
+    t, y = almanac.find_discrete(ts.ut1_jd(rise - 0.25), ts.ut1_jd(sets + 0.25), f)
+    found = []
+    for guess, rising in ((rise, True), (sets, False)):
+        jd = t.ut1[y == rising]
+        found.append(jd[abs(jd - guess).argmin()] if jd.size else None)
+    return found
+
+# Measure cost and error of the available models
+#   samples: number of random (day, site) pairs, latitude -60 to 60
+#   days: range of J2000 day numbers to pick the days from, must be covered by the ephemeris
+# The error is measured against reference_rise_set(), so it needs the ephemeris,
+# without it only the costs are measured.
+# Return a list of dict with name, cost (us per sun_rise_set() call) and
+# max and rms sunrise/sunset error (seconds, None without the ephemeris)
+def check_models(samples=1000, days=(0, 365 * 40), seed=1):
+    import random
+    rnd = random.Random(seed)
+    cases = [(rnd.randrange(*days), rnd.uniform(-180, 180), rnd.uniform(-60, 60)) for i in range(samples)]
+    ref = None
+    if load_ephemeris() is not None:
+        ref = []
+        for c in cases:
+            jt, ha, dec = sunclock.sun_rise_set(*c)  # only to place the search window
+            ref.append(reference_rise_set(jt - ha, jt + ha, c[1], c[2]))
+    report = []
+    for m in available_models():
+        t = time.perf_counter()
+        results = [m.sun_rise_set(*c) for c in cases]
+        cost = (time.perf_counter() - t) / samples * 1e6
+        row = {'name': m.name, 'cost': cost, 'max': None, 'rms': None}
+        if ref is not None:
+            errors = []
+            for r, events in zip(results, ref):
+                for event, model in zip(events, (r[0] - r[1], r[0] + r[1])):
+                    if event is not None:
+                        errors.append(abs(model - event) * 86400)
+            row.update({'max': max(errors), 'rms': math.sqrt(sum(e * e for e in errors) / len(errors))})
+        report.append(row)
+    return report
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Cost and error of the solar model tiers.')
+    parser.add_argument('--kernel', help='SPK kernel for the ephemeris tier and the reference (default dlm/de421.bsp)')
+    parser.add_argument('--days', help='first and last J2000 day number of the checked days (default 0 14600)', type=int, nargs=2, default=[0, 365 * 40])
+    parser.add_argument('--samples', help='random (day, site) pairs (default 1000)', type=int, default=1000)
+    args = parser.parse_args()
+    if args.kernel and load_ephemeris(args.kernel) is None:
+        print("cannot load %s" % args.kernel)
+        exit(1)
+    report = check_models(args.samples, (args.days[0], args.days[1] + 1))
+    if report[0]['max'] is None:
+        print("no ephemeris, errors not measured")
+    print("tier        cost/call    max error    rms error   (against almanac.find_discrete)")
+    for r in report:
+        if r['max'] is None:
+            print("%-10s %8.1f us" % (r['name'], r['cost']))
+        else:
+            print("%-10s %8.1f us %10.1f s %10.1f s" % (r['name'], r['cost'], r['max'], r['rms']))
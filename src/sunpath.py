@@ -0,0 +1,161 @@
+import math
+import numpy as np
+from sunbatch import (solar_mean_anomaly, equation_of_the_center, solar_ecliptic_longitude,
+        sin_declination_of_sun, equ2hor_batch)
+from sunclock import equ2hor
+
+# Continuous-time position of the Sun
+#
+# sunclock.sun_rise_set() gives one declination for the whole day, the one at
+# the transit, so the Sun drifts up to ~0.2 degree off its real path near the
+# equinoxes. Here the declination and the equation of time are functions of time:
+# for every UT day (J2000 day n covers n - 0.5 to n + 0.5) they are sampled from
+# the sunclock.py formulas and fitted with a cubic polynomial in the fraction of
+# the day, so a position at any instant costs two Horner evaluations plus the
+# equatorial to horizontal conversion.
+#
+# Example:
+#   path = SunPath(-119.8, 34.4)
+#   az, alt = path.position(2458918.8)               # at an instant
+#   hor = path.positions(jd_array)                   # many instants, [..., 0] azimuth, [..., 1] altitude
+#   step = path.stepper(2458918.8, 1 / 86400)        # every second from an instant
+#   az, alt = step.next()
+
+DEGREE = 3  # degree of the per-day polynomials, the fit error is far below the model error
+
+_NODES = 0.5 * np.cos(np.pi * (np.arange(DEGREE + 1) + 0.5) / (DEGREE + 1))  # Chebyshev nodes in [-0.5, 0.5]
+_FIT = np.linalg.inv(np.vander(_NODES, DEGREE + 1, increasing=True))  # samples at the nodes -> coefficients
+
+# Return (declination in radians, equation of time in fraction of day) at times,
+# same formulas as sunclock.sun_rise_set(), evaluated at the time itself
+# instead of at the mean solar noon
+#   j: time, J2000 Julian day with fraction
+# The equation of time here is local true solar transit minus mean solar noon.
+def dec_eot(j):
+    m = solar_mean_anomaly(j)
+    l = solar_ecliptic_longitude(m, equation_of_the_center(m))
+    eot = 0.0053*np.sin(np.radians(m)) - 0.0069*np.sin(2*np.radians(l))
+    return np.arcsin(sin_declination_of_sun(l)), eot
+
+# Return the polynomial coefficients of days, in one pass
+#   n: array of J2000 day numbers
+# Return an array of shape n.shape + (2, DEGREE + 1), [..., 0, :] declination,
+# [..., 1, :] equation of time, lowest order first, variable is the time minus n in days
+def day_coefficients(n):
+    n = np.asarray(n, dtype=float)
+    dec, eot = dec_eot(n[..., None] + _NODES)
+    return np.stack([dec @ _FIT.T, eot @ _FIT.T], axis=-2)
+
+# Evaluate polynomials, coefficients lowest order first on the last axis
+def horner(c, x):
+    v = c[..., -1]
+    for k in range(c.shape[-1] - 2, -1, -1):
+        v = v * x + c[..., k]
+    return v
+
+# horner() for a list of coefficients and a float, much cheaper than NumPy for one value
+def horner_list(c, x):
+    v = 0.0
+    for a in reversed(c):
+        v = v * x + a
+    return v
+
+# The Sun seen by an observer, at any time
+class SunPath:
+    #   lo: longitude of the observer, west is negative, in degree
+    #   la: latitude of the observer, north is positive, in degree
+    def __init__(self, lo, la):
+        self.lo, self.la = lo, la
+        self.days = {}  # J2000 day number -> coefficients as lists, see day_coefficients()
+
+    # Return the coefficients of a day, calculated the first time it is needed
+    def coefficients(self, n):
+        c = self.days.get(n)
+        if c is None:
+            if len(self.days) > 64:  # keep a few days only
+                self.days.clear()
+            c = self.days[n] = day_coefficients(n).tolist()
+        return c
+
+    # Return (hour angle in fraction of day, declination in radians) at a time
+    #   jd: Julian date
+    def hour_angle_dec(self, jd):
+        t = jd - 2451545.0
+        n = math.floor(t + 0.5)
+        c = self.coefficients(n)
+        x = t - n
+        ha = (t - 0.0008 + self.lo / 360 - horner_list(c[1], x) + 0.5) % 1 - 0.5
+        return ha, horner_list(c[0], x)
+
+    # Return (azimuth, altitude) in degree at a time, see sunclock.equ2hor()
+    #   jd: Julian date
+    def position(self, jd):
+        ha, dec = self.hour_angle_dec(jd)
+        return equ2hor(ha, dec, self.la)
+
+    # Return the positions at many times, in one pass
+    #   jd: array of Julian dates
+    # Return an array of shape jd.shape + (2,), [..., 0] azimuth, [..., 1] altitude, in degree
+    def positions(self, jd):
+        t = np.asarray(jd, dtype=float) - 2451545.0
+        n = np.floor(t + 0.5)
+        days, index = np.unique(n, return_inverse=True)
+        c = day_coefficients(days)[index.reshape(n.shape)]
+        x = t - n
+        ha = (t - 0.0008 + self.lo / 360 - horner(c[..., 1, :], x) + 0.5) % 1 - 0.5
+        return equ2hor_batch(ha, horner(c[..., 0, :], x), self.la)
+
+    # Return a SunStepper starting at a time
+    #   jd: Julian date of the first position
+    #   step: time between positions, in days
+    def stepper(self, jd, step):
+        return SunStepper(self, jd, step)
+
+# Positions of the Sun at evenly spaced times, advanced incrementally
+# The hour angle is advanced by rotating its cosine and sine by a fixed angle,
+# the rotation is corrected for the change of the equation of time and restarted
+# from the exact hour angle every `resync` steps (an hour by default) and at every new UT day.
+class SunStepper:
+    #   path: the SunPath
+    #   jd: Julian date of the first position
+    #   step: time between positions, in days
+    #   resync: steps between exact hour angle evaluations
+    def __init__(self, path, jd, step, resync=None):
+        self.path, self.jd0, self.step = path, jd, step
+        self.resync = resync or max(1, int(1 / 24 / step))
+        self.k = 0  # steps done, the time is jd0 + k * step, adding step up would accumulate rounding errors
+        self.jd = jd
+        la = math.radians(path.la)
+        self.sin_la, self.cos_la = math.sin(la), math.cos(la)
+        self._sync()
+
+    # Start again from the exact hour angle at self.jd
+    def _sync(self):
+        ha, dec = self.path.hour_angle_dec(self.jd)
+        t = self.jd - 2451545.0
+        self.day = math.floor(t + 0.5)
+        c = self.path.coefficients(self.day)
+        self.dec_c = c[0]
+        x = t - self.day
+        slope = sum(k * c[1][k] * x ** (k - 1) for k in range(1, len(c[1])))  # d(eot)/dt
+        delta = 2 * math.pi * self.step * (1 - slope)
+        self.cos_d, self.sin_d = math.cos(delta), math.sin(delta)
+        self.cos_h, self.sin_h = math.cos(2 * math.pi * ha), math.sin(2 * math.pi * ha)
+        self.left = self.resync
+
+    # Return (azimuth, altitude) in degree at the current time and advance one step
+    def next(self):
+        t = self.jd - 2451545.0
+        dec = horner_list(self.dec_c, t - self.day)
+        sin_dec, cos_dec = math.sin(dec), math.cos(dec)
+        alt = math.degrees(math.asin(self.sin_la * sin_dec + self.cos_la * cos_dec * self.cos_h))
+        az = math.degrees(math.atan2(self.sin_h, self.cos_h * self.sin_la - sin_dec / cos_dec * self.cos_la)) + 180
+        self.k += 1
+        self.jd = self.jd0 + self.k * self.step
+        self.left -= 1
+        if self.left <= 0 or math.floor(self.jd - 2451545.0 + 0.5) != self.day:
+            self._sync()
+        else:
+            self.cos_h, self.sin_h = (self.cos_h * self.cos_d - self.sin_h * self.sin_d,
+                    self.sin_h * self.cos_d + self.cos_h * self.sin_d)
+        return az, alt
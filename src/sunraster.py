@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.format import open_memmap
+from sunbatch import (local_mean_solar_noon, solar_mean_anomaly, equation_of_the_center,
+        solar_ecliptic_longitude, local_true_solar_transit, sin_declination_of_sun, cos_hour_angle)
+from sunjulian import day_number
+
+# Sunrise/sunset raster: the solar model over a whole latitude/longitude grid
+#
+# For every date and every grid cell it stores, in separate .npy files of an
+# output directory, memory-mapped so neither the writer nor a reader needs them
+# in RAM:
+#   rise.npy, set.npy: sunrise/sunset, hours since 00:00 UTC of the date, float32,
+#                      can be below 0 or above 24 far from Greenwich, NaN in polar day/night
+#   day_length.npy: hours from sunrise to sunset, float32, 24 in polar day, 0 in polar night
+#   polar.npy: 1 polar day, -1 polar night, 0 otherwise, int8
+#   done.npy: 1 for every date written
+#   header.json: grid and file layout
+#
+# The arrays are tiled: shape (dates, lat tiles, lon tiles, tile, tile), so a
+# window of the map is a few contiguous blocks of the files. Rows go from north
+# to south, columns from west to east, cell centers at
+#   lat = 90 - (row + 0.5) * resolution, lon = -180 + (column + 0.5) * resolution
+# The grid is padded to whole tiles, padding cells are NaN / 0.
+#
+# The declination and the transit of a date depend only on longitude and the
+# hour angle only on latitude and declination, so a date is one row of transits
+# and a 2D hour angle evaluation, done a tile row at a time. Dates are shared
+# among worker processes, a stopped run can be started again and skips the dates
+# already done.
+#
+# Example, a 0.1 degree map for every day of 2021:
+#   python sunraster.py -o raster2021 -y 2021 -m 1 -d 1 --days 365 --res 0.1
+# Reading:
+#   r = Raster('raster2021')
+#   r.window('rise', 0, 30, 40, -125, -115)   # 2D array of the first date, lat 30-40, lon -125 - -115
+
+FIELDS = {'rise': 'float32', 'set': 'float32', 'day_length': 'float32', 'polar': 'int8'}
+
+# Create the output files, or open the existing ones of the same grid
+# Return the header dict
+def create(out_dir, start, days, res, tile):
+    os.makedirs(out_dir, exist_ok=True)
+    ny, nx = int(round(180 / res)), int(round(360 / res))
+    header = {'start': start.isoformat(), 'days': days, 'resolution': res, 'tile': tile,
+            'rows': ny, 'columns': nx, 'lat_tiles': -(-ny // tile), 'lon_tiles': -(-nx // tile),
+            'fields': FIELDS}
+    path = os.path.join(out_dir, 'header.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            old = json.load(f)
+        if old != header:
+            raise ValueError("%s holds a different raster, use another output directory" % out_dir)
+        return header
+    shape = (days, header['lat_tiles'], header['lon_tiles'], tile, tile)
+    for name, dtype in FIELDS.items():
+        open_memmap(os.path.join(out_dir, name + '.npy'), 'w+', dtype, shape).flush()
+    open_memmap(os.path.join(out_dir, 'done.npy'), 'w+', 'int8', (days,)).flush()
+    with open(path, 'w') as f:  # written last, its presence means the files are complete
+        json.dump(header, f, indent=2)
+    return header
+
+# Return the cell center latitudes and longitudes of the padded grid
+def grid(header):
+    res, tile = header['resolution'], header['tile']
+    lat = 90 - (np.arange(header['lat_tiles'] * tile) + 0.5) * res
+    lon = -180 + (np.arange(header['lon_tiles'] * tile) + 0.5) * res
+    return lat, lon
+
+# Worker: calculate and write some dates, return the number of dates written
+#   out_dir: output directory, see create()
+#   dates: indexes of the dates
+def run_dates(out_dir, dates):
+    with open(os.path.join(out_dir, 'header.json')) as f:
+        header = json.load(f)
+    files = {name: open_memmap(os.path.join(out_dir, name + '.npy'), 'r+') for name in FIELDS}
+    done = open_memmap(os.path.join(out_dir, 'done.npy'), 'r+')
+    tile, nxt = header['tile'], header['lon_tiles']
+    lat, lon = grid(header)
+    valid_lon = (lon < 180)[None, :]
+    start = datetime.date.fromisoformat(header['start'])
+    n0 = day_number(datetime.datetime(start.year, start.month, start.day, hour=12))
+    for k in dates:
+        n = n0 + k
+        # transit and declination depend on the longitude only, sunclock.sun_rise_set() step by step
+        j = local_mean_solar_noon(n, lon)
+        m = solar_mean_anomaly(j)
+        l = solar_ecliptic_longitude(m, equation_of_the_center(m))
+        jt = (local_true_solar_transit(j, m, l) - (2451544.5 + n)) * 24  # hours since 00:00 UTC
+        d = sin_declination_of_sun(l)[None, :]
+        for i in range(header['lat_tiles']):
+            la = lat[i * tile:(i + 1) * tile, None]
+            cha = cos_hour_angle(d, la)
+            valid = (la > -90) & valid_lon
+            polar_day, polar_night = valid & (cha < -1), valid & (cha > 1)
+            up = valid & ~(polar_day | polar_night)
+            ha = np.where(up, np.arccos(np.clip(cha, -1, 1)) * (12 / np.pi), np.nan)  # hours
+            out = {
+                'rise': jt - ha,
+                'set': jt + ha,
+                'day_length': np.where(polar_day, 24, np.where(polar_night, 0, 2 * ha)),
+                'polar': polar_day.astype('int8') - polar_night.astype('int8'),
+            }
+            for name, v in out.items():  # (tile, columns) -> (lon tiles, tile, tile)
+                files[name][k, i] = v.reshape(tile, nxt, tile).transpose(1, 0, 2)
+        for f in files.values():
+            f.flush()
+        done[k] = 1
+        done.flush()
+    return len(dates)
+
+# Generate a raster
+#   out_dir: output directory
+#   start: datetime.date of the first date
+#   days: number of dates
+#   res: grid resolution, in degree, 180 should be a multiple of it
+#   tile: tile size, in cells
+#   workers: number of worker processes, default is the number of CPUs
+#   progress: a file to write progress lines to, or None
+# Return the number of dates written in this run
+def generate(out_dir, start, days, res=0.1, tile=256, workers=None, progress=sys.stderr):
+    create(out_dir, start, days, res, tile)
+    done = np.load(os.path.join(out_dir, 'done.npy'))
+    todo = np.flatnonzero(done == 0).tolist()
+    workers = workers or os.cpu_count()
+    t_start = time.time()
+    written = 0
+    with ProcessPoolExecutor(workers) as pool:
+        batches = [todo[i:i + 4] for i in range(0, len(todo), 4)]
+        for r in pool.map(run_dates, [out_dir] * len(batches), batches):
+            written += r
+            if progress:
+                print("dates done: %d/%d, skipped: %d, %.1f s" % (written, len(todo),
+                        days - len(todo), time.time() - t_start), file=progress, flush=True)
+    return written
+
+# A raster opened for reading, memory-mapped
+class Raster:
+    def __init__(self, out_dir):
+        with open(os.path.join(out_dir, 'header.json')) as f:
+            self.header = json.load(f)
+        self.files = {name: np.load(os.path.join(out_dir, name + '.npy'), mmap_mode='r') for name in FIELDS}
+        self.done = np.load(os.path.join(out_dir, 'done.npy'), mmap_mode='r')
+        self.start = datetime.date.fromisoformat(self.header['start'])
+
+    # Return the index of a date
+    def date_index(self, date):
+        k = (date - self.start).days
+        if not 0 <= k < self.header['days']:
+            raise ValueError("%s is not in the raster" % date)
+        return k
+
+    # Return a window of a field of a date as a 2D array, north to south, west to east,
+    # only the tiles touching the window are read
+    #   field: one of FIELDS
+    #   date: index of the date, or datetime.date
+    #   lat0, lat1, lon0, lon1: window bounds, in degree, cells with centers inside are returned
+    def window(self, field, date, lat0, lat1, lon0, lon1):
+        k = self.date_index(date) if isinstance(date, datetime.date) else date
+        if not self.done[k]:
+            raise ValueError("date %d of the raster is not written yet" % k)
+        h = self.header
+        res, tile = h['resolution'], h['tile']
+        r0 = max(0, int(np.ceil((90 - max(lat0, lat1)) / res - 0.5)))
+        r1 = min(h['rows'], int(np.floor((90 - min(lat0, lat1)) / res - 0.5)) + 1)
+        c0 = max(0, int(np.ceil((min(lon0, lon1) + 180) / res - 0.5)))
+        c1 = min(h['columns'], int(np.floor((max(lon0, lon1) + 180) / res - 0.5)) + 1)
+        if r1 <= r0 or c1 <= c0:
+            return np.empty((0, 0), dtype=FIELDS[field])
+        ti0, ti1, tj0, tj1 = r0 // tile, (r1 - 1) // tile + 1, c0 // tile, (c1 - 1) // tile + 1
+        block = self.files[field][k, ti0:ti1, tj0:tj1]  # (lat tiles, lon tiles, tile, tile)
+        block = block.transpose(0, 2, 1, 3).reshape((ti1 - ti0) * tile, (tj1 - tj0) * tile)
+        return np.array(block[r0 - ti0 * tile:r1 - ti0 * tile, c0 - tj0 * tile:c1 - tj0 * tile])
+
+    # Return the value of a field at a date in the cell containing a point
+    # Raise ValueError when the date is not written yet, like window()
+    def point(self, field, date, lat, lon):
+        k = self.date_index(date) if isinstance(date, datetime.date) else date
+        if not self.done[k]:
+            raise ValueError("date %d of the raster is not written yet" % k)
+        h = self.header
+        r = min(max(int((90 - lat) / h['resolution']), 0), h['rows'] - 1)
+        c = min(max(int((lon + 180) / h['resolution']), 0), h['columns'] - 1)
+        tile = h['tile']
+        return self.files[field][k, r // tile, c // tile, r % tile, c % tile]
+
+if __name__ == '__main__':
+    today = datetime.date.today()
+    parser = argparse.ArgumentParser(description='Sunrise/sunset raster generator.')
+    parser.add_argument('-o', '--out', help='output directory', default='raster')
+    parser.add_argument('-y', '--year', help='year of start date (1900-2100)', type=int, metavar='YEAR', choices=range(1900,2101), default=today.year)
+    parser.add_argument('-m', '--month', help='month of start date (1-12)', type=int, metavar='MONTH', choices=range(1, 13), default=today.month)
+    parser.add_argument('-d', '--day', help='day of start date (1-31)', type=int, metavar='DAY', choices=range(1, 32), default=today.day)
+    parser.add_argument('--days', help='number of dates', type=int, default=1)
+    parser.add_argument('--res', help='grid resolution in degree (default 0.1)', type=float, default=0.1)
+    parser.add_argument('--tile', help='tile size in cells (default 256)', type=int, default=256)
+    parser.add_argument('-j', '--workers', help='number of worker processes', type=int, default=None)
+    args = parser.parse_args()
+    generate(args.out, datetime.date(args.year, args.month, args.day), args.days, args.res, args.tile, args.workers)
@@ -1,12 +1,16 @@
 # coding=utf-8
 import argparse
+import time
+import datetime
 from tkinter import *
 from tkinter import ttk
-import datetime
-import julian
-from sunclock import sun_rise_set, equ2hor
-import pytz
-from timezonefinder import TimezoneFinder
+from sunjulian import from_jd, day_number
+from tzresolve import get_noons
+from instrument import timed, first_frame
+import snapshot
+
+# NumPy and the modules using it are imported by the functions drawing the graph,
+# so the window with the clock is up before they are loaded, see the main below.
 
 simu_pre_rise_hour = 1  # we simulate 1 hours before sunrise
 simu_pre_rise_j = simu_pre_rise_hour / 24  # convert to Julian day
@@ -18,9 +22,12 @@ simu_tick_step_j = simu_tick_step_minutes / 1440  # Julian day per tick
 simu_track_segments = 32  # segments of sun position curve, even number is better I guess
 simu_sun_radius = 7 # radius of sun disc in the graph
 
-# these 2 globals will be modified by tick
-simu_curr_day = 0  # the day we are simulating
-simu_curr_tick = 0 # the tick number at the day we are simulating
+# these globals will be modified by tick
+simu_curr_frame = 0  # index of the frame to show, see frame_table()
+shown = {'day': None, 'clock': None, 'disc': None}  # what the widgets are showing now
+tick_last = None  # time.perf_counter() of the last tick
+late_ticks = 0  # ticks came later than half a tick period
+dropped_frames = 0  # frames skipped to catch up with late ticks
 
 ## ===== Canvas related sizes ======
 width_canvas, height_canvas = 600, 320
@@ -37,7 +44,11 @@ root.title("Sunrise Simulator Alarm Clock")
 
 # Frame
 content = ttk.Frame(root)
-content.grid(column=0, row=0)
+content.grid(column=0, row=0, sticky=(N, S, W, E))
+root.columnconfigure(0, weight=1)  # the canvas follows the window size
+root.rowconfigure(0, weight=1)
+content.columnconfigure(1, weight=1)
+content.rowconfigure(2, weight=1)
 
 # =============== Row 0: the big clock ==============
 # clock
@@ -67,47 +78,35 @@ location_lbl.grid(column=2, row=1, sticky=E, padx=10)
 
 # ======= Row 2: the canvas ======
 canvas = Canvas(content, borderwidth=1, relief="sunken", width=width_canvas, height=height_canvas)
-canvas.grid(column=0, row=2, columnspan=3, padx=10, pady=8)
+canvas.grid(column=0, row=2, columnspan=3, padx=10, pady=8, sticky=(N, S, W, E))
 
 # ===== METHODS =====
 
 # called every simu_tick_ms microseconds
+# when a tick comes late, the frames it missed are dropped to keep the animation speed
+@timed('tk_clock.tick')
 def tick():
+    global tick_last, late_ticks, dropped_frames, simu_curr_frame
+    now = time.perf_counter()
+    if tick_last is not None:
+        elapsed = (now - tick_last) * 1000 / simu_tick_ms  # in tick periods
+        if elapsed > 1.5:
+            late_ticks += 1
+            dropped = round(elapsed) - 1
+            dropped_frames += dropped
+            simu_curr_frame = (simu_curr_frame + dropped) % len(frames)
+            root.title("Sunrise Simulator Alarm Clock - late ticks: %d, dropped frames: %d"
+                    % (late_ticks, dropped_frames))
+    tick_last = now
     update()
     clock_lbl.after(simu_tick_ms, tick)
 
-# Calculate standard timezone from longitude, return a timezone.timezone object
-def get_std_timezone(lng):
-    hours = lng // 15
-    if ((lng % 15) > 7.5): hours = hours + 1
-    return datetime.timezone(datetime.timedelta(hours=hours))
-
-# Julian.to_jd() ignores timezone, this is for timezone aware datetime
-def myjulian_to_jd(d_with_tz):
-    return julian.to_jd(d_with_tz.astimezone(datetime.timezone.utc))
-
-# Julian.from_jd() return naive UTC datetime, this returns an aware datetime
-def myjulian_from_jd(j, tz):
-    return julian.from_jd(j).replace(tzinfo=datetime.timezone.utc).astimezone(tz)
-
-# Get timezone, datetime objects of the noon of the specified local date
-# in local timezone and in UTC
-def get_noons(year, month, day, lat, lon):
-    tf = TimezoneFinder()
-    tz_str = tf.timezone_at(lng=lon, lat=lat)  # show the geolocation
-    if (tz_str != None):   # find a location in TimezoneFinder's database
-        tz = pytz.timezone(tz_str)
-        if (tz != None):   # everything is OK
-            # NOTE: pytz's tz cannot be used in datetime.datetime() constructor
-            d_local = tz.localize(datetime.datetime(year, month, day, hour=12))
-        else:  # somehow pytz does not has this location
-            tz = get_std_timezone(lon)  # have to use standard time zone
-            d_local = datetime.datetime(year, month, day, hour=12, tzinfo=tz)
-    else:  # this geolocation is not in TimezoneFinder's database
-        tz = get_std_timezone(lon)  # have to use a standard time zone
-        d_local = datetime.datetime(year, month, day, hour=12, tzinfo=tz)
-    d_utc = d_local.astimezone(tz=datetime.timezone.utc)  # get an UTC one for the same datetime
-    return {'tz': tz, 'd_local': d_local, 'd_utc': d_utc}
+# change the canvas size, the graph scales are calculated from it
+def set_canvas_size(width, height):
+    global width_canvas, height_canvas, ratio_x, ratio_y
+    width_canvas, height_canvas = width, height
+    ratio_x = (width_canvas - pad_left - pad_right) / (azimuth_max * 2)
+    ratio_y = (height_canvas - pad_top - pad_bottom) / altitude_max
 
 # map a horizontal (azimuthz, altitude) coordinates to our graph coordinates
 def map_hor_to_rect(az, alt):
@@ -115,79 +114,183 @@ def map_hor_to_rect(az, alt):
     y = (90 - alt) * ratio_y +pad_top
     return (x, y)
 
-# draw the sun position graph background
-def graph_init():
-    global id_sun
-
+# draw the box and the labels, tagged 'axes'
+def draw_axes():
     # big box
-    canvas.create_rectangle((pad_left, pad_top, width_canvas-pad_right, height_canvas-pad_bottom))
+    canvas.create_rectangle((pad_left, pad_top, width_canvas-pad_right, height_canvas-pad_bottom), tags='axes')
 
     # orientation labels along X
     c = map_hor_to_rect(0, 0)
     y = c[1] + 15  # move down a little bit
-    canvas.create_text(c[0], y, text="S")  # South
+    canvas.create_text(c[0], y, text="S", tags='axes')  # South
     c = map_hor_to_rect(-90, 0)
-    canvas.create_text(c[0], y, text="E")   # East
+    canvas.create_text(c[0], y, text="E", tags='axes')   # East
     c = map_hor_to_rect(90, 0)
-    canvas.create_text(c[0], y, text="W")   # West
+    canvas.create_text(c[0], y, text="W", tags='axes')   # West
 
     # altitude labels along Y
     c = map_hor_to_rect(-azimuth_max, 0)
     x = c[0] - 15  # move left a little bit
-    canvas.create_text(x, c[1], text="0")  # altitude 0 degree
+    canvas.create_text(x, c[1], text="0", tags='axes')  # altitude 0 degree
     c = map_hor_to_rect(-azimuth_max, 45)
-    canvas.create_text(x, c[1], text="45")  # altitude 45 degree
+    canvas.create_text(x, c[1], text="45", tags='axes')  # altitude 45 degree
     c = map_hor_to_rect(-azimuth_max, 90)
-    canvas.create_text(x, c[1], text="90")  # altitude 90 degree
-
-    # draw sun tracks for every simulated days
+    canvas.create_text(x, c[1], text="90", tags='axes')  # altitude 90 degree
+
+# drop the points of a track closer than min_px pixels to the last kept point,
+# the first and the last points are always kept
+#   points: array of shape (number of points, 2) in canvas pixels
+def decimate(points, min_px=2):
+    kept = [points[0]]
+    for p in points[1:-1]:
+        if abs(p[0] - kept[-1][0]) >= min_px or abs(p[1] - kept[-1][1]) >= min_px:
+            kept.append(p)
+    kept.append(points[-1])
+    return kept
+
+# draw the sun tracks of all simulating days as the static background layer, tagged 'track'
+# Tracks are decimated to the canvas resolution, and tracks looking the same in
+# pixels (days around the solstices for example) are drawn only once.
+def draw_tracks():
+    import numpy as np
+    drawn = set()
     for i in range(simu_days):
-        step = (sun[i]['j_set'] - sun[i]['j_rise']) / simu_track_segments
-        track = []  # contains point coordinates like [x0, y0, x1, y1, x2, y2...]
-        for j in range(simu_track_segments + 1):  # generate coordinates for every segment
-            h = equ2hor(sun[i]['j_rise_ah'] + j*step, sun[i]['dec'], obsv_lat)
-            c = map_hor_to_rect(h[0] - 180, h[1])
-            track.append(c[0])
-            track.append(c[1])
-        canvas.create_line(track, smooth='true', dash=[2,4]) # make it smooth
+        x, y = map_hor_to_rect(tracks[i, :, 0] - 180, tracks[i, :, 1])  # we set south = 0
+        points = np.rint(np.column_stack((x, y))).astype(int).tolist()
+        track = tuple(v for p in decimate(points) for v in p)  # like (x0, y0, x1, y1, x2, y2...)
+        if track not in drawn:
+            drawn.add(track)
+            canvas.create_line(track, smooth='true', dash=[2,4], tags='track') # make it smooth
+
+# draw the sun position graph background
+@timed('tk_clock.graph_init')
+def graph_init():
+    global id_sun, tracks
+    from sunbatch import sun_tracks
+
+    # sun tracks for every simulating days, all tracks are calculated in one call
+    tracks = sun_tracks([-s['j_rise_ah'] for s in sun], [s['dec'] for s in sun],
+            obsv_lat, simu_track_segments)
+    draw_axes()
+    draw_tracks()
 
     # draw the sun disc, since it is hidden we don't bother to calculate a position
     id_sun = canvas.create_oval(0, 0, 0, 0, fill='red', outline='yellow', state='hidden')
-
-# update all the widgets, called by tick()
+    canvas.bind('<Configure>', on_resize)
+
+# the canvas size changed, wait until it stops changing to render again
+# the event size includes the border and the highlight ring on both sides, taken
+# from the widget and not from the first event, which may be seen before binding
+resize_job = None
+def on_resize(event):
+    global resize_job
+    inset = 2 * int(canvas['borderwidth']) + 2 * int(canvas['highlightthickness'])
+    size = (event.width - inset, event.height - inset)
+    if resize_job is not None:
+        canvas.after_cancel(resize_job)
+    if size != (width_canvas, height_canvas):
+        resize_job = canvas.after(50, resize, *size)
+
+# render the graph for a new canvas size
+# the track layer is scaled by Tk instead of drawn again, only the few axes items
+# are drawn again and the sun disc positions of the frames are mapped again
+def resize(width, height):
+    global resize_job, discs
+    resize_job = None
+    old_ratio_x, old_ratio_y = ratio_x, ratio_y
+    set_canvas_size(width, height)
+    canvas.scale('track', pad_left, pad_top, ratio_x / old_ratio_x, ratio_y / old_ratio_y)
+    canvas.delete('axes')
+    draw_axes()
+    discs = disc_table()
+    if shown['disc'] is not None:
+        shown['disc'] = ()  # the disc must be moved at the next tick
+
+# build the table of all frames of all simulating days, so a tick only indexes into it
+# Return a tuple:
+#   0: frames, every frame is a tuple:
+#       0: index of the simulating day
+#       1: clock string
+#   1: (sunrise string, sunset string) of every simulating day
+#   2: array of the Sun horizontal coordinates of every frame, see disc_table()
+@timed('tk_clock.frame_table')
+def frame_table():
+    import numpy as np
+    from sunpath import SunPath
+    tz = noons['tz']
+    frames, labels, times = [], [], []
+    for i in range(simu_days):
+        s = sun[i]
+        ticks = int(s['j_total'] / simu_tick_step_j) + 1  # ticks to simulate this day
+        j = s['j_start'] + np.arange(ticks) * simu_tick_step_j  # time of every tick in Julian day
+        times.append(j)
+        d_first, d_last = from_jd(j[0], tz), from_jd(j[-1], tz)
+        same_offset = d_first.utcoffset() == d_last.utcoffset()  # not a daylight saving switch day
+        d_first, zone = d_first.replace(tzinfo=None), d_first.strftime(' %Z')
+        for k in range(ticks):
+            if same_offset:   # naive local time is much cheaper than timezone conversion
+                clock = (d_first + datetime.timedelta(minutes=k*simu_tick_step_minutes)).strftime('%c') + zone
+            else:
+                clock = from_jd(j[k], tz).strftime('%c %Z')
+            frames.append((i, clock))
+        labels.append((from_jd(s['j_rise'], tz).strftime('Sunrise: %H:%M'),
+                from_jd(s['j_set'], tz).strftime('Sunset: %H:%M')))
+    # the Sun horizontal coords of all frames, the declination changing along the day
+    return frames, labels, SunPath(obsv_lon, obsv_lat).positions(np.concatenate(times))
+
+# map the Sun positions of all frames to the canvas, done again when the canvas is resized
+# Return a list of sun disc coordinates (x0, y0, x1, y1) of every frame,
+# None when the Sun is below the horizon
+def disc_table():
+    import numpy as np
+    x, y = map_hor_to_rect(frame_hor[:, 0] - 180, frame_hor[:, 1])  # we set south = 0
+    x, y = np.rint(x).astype(int).tolist(), np.rint(y).astype(int).tolist()
+    r = simu_sun_radius
+    return [(x[k] - r, y[k] - r, x[k] + r, y[k] + r) if frame_hor[k, 1] >= -0.83 else None  # hide the Sun below the horizon
+            for k in range(len(x))]
+
+# update the widgets to the current frame, called by tick()
+# only what is different from the last frame is pushed to Tk
 def update():
-    global simu_curr_tick, simu_curr_day
-
-    if simu_tick_step_j*simu_curr_tick > sun[simu_curr_day]['j_total']:  # this day is done
-        simu_curr_day += 1
-        if simu_curr_day == simu_days:  # last day is done, wrap to the first day
-            simu_curr_day = 0
-        simu_curr_tick = 0
-
-    # current time in Julian day
-    j = sun[simu_curr_day]['j_start'] + simu_curr_tick*simu_tick_step_j
-
-    # update clock, sunrise and sunset time
-    clock_var.set(myjulian_from_jd(j, noons['tz']).strftime('%c %Z'))
-    if simu_curr_tick == 0:   # only need to be done at the beginning of the day
-        sunrise_time_var.set(myjulian_from_jd(sun[simu_curr_day]['j_rise'], noons['tz'])
-                .strftime('Sunrise: %H:%M'))
-        sunset_time_var.set(myjulian_from_jd(sun[simu_curr_day]['j_set'], noons['tz'])
-                .strftime('Sunset: %H:%M'))
-
-    # update sun disc position
-    ah = j - sun[simu_curr_day]['j_transit'] # current local Sun angle hour
-    h = equ2hor(ah, sun[simu_curr_day]['dec'], obsv_lat)  # Sun horizontal coords
-    if (h[1] < -0.83):  # hide the Sun if it is below the horizon
-        canvas.itemconfigure(id_sun, state='hidden')
-    else:
-        c = map_hor_to_rect(h[0] - 180, h[1])  # we set south = 0
-        x0, y0 = c[0] - simu_sun_radius, c[1] - simu_sun_radius
-        x1, y1 = c[0] + simu_sun_radius, c[1] + simu_sun_radius
-        canvas.coords(id_sun, x0, y0, x1, y1)  # move to the right position
-        canvas.itemconfigure(id_sun, state='normal')  # show the Sun
-
-    simu_curr_tick += 1
+    global simu_curr_frame
+
+    day, clock = frames[simu_curr_frame]
+    disc = discs[simu_curr_frame]
+    if clock != shown['clock']:
+        clock_var.set(clock)
+    if day != shown['day']:   # only need to be done at the beginning of the day
+        sunrise_time_var.set(day_labels[day][0])
+        sunset_time_var.set(day_labels[day][1])
+    if disc != shown['disc']:
+        if disc is None:
+            canvas.itemconfigure(id_sun, state='hidden')
+        else:
+            canvas.coords(id_sun, *disc)  # move to the right position
+            if shown['disc'] is None:
+                canvas.itemconfigure(id_sun, state='normal')  # show the Sun
+    shown['day'], shown['clock'], shown['disc'] = day, clock, disc
+
+    simu_curr_frame = (simu_curr_frame + 1) % len(frames)  # wrap to the first day at the end
+
+# calculate sunrise/sunset data for each simulating day, return a list of dict
+# days in the startup snapshot are taken from it, see snapshot.py
+#   n: number of days since Jan 1st, 2000 12:00 UTC of the first simulating day
+@timed('tk_clock.sun_days')
+def sun_days(n):
+    sun = []
+    for i in range(simu_days):
+        s = snap.sun_rise_set(n + i*simu_day_interval, obsv_lon, obsv_lat)
+        sun.append({
+            'j_transit': s[0],  # Sun transit time in Julian day
+            'j_rise': s[0] - s[1],  # sunrise time in Julian day
+            'j_set': s[0] + s[1],   # sunset time in Julian day
+            'j_start': s[0] - s[1] - simu_pre_rise_j,  # simulate start time in Julian day
+            'j_stop': s[0] + s[1] + simu_aft_set_j, # simulate stop time in Julian day
+            'j_total': 2 * s[1] + simu_pre_rise_j + simu_aft_set_j,  # time to simulate at this day
+            'j_rise_ah': - s[1],  # local sunrise Angle Hour in fraction of a Julian day
+            'dec': s[2],  # declination of the Sun
+            })
+    return sun
 
 # XXX imported from sunclock.py, just for reference
 # Calculate, result as a tuple:
@@ -217,6 +320,7 @@ simu_days = 7  # how many days to simulate
 simu_day_interval = 30 # interval between each simulating day
 
 obsv_lat, obsv_lon = 34.4, -119.8   # UCSB
+snap = snapshot.Snapshot(obsv_lat, obsv_lon, None)  # replaced by the saved one in the main
 
 if __name__ == '__main__':
     # get simulation parameters from command line arguments
@@ -228,6 +332,9 @@ if __name__ == '__main__':
     parser.add_argument('--int', help='number of days between each simulating days (1-365)', type=int, metavar='INT', choices=range(1, 366), default=simu_day_interval)
     parser.add_argument('--lat', help='observer latitude (24-55)', type=float, default=obsv_lat)
     parser.add_argument('--lon', help='observer longitude (-180.0-180.0)', type=float, default=obsv_lon)
+    parser.add_argument('--tick', help='milliseconds of a simulating tick (default 80)', type=int, metavar='MS', default=simu_tick_ms)
+    parser.add_argument('--profile', help='report call counts and latencies at exit and on SIGUSR1, see instrument.py', action='store_true')
+    parser.add_argument('--snapshot', help='startup snapshot file, see snapshot.py (default %(default)s)', default=snapshot.DEFAULT_PATH)
     args = parser.parse_args()
     if args.lat < 24 or args.lat > 55:
         print("Sorry, we can only deal with observer latitude between 24N and 55N")
@@ -238,26 +345,29 @@ if __name__ == '__main__':
     simu_year, simu_month, simu_day = args.year, args.month, args.day
     simu_days, simu_day_interval = args.days, args.int
     obsv_lat, obsv_lon = args.lat, args.lon
+    simu_tick_ms = max(args.tick, 1)
 
+    # the timezone and sunrise/sunset saved by the last run, or found again
+    snap = snapshot.load(obsv_lat, obsv_lon, args.snapshot) or snapshot.Snapshot.resolve(obsv_lat, obsv_lon, args.snapshot)
     # get noon of the simulation start day and timezone
-    noons = get_noons(simu_year, simu_month, simu_day, obsv_lat, obsv_lon)
+    noons = get_noons(simu_year, simu_month, simu_day, obsv_lat, obsv_lon, snap.timezone())
     # calcuate number of days since Jan 1st, 2000 12:00 UTC
-    n = round(julian.to_jd(noons['d_utc']) - julian.to_jd(datetime.datetime(2000, 1, 1, hour=12)))
-    sun = []
-    for i in range(simu_days):   # calculate sunrise/sunset data for each simulating day
-        s = sun_rise_set(n + i*simu_day_interval, obsv_lon, obsv_lat)
-        sun.append({
-            'j_transit': s[0],  # Sun transit time in Julian day
-            'j_rise': s[0] - s[1],  # sunrise time in Julian day
-            'j_set': s[0] + s[1],   # sunset time in Julian day
-            'j_start': s[0] - s[1] - simu_pre_rise_j,  # simulate start time in Julian day
-            'j_stop': s[0] + s[1] + simu_aft_set_j, # simulate stop time in Julian day
-            'j_total': 2 * s[1] + simu_pre_rise_j + simu_aft_set_j,  # time to simulate at this day
-            'j_rise_ah': - s[1],  # local sunrise Angle Hour in fraction of a Julian day
-            'dec': s[2],  # declination of the Sun
-            })
-
+    n = day_number(noons['d_utc'])
+    sun = sun_days(n)
+
+    # show the clock of the first frame before NumPy is loaded and the frames are calculated
+    tz = noons['tz']
+    clock_var.set(from_jd(sun[0]['j_start'], tz).strftime('%c %Z'))
+    sunrise_time_var.set(from_jd(sun[0]['j_rise'], tz).strftime('Sunrise: %H:%M'))
+    sunset_time_var.set(from_jd(sun[0]['j_set'], tz).strftime('Sunset: %H:%M'))
     location_var.set("%s° N, %s° E" % (round(obsv_lat, 2), round(obsv_lon, 2)))
+    root.update()
+    first_frame('tk_clock')  # in the report of instrument.py
+    snap.fill(n)  # the snapshot for the next start
+    snap.save()
+
+    frames, day_labels, frame_hor = frame_table()
+    discs = disc_table()
     graph_init()
     tick()
     root.mainloop()
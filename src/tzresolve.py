@@ -0,0 +1,85 @@
+import datetime
+from functools import lru_cache
+from instrument import timed, span, register_cache
+
+# Timezone resolution shared by alarm_simple1.py and tk_clock.py
+#
+# TimezoneFinder loads its whole polygon dataset when it is created, so only one
+# is created, on first use. timezone_at() results are cached per latitude/longitude
+# cell and pytz timezone objects per name, so a batch of locations pays the
+# polygon loading once and repeated locations don't search the polygons again.
+# pytz is imported only when a timezone object is made from a name, see
+# snapshot.py for skipping the search at all at startup.
+
+# decimal places of latitude/longitude of a timezone cell, 2 is about 1 km
+cell_precision = 2
+
+_finder = None  # the shared TimezoneFinder, see get_finder()
+
+# Return the shared TimezoneFinder, create it at the first call
+def get_finder():
+    global _finder
+    if _finder is None:
+        with span('TimezoneFinder startup'):
+            from timezonefinder import TimezoneFinder  # slow, load it only when needed
+            _finder = TimezoneFinder()
+    return _finder
+
+@lru_cache(maxsize=65536)
+def _timezone_name_at_cell(lat, lon):
+    return get_finder().timezone_at(lng=lon, lat=lat)
+
+register_cache('timezone cells', lambda: _timezone_name_at_cell.cache_info()[:2])
+
+# Return the timezone name like 'America/Los_Angeles' of a geolocation,
+# or None when it is not in TimezoneFinder's database
+@timed('timezone_name')
+def timezone_name(lat, lon):
+    return _timezone_name_at_cell(round(lat, cell_precision), round(lon, cell_precision))
+
+# Return the pytz timezone object of a timezone name, or None when pytz does not have it
+@lru_cache(maxsize=None)
+def get_pytz(tz_str):
+    import pytz
+    try:
+        return pytz.timezone(tz_str)
+    except pytz.UnknownTimeZoneError:
+        return None
+
+# Calculate standard timezone from longitude, return a timezone.timezone object
+def get_std_timezone(lng):
+    hours = lng // 15
+    if ((lng % 15) > 7.5): hours = hours + 1
+    return datetime.timezone(datetime.timedelta(hours=hours))
+
+# Return the timezone of a geolocation: a pytz timezone when it can be found,
+# otherwise the standard timezone from the longitude
+def get_timezone(lat, lon):
+    return timezone_of(timezone_name(lat, lon), lon)
+
+# Return the timezone of a timezone name found by timezone_name(): a pytz timezone
+# when pytz has it, otherwise the standard timezone from the longitude
+def timezone_of(tz_str, lon):
+    if (tz_str != None):   # find a location in TimezoneFinder's database
+        tz = get_pytz(tz_str)
+        if (tz != None):   # everything is OK
+            return tz
+    return get_std_timezone(lon)  # have to use a standard time zone
+
+# Return a local datetime of the timezone, pytz timezone is handled
+def localize(tz, year, month, day, hour=12):
+    if isinstance(tz, datetime.tzinfo) and hasattr(tz, 'localize'):
+        # NOTE: pytz's tz cannot be used in datetime.datetime() constructor
+        return tz.localize(datetime.datetime(year, month, day, hour=hour))
+    return datetime.datetime(year, month, day, hour=hour, tzinfo=tz)
+
+# Get timezone, datetime objects of the noon of the specified local date
+# in local timezone and in UTC
+#   tz: the timezone when it is already known, like from a snapshot.Snapshot
+@timed('get_noons')
+def get_noons(year, month, day, lat, lon, tz=None):
+    if tz is None:
+        tz = get_timezone(lat, lon)
+    d_local = localize(tz, year, month, day)
+    d_utc = d_local.astimezone(tz=datetime.timezone.utc)  # get an UTC one for the same datetime
+    return {'tz': tz, 'd_local': d_local, 'd_utc': d_utc}